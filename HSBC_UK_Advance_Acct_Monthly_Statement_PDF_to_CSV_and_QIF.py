@@ -8,12 +8,34 @@ __license__ = "GPL"
 __version__ = "1.0"
 __maintainer__ = "Squizzy"
 
-import pypdf
 import re
 import csv
+import functools
+import itertools
+import gzip
+import hashlib
+import heapq
+import inspect
+import io
+import json
+import mmap
 import os
+import select
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zipfile
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import Callable
+from typing import BinaryIO, Callable, Iterable, Iterator, TextIO
+
+# pypdf, tkinter and concurrent.futures are only imported by the functions needing them,
+# so that the command line starts fast when they are not needed (--help, --dry-run, ...)
 
 # from pprint import pprint
 
@@ -21,25 +43,101 @@ from typing import Callable
 # Constants
 
 INPUT_FOLDER = "Downloaded_PDF"
+# The PDFs can also be in zip archives, read without unpacking them, see the PDF input functions
+ARCHIVE_EXTENSION = ".zip"
+
+# Watch mode, see the watch mode functions
+WATCH_SETTLE_SECONDS = 0.5                     # a file is converted once it has not changed for this long (e.g. download complete)
+WATCH_POLL_INTERVAL = 0.5                      # seconds between two scans of the folder, when inotify is not available
+WATCH_IDLE_TIMEOUT = 1.0                       # seconds between two checks of the stop request, when nothing changes
 
 OUTPUT_FOLDER_GENERIC = "Converted_Files"
 
-OUTPUT_FOLDER_RAW = OUTPUT_FOLDER_GENERIC + "\\RAW"
+OUTPUT_FOLDER_RAW = os.path.join(OUTPUT_FOLDER_GENERIC, "RAW")
 OUTPUT_EXTENSION_RAW = ".txt"
 OUTPUT_FILENAME_RAW_COMBINED = "HSBC_raw_transactions_combined.txt"
 
-OUTPUT_FOLDER_CSV = OUTPUT_FOLDER_GENERIC + "\\CSV"
+OUTPUT_FOLDER_CSV = os.path.join(OUTPUT_FOLDER_GENERIC, "CSV")
 OUTPUT_EXTENSION_CSV = ".csv"
 OUTPUT_FILENAME_CSV_COMBINED = "HSBC_transactions_combined.csv"
 
-OUTPUT_FOLDER_MMX = OUTPUT_FOLDER_GENERIC + "\\MMX_CSV"
+OUTPUT_FOLDER_MMX = os.path.join(OUTPUT_FOLDER_GENERIC, "MMX_CSV")
 OUTPUT_EXTENSION_MMX = "-mmx.csv"
 OUTPUT_FILENAME_MMX_COMBINED = "HSBC_transactions_combined.mmx"
 
-OUTPUT_FOLDER_QIF = OUTPUT_FOLDER_GENERIC + "\\QIF"
+OUTPUT_FOLDER_QIF = os.path.join(OUTPUT_FOLDER_GENERIC, "QIF")
 OUTPUT_EXTENSION_QIF = ".qif"
 OUTPUT_FILENAME_QIF_COMBINED = "HSBC_transactions_combined.qif"
 
+# Record of the PDFs already converted, see the manifest functions
+MANIFEST_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_conversion_manifest.json")
+MANIFEST_JOURNAL_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_conversion_manifest.journal")
+
+# Output files are written under a temporary name, and renamed once complete
+OUTPUT_TEMPORARY_EXTENSION = ".part"
+OUTPUT_FILE_BUFFER_SIZE = 1024 * 1024          # bytes
+OUTPUT_ROWS_BATCH_SIZE = 500                   # transactions formatted and written at once
+
+# Fingerprints of the transactions of each statement, to leave the duplicates out of the combined files, see the duplicate transactions functions
+TRANSACTION_FINGERPRINTS_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_transaction_fingerprints.json")
+DUPLICATE_TRANSACTIONS_REPORT_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_duplicate_transactions.csv")
+
+# Database of the transactions of all the PDFs converted, see the ledger functions
+LEDGER_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_transactions_ledger.sqlite")
+# Base name of the files generated from a query of the ledger (with the extension of each format)
+LEDGER_QUERY_BASE_FILENAME = "HSBC_transactions_ledger_query"
+
+# Report of the time and memory spent in each stage of the conversion, see the stage metrics functions
+STAGE_METRICS_REPORT_FILENAME = os.path.join(OUTPUT_FOLDER_GENERIC, "HSBC_conversion_stage_metrics.json")
+STAGE_METRICS_REPORT_FIELDS = ["pdf", "stage", "calls", "items", "wall_seconds", "cpu_seconds", "peak_traced_memory_bytes", "pages", "wall_milliseconds_per_page"]
+STAGE_METRICS_ALL_PDF_FILES = "(all)"          # "pdf" of the rows totalling each stage over all the PDFs
+PROFILE_EXTENSION = ".prof"
+
+# Cache of the text extracted from the PDF pages, see load_lines_from_all_pages_from_PDF
+PAGE_TEXT_CACHE_FOLDER = os.path.join(OUTPUT_FOLDER_GENERIC, "Page_Text_Cache")
+PAGE_TEXT_CACHE_EXTENSION = ".json.gz"
+PAGE_TEXT_CACHE_MAX_SIZE = 200 * 1024 * 1024   # bytes. Least recently used entries are deleted beyond this
+PAGE_TEXT_CACHE_VERSION = 2                    # to increase with any change of the content of the entries
+
+# pypdf text extraction parameters
+# Any change invalidates the cached page text as the cache key includes them
+PDF_TEXT_EXTRACTION_PARAMETERS = {
+    "extraction_mode": "layout",
+    "layout_mode_space_vertically": False,
+    "layout_mode_scale_weight": 0.98,
+}
+
+# Text marking the start of transactions on a page, as found in the raw content stream of the page
+# (where words can be split and spaced by positioning operators instead of space characters)
+REGEX_TRANSACTION_PAGE_MARKER = re.compile(rb"BALANCE\s*BROUGHT\s*FORWARD")
+
+# Title of the line of the statement summary (first page) giving the balance at the end of the statement
+# Once a page carries this balance forward, the transactions are complete, see transaction_section_ends_on_PDF_page
+CLOSING_BALANCE_TITLE = "Closing Balance"
+
+# Strings shown in a page content stream: (literal) or <hexadecimal>
+REGEX_CONTENT_STREAM_STRING = re.compile(rb"\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>")
+
+# Font encodings for which the strings of the content stream are the text itself
+READABLE_FONT_ENCODINGS = ("/WinAnsiEncoding", "/MacRomanEncoding", "/StandardEncoding")
+
+# Coordinates text extraction engine (text_extraction_engine switch), see the coordinates text extraction functions
+# "adaptive": coordinates first, and the layout mode for the pages whose transactions do not reconcile with their balances
+TEXT_EXTRACTION_ENGINES = ("layout", "coordinates", "adaptive")
+COORDINATES_ROW_TOLERANCE = 2.0                # points. Text runs whose baselines are closer than this are on the same row
+COORDINATES_CELL_GAP = 0.6                     # font sizes. Text runs closer than this on a row are in the same cell
+COORDINATES_WORD_GAP = 0.1                     # font sizes. Text runs of a cell further apart than this are separate words
+COORDINATES_AVERAGE_CHARACTER_WIDTH = 500      # thousandths of the font size, for the characters whose width is not known
+COORDINATES_POINTS_PER_CHARACTER = 4.0         # horizontal position of the text out of the transactions table, in points per character
+COORDINATES_COLUMN_GAP = 3                     # characters between the columns of the transactions table
+
+# Most amounts moved to the other column (paid in or paid out) to make up the difference between two balances,
+# see place_amounts_by_balance_difference
+AMOUNTS_TO_MOVE_MAX = 3
+
+# Below this number of pages, a PDF is extracted by the current process even if page_extraction_workers is more than 1
+PARALLEL_PAGE_EXTRACTION_MIN_PAGES = 8
+
 
 #####
 # Switches
@@ -47,19 +145,35 @@ OUTPUT_FILENAME_QIF_COMBINED = "HSBC_transactions_combined.qif"
 output_generic_csv = True                   # Generate a CSV file of all the transactions                           
 output_mmx = False                          # Generate a CSV file of all the transactions, MoneyManagerEx compliant 
 output_qif = False                          # Generate a QIF file of all the transactions                           
+output_ledger = False                       # Load the transactions into the SQLite ledger database (LEDGER_FILENAME)
 use_mmx_header = True                       # if False, do not include header in the output CSV for MMX             
 combine_all_output_statements = False       # In folder selection mode, generate a file combining all transactions  
+skip_duplicate_transactions_in_combined_files = True # Leave out of the combined files the transactions already there from another (overlapping) statement
+combine_per_account = False                 # Generate the combined files of each account (sort code and account number) instead of one for all
+combine_in_date_order = True                # Combined files in date order (statements ordered by period, overlapping ones merged), instead of in the order of the PDF files
 cancel = False                              # cancel the execution of the program by the user                       
 
 # Application specific
-csv_writer_combined_header_present = False  # In a combined CSV file, do not re-add header every time a new file is added
-mmx_writer_combined_header_present = False  # In a combined CSV file, do not re-add header every time a new file is added
 file_generation_log_entry_already_displayed = False # Use to prevent display of overwhelming amount of useless log entries
 
+# Performance specific
+conversion_workers = 1                      # In folder selection mode, number of processes converting PDFs in parallel (1: one after the other)
+incremental_conversion = True               # In folder selection mode, only convert the PDFs new or changed since the last conversion
+skip_non_transaction_pages = True           # Do not run the layout extraction on pages without transactions (T&C, summary...) when this can be told cheaply
+stop_after_last_transaction_page = True     # Do not extract the pages after the one completing the transactions (T&C, interest rates...)
+text_extraction_engine = "adaptive"         # "layout": pypdf layout mode, "coordinates": the text placed by its coordinates in the page (see the coordinates text extraction functions),
+                                            # "adaptive": coordinates, checked by reconciling the balances of the page, layout mode if they do not reconcile
+line_parser_engine = "columns"              # "columns": split the lines at the column positions of the header row, "regex": LINE_DETAILS_EXTRACTION_REGEX
+page_extraction_workers = 1                 # Number of processes extracting the pages of one (long) PDF in parallel (1: one page after the other)
+use_page_text_cache = True                  # Reuse the text extracted from an unchanged PDF instead of extracting it again
+stream_conversion = True                    # Write each transaction as soon as it is final, extracting the pages one by one, instead of extracting the whole PDF first
+
 # Debug specific
 show_log = False                            # Display log messages to terminal if True
+collect_stage_metrics = False               # Record the time spent in each stage of the conversion, per PDF (see write_stage_metrics_report)
+trace_stage_memory = False                  # With collect_stage_metrics, also record the peak memory of each stage with tracemalloc (slows the conversion down)
+PDF_profiles_folder = ""                    # If set, save a cProfile profile of the conversion of each PDF in this folder
 output_raw = False                          # Generate a raw text file of all the transactions                      
-output_spaces_in_csv = False                # In Generic CSV, include columns with the spacing between details      
 
 
 #####
@@ -70,83 +184,101 @@ output_spaces_in_csv = False                # In Generic CSV, include columns wi
 REGEX_date = r"^(?P<date>\b\d{2}\s\w{3,4}\s\d{2}\b){0,10}"
 
 # PRESENTATIONAL SPACING:
-# 0 or more spaces
-REGEX_space1 = r"(?P<space1>\s{1,28})?"
+# Any number of spaces. Their width does not matter: the columns of the amounts are told by the balances
+# (see place_amount_in_the_credit_or_debit_column), not by the position of the amounts on the line
+REGEX_spacing = r"\s*"
 
 # TRANSACTION TYPE:
 # 2 or 3 upper case letters CR, SO, ... or ))) (supposedly, contactless payment)
 # REGEX_type = r'([A-Z\)]{2,3})?'
 # One of the choices of ATM, BP, CR, DD, DR, SO, VIS, \\\ - if any needs to be added, they can be separated with OR ( '|' )
-REGEX_type = r"(?P<type>ATM|BP|CR|DD|DR|SO|VIS|\)\)\))?"
+# followed by a space (or the end of the line), so that a detail starting like a type (e.g. VISA, CREDIT) is not taken for one
+REGEX_type = r"(?P<type>(?:ATM|BP|CR|DD|DR|SO|VIS|\)\)\))(?=\s|$))?"
 
-# PRESENTATIONAL SPACING:
-# 0 or more spaces
-REGEX_space2 = r"(?P<space2>\s{0,20})"
+# AMOUNT:
+# (Optional: One or more digit followed by a comma) | One or more digits | full stop | 2 digits
+REGEX_amount = r"(?:\d+,)*\d+\.\d{2}"
+
+# BALANCE:
+# An amount, followed by D (possibly after spaces) if overdrawn
+REGEX_balance = rf"{REGEX_amount}(?:\s*D\b)?"
 
 # TRANSACTION DETAIL:
-# Description: word boundary | one or more of a-z, A-Z, /, ., *, - | word boundary | (Optional, repeated 0 or more times: space|word boundary | one or more of a-z, A-Z, /, ., *, - | word boundary | Optional End of String)
-REGEX_detail = r"(?P<detail>(?:[a-zA-Z0-9\/\.\*\-\@\:]+(?:\s{0,5}))+)"
+# Words of one or more of a-z, A-Z, 0-9, /, ., *, -, @, : separated by spaces, up to the first word which is an amount
+REGEX_detail_word = r"[a-zA-Z0-9\/\.\*\-\@\:]+"
+REGEX_detail = rf"(?P<detail>{REGEX_detail_word}(?:\s+(?!{REGEX_amount}(?:\s|$)){REGEX_detail_word})*)"
 
-# OPTIONAL END OF STRING
-# Description: if the line ends right after the "detail" part, the end of the detail might not be caught if details has space in it
-# This is no longer a problem if we make the end optional so not even a space is expected after the detail
-REGEX_optional_start = r"(?:"
+# AMOUNTS (optional):
+# The amount of the transaction (in the paid out column until place_amount_in_the_credit_or_debit_column), then the balance if printed
+REGEX_amounts = rf"(?:\s+(?P<paid_out>{REGEX_amount})(?:\s+(?P<balance>{REGEX_balance}))?)?"
 
+#####
+# Combined regex to process a whole line in one go
 
-# PRESENTATIONAL SPACING:
-# (Optional 0 or more spaces)
-# Recorded as its amount of spaces should dictate whether an amount is a paid out or paid in
-# If a max size is specified, and the number is way further, the paid_out column will be skipped. 
-# Trial and error said 100 appears to works
-REGEX_space3 = r"(?P<space3>\s{1,100})"
+LINE_DETAILS_EXTRACTION_REGEX = (
+      REGEX_date
+    + REGEX_spacing
+    + REGEX_type
+    + REGEX_spacing
+    + REGEX_detail
+    + REGEX_amounts
+)
 
-# FIRST NUMBER ENCOUNTERED (can't get PAID_OUT as position on the line is not guaranteed:
-# (Optional: One or more digit followed by a comma) | One or more digits | (optional: full stop) | 0 or more digits - the whole thing happening 0 or once only
-# Again a max size helps allowing the paid_in amount to be reached. 50 selected as the position moves a lot depending on the lines
-REGEX_paid_out = r"(?P<paid_out>(?:\d+,)*\d+[\.]?\d{0,2}){0,50}"
+LINE_DETAILS_EXTRACTION_PATTERN = re.compile(LINE_DETAILS_EXTRACTION_REGEX)
 
-# PRESENTATIONAL SPACING:
-# (Optional: 0 or more spaces)
-# If more than 120 char, then it is probably a paid in amount
-# Again the max size helps allowing the paid_in amount to be reached
-REGEX_space4 = r"(?P<space4>\s{0,40})"
 
-# FIRST NUMBER ENCOUNTERED (can't get PAID_OUT as position on the line is not guaranteed:
-# (Optional: One or more digit followed by a comma) | One or more digits | (optional: full stop) | 0 or more digits - the whole thing happening 0 or once only
-REGEX_paid_in = r"(?P<paid_in>(?:\d+,)*\d+[\.]?\d{0,2})?"
+#####
+# Column positions for the "columns" line parser engine
+# Instead of the regex, the columns are located once per page from its header row,
+# then each line is sliced at these positions: amounts from the right, date, type and details on the left
 
-# PRESENTATIONAL SPACING:
-# (Optional: 0 or more spaces)
-# Again max size to allow to reach the balance column
-REGEX_space5 = r"(?P<space5>\s{0,30})"
+# Titles of the header row of the transactions table
+COLUMN_TITLE_DETAILS = "Payment type and details"
+COLUMN_TITLE_PAID_OUT = "Paid out"
+COLUMN_TITLE_PAID_IN = "Paid in"
+COLUMN_TITLE_BALANCE = "Balance"
 
-# FIRST NUMBER ENCOUNTERED (can't get PAID_OUT as position on the line is not guaranteed:
-# (Optional: One or more digit followed by a comma) | One or more digits | (optional: full stop) | 0 or more digits - the whole thing happening 0 or once only
-REGEX_balance = r"(?P<balance>(?:\d+,)*\d+[\.]?\d{0,2})?"
+REGEX_CELL_DATE = re.compile(r"\d{2}\s\w{3,4}\s\d{2}")
+# An overdrawn balance is followed by D, e.g. "1,234.56 D" (see get_amount_in_pence)
+OVERDRAWN_BALANCE_SUFFIX = "D"
+REGEX_CELL_AMOUNT = re.compile(r"(?:\d+,)*\d+\.\d{2}(?:\s*D\b)?")
+TRANSACTION_TYPES = ("ATM", "BP", "CR", "DD", "DR", "SO", "VIS", ")))")
 
-# OPTIONAL END OF STRING
-# Description: if the line ends right after the "detail" part, the end of the detail might not be caught if details has space in it
-# This is no longer a problem if we make the end optional so not even a space is expected after the detail
-REGEX_optional_end = r")?"
+# Amounts are right aligned, but can stick out of their column title by a few characters on the left
+COLUMN_AMOUNT_LEFT_MARGIN = 4
 
-#####
-# Combined regex to process a whole line in one go
+# Statement header, above the transactions table: the sort code and account number (on the same line) and the statement period
+# (e.g. "1 January to 31 January 2020", or "15 December 2019 to 14 January 2020")
+REGEX_SORT_CODE_AND_ACCOUNT_NUMBER = re.compile(r"\b(\d{2}-\d{2}-\d{2})\s+(\d{8})\b")
+REGEX_STATEMENT_PERIOD = re.compile(r"\b(\d{1,2}) ([A-Z][a-z]+)(?: (\d{4}))? to (\d{1,2}) ([A-Z][a-z]+) (\d{4})\b")
 
-LINE_DETAILS_EXTRACTION_REGEX = (
-      REGEX_date
-    + REGEX_space1
-    + REGEX_type
-    + REGEX_space2
-    + REGEX_detail
-    + REGEX_optional_start
-    + REGEX_space3
-    + REGEX_paid_out
-    + REGEX_space4
-    + REGEX_paid_in
-    + REGEX_space5
-    + REGEX_balance
-    + REGEX_optional_end
-)
+
+#####
+# One transaction (line) of the PDF, as it goes through the conversion steps
+# Each step updates the transactions in place, instead of copying them
+@dataclass(slots=True)
+class Transaction:
+    date: str | None = None
+    type: str | None = None
+    detail: str | None = None
+    paid_out: str | None = None
+    paid_in: str | None = None
+    balance: str | None = None
+    # In pence, paid in as positive value, paid out as negative value. Set by change_amounts_to_one_column_with_pos_or_neg_values
+    amount: int | None = None
+
+# Account and period of a statement, from the header of its first page (see parse_statement_metadata). Dates as YYYY-MM-DD
+@dataclass(slots=True)
+class StatementMetadata:
+    sort_code: str | None = None
+    account_number: str | None = None
+    period_start: str | None = None
+    period_end: str | None = None
+
+    # Account of the statement, as in the names of its combined files
+    @property
+    def account(self) -> str:
+        return f"{self.sort_code}_{self.account_number}" if self.account_number else "unknown_account"
 
 
 # def log(func_name: str, mesage: str) -> None:
@@ -155,20 +287,201 @@ def log(message: str) -> None:
         logtime = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         print(f"[{logtime}] {message}")
 
-def log_wrapper(func: Callable) -> Callable:
-    def wrapper(*args, **kwargs):
-        func_name = func.__name__
-        log(f"-- FUNCTION STARTED: {func_name}")
-        result = func(*args, **kwargs)
-        log(f"-- FUNCTION ENDED: {func_name}\n")
-        return result
-    return wrapper
+# Counts reported at the end of the conversion (e.g. pages skipped), by name
+conversion_statistics: dict[str, int] = {}
+
+def count_statistic(name: str, count: int = 1) -> None:
+    conversion_statistics[name] = conversion_statistics.get(name, 0) + count
+
+def report_conversion_statistics(report_stream: TextIO | None = None) -> None:
+    for name, count in conversion_statistics.items():
+        print(f"{name}: {count}", file=report_stream)
+
+#####
+# Stage metrics functions
+# Wall time, CPU time and peak memory of each stage of the conversion (load, separate, parse, recombine, date-fill, each writer...), per PDF.
+# A stage only counts its own time, not the time of the stages it calls or pulls transactions from, so the stages add up to the run
+
+# By (PDF file, stage): [calls, items yielded or written (pages, transactions...), wall time, CPU time, peak traced memory]
+stage_metrics: dict[tuple[str, str], list] = {}
+# Stages running, the innermost last, and the (wall, CPU) time at which they were last charged
+stage_metrics_stack: list[str] = []
+stage_metrics_clock = (0.0, 0.0)
+# PDF the running stages are counted for ("" outside of the conversion of a PDF)
+stage_metrics_PDF_file = ""
+
+def get_stage_metrics(stage: str) -> list:
+    metrics = stage_metrics.get((stage_metrics_PDF_file, stage))
+    if metrics is None:
+        metrics = stage_metrics[(stage_metrics_PDF_file, stage)] = [0, 0, 0.0, 0.0, 0]
+    return metrics
+
+# Add the metrics of a stage to another (e.g. of a worker process to the ones of the parent process)
+def merge_stage_metrics(metrics: list, other_metrics: list) -> None:
+    for index in range(4):
+        metrics[index] += other_metrics[index]
+    metrics[4] = max(metrics[4], other_metrics[4])
+
+# Charge the time (and peak memory) since the last change of stage to the innermost stage running
+def charge_current_stage() -> None:
+    global stage_metrics_clock
+
+    wall_time, CPU_time = time.perf_counter(), time.process_time()
+    if stage_metrics_stack:
+        metrics = get_stage_metrics(stage_metrics_stack[-1])
+        metrics[2] += wall_time - stage_metrics_clock[0]
+        metrics[3] += CPU_time - stage_metrics_clock[1]
+        if tracemalloc.is_tracing():
+            metrics[4] = max(metrics[4], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+    stage_metrics_clock = (wall_time, CPU_time)
+
+# A stage running within the same stage (e.g. a list function going through its generator) is not counted as another call
+def enter_stage(stage: str, calls: int = 1) -> None:
+    charge_current_stage()
+    if not stage_metrics_stack or stage_metrics_stack[-1] != stage:
+        get_stage_metrics(stage)[0] += calls
+    stage_metrics_stack.append(stage)
+
+def leave_stage(items: int = 0) -> None:
+    charge_current_stage()
+    get_stage_metrics(stage_metrics_stack.pop())[1] += items
+
+# The stages running from now are counted for this PDF
+def set_stage_metrics_PDF_file(PDF_file: str) -> None:
+    global stage_metrics_PDF_file
+
+    if collect_stage_metrics:
+        charge_current_stage()
+    stage_metrics_PDF_file = PDF_file
+
+# Time a block of code as a stage, items being the number of items (e.g. transactions) it processes
+@contextmanager
+def measure_stage(stage: str, items: int = 0) -> Iterator[None]:
+    if not collect_stage_metrics:
+        yield
+        return
+
+    enter_stage(stage)
+    try:
+        yield
+    finally:
+        leave_stage(items)
+
+# Time each step of an iterator as a stage, counting the items it yields
+def iterate_in_stage(stage: str, iterator: Iterator) -> Iterator:
+    calls = 1
+    while True:
+        enter_stage(stage, calls)
+        calls = 0
+        try:
+            item = next(iterator)
+        except StopIteration:
+            leave_stage()
+            return
+        except BaseException:
+            leave_stage()
+            raise
+        leave_stage(1)
+        yield item
+
+# Decorator of the functions of a stage: log their start and end if show_log, and record their metrics if collect_stage_metrics
+# For a generator function, it is the iteration of the generator which is timed (the log would not tell anything useful)
+# Nothing is formatted or timed when neither is set
+def measured_stage(stage: str) -> Callable[[Callable], Callable]:
+    def decorator(func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                iterator = func(*args, **kwargs)
+                return iterate_in_stage(stage, iterator) if collect_stage_metrics else iterator
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if show_log:
+                log(f"-- FUNCTION STARTED: {func.__name__}")
+
+            if collect_stage_metrics:
+                enter_stage(stage)
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    leave_stage()
+            else:
+                result = func(*args, **kwargs)
+
+            if show_log:
+                log(f"-- FUNCTION ENDED: {func.__name__}\n")
+            return result
+        return wrapper
+    return decorator
+
+# Rows of the stage metrics report: each stage of each PDF, then each stage over all the PDFs
+# The pages of a PDF are the ones its "load" stage yielded
+def get_stage_metrics_report_rows() -> list[dict[str, str | int | float | None]]:
+    stage_metrics_by_PDF: dict[str, dict[str, list]] = {}
+    stage_metrics_totals: dict[str, list] = {}
+
+    for (PDF_file, stage), metrics in stage_metrics.items():
+        stage_metrics_by_PDF.setdefault(PDF_file, {})[stage] = metrics
+        merge_stage_metrics(stage_metrics_totals.setdefault(stage, [0, 0, 0.0, 0.0, 0]), metrics)
+    stage_metrics_by_PDF[STAGE_METRICS_ALL_PDF_FILES] = stage_metrics_totals
+
+    report_rows: list[dict[str, str | int | float | None]] = []
+    for PDF_file, PDF_stage_metrics in stage_metrics_by_PDF.items():
+        pages = PDF_stage_metrics["load"][1] if "load" in PDF_stage_metrics else 0
+        for stage, (calls, items, wall_time, CPU_time, peak_memory) in PDF_stage_metrics.items():
+            report_rows.append({
+                "pdf": PDF_file,
+                "stage": stage,
+                "calls": calls,
+                "items": items,
+                "wall_seconds": round(wall_time, 6),
+                "cpu_seconds": round(CPU_time, 6),
+                "peak_traced_memory_bytes": peak_memory or None,
+                "pages": pages,
+                "wall_milliseconds_per_page": round(wall_time * 1000 / pages, 3) if pages else None,
+            })
+
+    return report_rows
+
+# Write the stage metrics as JSON, or as (tab separated) CSV if the file name ends with .csv
+def write_stage_metrics_report(report_filename: str) -> None:
+    report_rows = get_stage_metrics_report_rows()
+
+    with open(report_filename, "w", encoding="utf-8", newline="") as report_file:
+        if report_filename.lower().endswith(".csv"):
+            csv_writer = csv.DictWriter(report_file, STAGE_METRICS_REPORT_FIELDS, delimiter="\t")
+            csv_writer.writeheader()
+            csv_writer.writerows(report_rows)
+        else:
+            json.dump({"stages": report_rows}, report_file, indent=1)
+
+# Save a cProfile profile of the conversion of a PDF in PDF_profiles_folder, if set
+# Named as the individual files of the PDF (see get_output_base_filename), so that PDFs of the same name do not share a profile
+@contextmanager
+def profile_PDF_conversion(SelectedFile: str) -> Iterator[None]:
+    if not PDF_profiles_folder:
+        yield
+        return
+
+    import cProfile
+
+    PDF_profile = cProfile.Profile()
+    PDF_profile.enable()
+    try:
+        yield
+    finally:
+        PDF_profile.disable()
+        os.makedirs(PDF_profiles_folder, exist_ok=True)
+        PDF_profile.dump_stats(os.path.join(PDF_profiles_folder, get_output_base_filename(SelectedFile) + PROFILE_EXTENSION))
 
 #####
 # Preparation steps functions
 
 # open a popup to find and select the file to process
-@log_wrapper
+@measured_stage("selection window")
 def select_input_file_or_folder() -> tuple[str, str]:
     log("Selecting a file or a folder")
     import tkinter as tk
@@ -194,7 +507,7 @@ def select_input_file_or_folder() -> tuple[str, str]:
         nonlocal file_path
         nonlocal file_name
         file_selected = filedialog.askopenfilename(
-            title="select file", initialdir=".", filetypes=[("PDF files", "*.pdf")]
+            title="select file", initialdir=".", filetypes=[("PDF files", "*.pdf"), ("Zip archives of PDF files", "*" + ARCHIVE_EXTENSION)]
         )
         file_path = os.path.dirname(file_selected)
         file_name = os.path.basename(file_selected)
@@ -245,7 +558,7 @@ def select_input_file_or_folder() -> tuple[str, str]:
     return file_path, file_name
 
 # check if user cancelled the process
-@log_wrapper
+@measured_stage("selection window")
 def user_cancelled(selected_path: str) -> bool:
     log("Checking if user cancelled")
     if not selected_path:
@@ -254,7 +567,7 @@ def user_cancelled(selected_path: str) -> bool:
     return False
         
 # create output folders
-@log_wrapper
+@measured_stage("output folders")
 def create_output_folders() -> None:
     log("Creating required output folders")
     
@@ -274,283 +587,1277 @@ def create_output_folders() -> None:
         os.makedirs(OUTPUT_FOLDER_QIF)
 
 
+#####
+# PDF input functions
+# A PDF is given by its file name or, for a PDF in a zip archive, by the archive file name followed by the name
+# of the PDF in the archive (e.g. Downloaded_PDF/Statements_2023.zip/2023/January.pdf)
+
+# Zip archives opened by this process, by file name. Worker processes open their own, so as not to share a file position
+PDF_archives: dict[str, tuple[tuple[int, int], zipfile.ZipFile]] = {}
+PDF_archives_process_id = os.getpid()
+
+# Archive file name and name of the PDF (or folder) in the archive, None if not in a zip archive
+def split_PDF_archive_member(PDF_filename: str) -> tuple[str, str] | None:
+    PDF_filename_parts = os.path.normpath(PDF_filename).split(os.sep)
+
+    for index, PDF_filename_part in enumerate(PDF_filename_parts[:-1], 1):
+        if PDF_filename_part.lower().endswith(ARCHIVE_EXTENSION):
+            archive_filename = os.sep.join(PDF_filename_parts[:index])
+            if os.path.isfile(archive_filename):
+                return archive_filename, "/".join(PDF_filename_parts[index:])
+
+    return None
+
+# Open zip archive, opened again if it changed since
+def get_PDF_archive(archive_filename: str) -> zipfile.ZipFile:
+    global PDF_archives_process_id
+
+    if PDF_archives_process_id != os.getpid():
+        PDF_archives.clear()
+        PDF_archives_process_id = os.getpid()
+
+    archive_stat = os.stat(archive_filename)
+    archive_version = (archive_stat.st_size, archive_stat.st_mtime_ns)
+
+    if archive_filename in PDF_archives:
+        opened_archive_version, PDF_archive = PDF_archives[archive_filename]
+        if opened_archive_version == archive_version:
+            return PDF_archive
+        PDF_archive.close()
+
+    PDF_archive = zipfile.ZipFile(archive_filename)
+    PDF_archives[archive_filename] = (archive_version, PDF_archive)
+    return PDF_archive
+
+# Whether a PDF file, a folder, a zip archive or a PDF (or folder) in a zip archive exists
+def PDF_source_exists(path: str) -> bool:
+    if os.path.exists(path):
+        return True
+
+    archive_member = split_PDF_archive_member(path)
+    if archive_member is None:
+        return False
+
+    archive_filename, member_name = archive_member
+    return any(name == member_name or name.startswith(member_name + "/") for name in get_PDF_archive(archive_filename).namelist())
+
+# Size and modification time (in ns) of a PDF, to tell whether it changed since its last conversion
+def get_PDF_size_and_time(PDF_filename: str) -> tuple[int, int]:
+    archive_member = split_PDF_archive_member(PDF_filename)
+    if archive_member is None:
+        PDF_stat = os.stat(PDF_filename)
+        return PDF_stat.st_size, PDF_stat.st_mtime_ns
+
+    archive_filename, member_name = archive_member
+    member_info = get_PDF_archive(archive_filename).getinfo(member_name)
+    return member_info.file_size, int(datetime(*member_info.date_time).timestamp()) * 1_000_000_000
+
+# Open a PDF as a binary stream
+def open_PDF(PDF_filename: str) -> BinaryIO:
+    archive_member = split_PDF_archive_member(PDF_filename)
+    if archive_member is None:
+        return open(PDF_filename, "rb")
+
+    archive_filename, member_name = archive_member
+    return get_PDF_archive(archive_filename).open(member_name)
+
+# Content of a PDF for the extraction, for the time of the with block: a PDF file is memory mapped, so only the parts
+# pypdf reads are read from the disk, without being copied. A PDF in a zip archive is uncompressed in memory, never to the disk
+@contextmanager
+def read_PDF(PDF_filename: str) -> Iterator[bytes | mmap.mmap]:
+    if split_PDF_archive_member(PDF_filename) is not None:
+        with open_PDF(PDF_filename) as PDF_file:
+            PDF_bytes = PDF_file.read()
+        yield PDF_bytes
+        return
+
+    with open(PDF_filename, "rb") as PDF_file:
+        # An empty file cannot be mapped
+        if not os.fstat(PDF_file.fileno()).st_size:
+            yield b""
+            return
+        PDF_map = mmap.mmap(PDF_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        yield PDF_map
+    finally:
+        PDF_map.close()
+
+# PDFs of a zip archive, only the ones in a folder of the archive if given, sorted by name, as (selected folder, path of the PDF
+# in the selected folder): the selected folder is the one containing the archive if given, otherwise the archive itself
+def find_PDF_files_in_archive(archive_filename: str, archive_folder: str = "", selected_folder: str | None = None) -> list[tuple[str, str]]:
+    pdf_files: list[tuple[str, str]] = []
+
+    for member_name in sorted(get_PDF_archive(archive_filename).namelist()):
+        if not member_name.endswith(".pdf") or member_name.startswith("__MACOSX/"):
+            continue
+        if archive_folder and member_name != archive_folder and not member_name.startswith(archive_folder.rstrip("/") + "/"):
+            continue
+
+        PDF_filename = os.path.join(archive_filename, *member_name.split("/"))
+        pdf_files.append((selected_folder or archive_filename, os.path.relpath(PDF_filename, selected_folder or archive_filename)))
+
+    return pdf_files
+
+
+#####
+# Coordinates text extraction functions
+# Alternative to the pypdf layout mode (text_extraction_engine = "coordinates"): the text runs of a page are collected with their
+# position, grouped into rows by their baseline, and the cells of the rows of the transactions table are assigned to the columns
+# of the table by their position in points. The line parsers take these cells as they are (see PDFTableLine), without reading
+# them back from the text. Their text is only written for the raw output and the page text cache, in a fixed layout: each
+# column at the same character position on every row of the page, amounts right aligned.
+# The text runs are read straight from the content stream, which only works when its strings are the text itself: i.e. only
+# for the simple fonts (Type1, TrueType) not embedded, or with the standard, WinAnsi or MacRoman encoding, and no text drawn in
+# form XObjects. The fonts embedded without such encoding (e.g. subsets with their own encoding), composite fonts (Type0, CID
+# keyed) and Type3 fonts are not decoded: the pages using any of them are extracted with the layout mode instead, whichever the
+# text extraction engine, and counted in the report at the end (see extract_lines_from_PDF_page). (The pypdf text extraction
+# visitor reports the cells of a row drawn in the same text object as a single run, without their positions)
+
+# One text run of a page: position of its start and end on the baseline, in points
+@dataclass(slots=True)
+class PDFTextRun:
+    x: float
+    y: float
+    x_end: float
+    text: str
+    font_size: float
+
+# Line of the transactions table extracted from the coordinates: its text, as any other line, and its cells (date, details,
+# paid out, paid in, balance), read by the line parsers instead of its text (see convert_table_line_into_a_transaction)
+class PDFTableLine(str):
+    cells: list[str]
+
+    def __new__(cls, text: str, cells: list[str]) -> "PDFTableLine":
+        PDF_table_line = super().__new__(cls, text)
+        PDF_table_line.cells = cells
+        return PDF_table_line
+
+    # The cells are kept when the line is sent back by the page extraction worker processes
+    def __getnewargs__(self) -> tuple[str, list[str]]:
+        return str(self), self.cells
+
+# Tokens of a content stream: strings (one level of nested parentheses), arrays, names, numbers, operators, comments
+REGEX_CONTENT_STREAM_TOKEN = re.compile(
+    rb"\((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)|<<|>>|<[0-9A-Fa-f\s]*>|\[|\]|/[^\s/\[\]()<>{}%]*"
+    rb"|[-+]?(?:\d+\.?\d*|\.\d+)|[A-Za-z'\"*][A-Za-z0-9*]*|%[^\r\n]*"
+)
+REGEX_CONTENT_STREAM_STRING_ESCAPE = re.compile(rb"\\([0-7]{1,3}|\r\n|.)", re.DOTALL)
+CONTENT_STREAM_STRING_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"\r\n": b"", b"\n": b"", b"\r": b""}
+
+# Python codec of each font encoding whose strings are the text itself (see READABLE_FONT_ENCODINGS)
+FONT_ENCODING_CODECS = {"/WinAnsiEncoding": "cp1252", "/MacRomanEncoding": "mac_roman", "/StandardEncoding": "cp1252"}
+
+# Multiply two PDF transformation matrices (a, b, c, d, e, f)
+def multiply_PDF_matrices(m1: tuple[float, ...], m2: tuple[float, ...]) -> tuple[float, ...]:
+    return (
+        m1[0] * m2[0] + m1[1] * m2[2], m1[0] * m2[1] + m1[1] * m2[3],
+        m1[2] * m2[0] + m1[3] * m2[2], m1[2] * m2[1] + m1[3] * m2[3],
+        m1[4] * m2[0] + m1[5] * m2[2] + m2[4], m1[4] * m2[1] + m1[5] * m2[3] + m2[5],
+    )
+
+# Width of each character of a font in thousandths of the font size, the average width for the ones not known
+# Only for the fonts of the pages whose content stream is readable (see PDF_page_content_stream_is_readable): the characters are
+# looked up as decoded with the codec of the encoding of the font, not through a custom encoding or a ToUnicode map
+def get_font_character_widths(font) -> Callable[[str], float]:
+    try:
+        from pypdf.generic import Font
+
+        character_widths = Font.from_font_resource(font).character_widths
+    except Exception:
+        # Older pypdf, or font not interpretable
+        character_widths = {}
+    default_width = character_widths.get("default") or COORDINATES_AVERAGE_CHARACTER_WIDTH
+
+    return lambda text: sum(character_widths.get(character, default_width) for character in text)
+
+# Bytes of a literal string of a content stream, escapes resolved
+def decode_content_stream_literal_string(literal_string: bytes) -> bytes:
+    def unescape(escape: re.Match) -> bytes:
+        escaped = escape.group(1)
+        if escaped[:1].isdigit():
+            return bytes([int(escaped, 8) & 0xFF])
+        return CONTENT_STREAM_STRING_ESCAPES.get(escaped, escaped)
+
+    return REGEX_CONTENT_STREAM_STRING_ESCAPE.sub(unescape, literal_string[1:-1])
+
+# Text runs of a page, read from its content stream. None if the content stream uses what is not supported (e.g. inline images)
+# Only for pages whose content stream strings are the text itself, see PDF_page_content_stream_is_readable: the strings are
+# decoded with the codec of the encoding of the font (FONT_ENCODING_CODECS), never through a ToUnicode map or a font program
+def get_text_runs_from_PDF_page_content_stream(PDF_page) -> list[PDFTextRun] | None:
+    PDF_page_contents = PDF_page.get_contents()
+    if PDF_page_contents is None:
+        return []
+
+    fonts = PDF_page["/Resources"].get_object().get("/Font")
+    fonts = fonts.get_object() if fonts is not None else {}
+    fonts_widths: dict[str, tuple[Callable[[str], float], str]] = {}
+
+    text_runs: list[PDFTextRun] = []
+    operands: list = []
+    array: list | None = None
+    graphics_states: list[tuple[float, ...]] = []
+    identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    ctm = text_matrix = line_matrix = identity
+    font_widths, font_codec = (lambda text: len(text) * COORDINATES_AVERAGE_CHARACTER_WIDTH), "cp1252"
+    font_size = character_spacing = word_spacing = leading = 0.0
+    horizontal_scaling = 1.0
+
+    # Show a string at the current position, then move the position after it
+    def show(string: bytes) -> None:
+        nonlocal text_matrix
+        text = string.decode(font_codec, errors="replace")
+        advance = (font_widths(text) * font_size / 1000 + character_spacing * len(text) + word_spacing * text.count(" ")) * horizontal_scaling
+        start = multiply_PDF_matrices(text_matrix, ctm)
+        text_matrix = multiply_PDF_matrices((1.0, 0.0, 0.0, 1.0, advance, 0.0), text_matrix)
+        end = multiply_PDF_matrices(text_matrix, ctm)
+        if text.strip():
+            text_runs.append(PDFTextRun(start[4], start[5], end[4], text, abs(font_size * start[3])))
+
+    def move_to_next_line(tx: float, ty: float) -> None:
+        nonlocal text_matrix, line_matrix
+        line_matrix = text_matrix = multiply_PDF_matrices((1.0, 0.0, 0.0, 1.0, tx, ty), line_matrix)
+
+    for token in REGEX_CONTENT_STREAM_TOKEN.findall(PDF_page_contents.get_data()):
+        first = token[:1]
+
+        # Operands
+        if first == b"(":
+            operand: object = decode_content_stream_literal_string(token)
+        elif first == b"<" and token != b"<<":
+            operand = bytes.fromhex(token[1:-1].decode("ascii"))
+        elif first in b"+-.0123456789":
+            operand = float(token)
+        elif first == b"/":
+            operand = token.decode("latin-1")
+        elif token == b"[":
+            array = []
+            continue
+        elif token == b"]":
+            operands.append(array or [])
+            array = None
+            continue
+        elif first == b"%" or token in (b"<<", b">>"):
+            continue
+        else:
+            operand = None
+
+        if operand is not None:
+            if array is not None:
+                array.append(operand)
+            else:
+                operands.append(operand)
+            continue
+
+        # Operators
+        try:
+            if token == b"q":
+                graphics_states.append(ctm)
+            elif token == b"Q":
+                ctm = graphics_states.pop() if graphics_states else identity
+            elif token == b"cm":
+                ctm = multiply_PDF_matrices(tuple(operands[-6:]), ctm)
+            elif token == b"BT":
+                text_matrix = line_matrix = identity
+            elif token == b"Tf":
+                font_name, font_size = operands[-2], operands[-1]
+                if font_name not in fonts_widths:
+                    font = fonts.get(font_name)
+                    font = font.get_object() if font is not None else {}
+                    encoding = font.get("/Encoding")
+                    fonts_widths[font_name] = (get_font_character_widths(font), FONT_ENCODING_CODECS.get(encoding.get_object() if encoding is not None else "", "cp1252"))
+                font_widths, font_codec = fonts_widths[font_name]
+            elif token == b"Tc":
+                character_spacing = operands[-1]
+            elif token == b"Tw":
+                word_spacing = operands[-1]
+            elif token == b"Tz":
+                horizontal_scaling = operands[-1] / 100
+            elif token == b"TL":
+                leading = operands[-1]
+            elif token == b"Td":
+                move_to_next_line(operands[-2], operands[-1])
+            elif token == b"TD":
+                leading = -operands[-1]
+                move_to_next_line(operands[-2], operands[-1])
+            elif token == b"Tm":
+                line_matrix = text_matrix = tuple(operands[-6:])
+            elif token == b"T*":
+                move_to_next_line(0.0, -leading)
+            elif token == b"Tj":
+                show(operands[-1])
+            elif token == b"'":
+                move_to_next_line(0.0, -leading)
+                show(operands[-1])
+            elif token == b'"':
+                word_spacing, character_spacing = operands[-3], operands[-2]
+                move_to_next_line(0.0, -leading)
+                show(operands[-1])
+            elif token == b"TJ":
+                for element in operands[-1]:
+                    if isinstance(element, bytes):
+                        show(element)
+                    else:
+                        text_matrix = multiply_PDF_matrices((1.0, 0.0, 0.0, 1.0, -element / 1000 * font_size * horizontal_scaling, 0.0), text_matrix)
+            elif token in (b"BI", b"ID"):
+                # Inline image: its data cannot be told from the operators
+                return None
+        except (IndexError, TypeError, ValueError):
+            # Operands missing or not the ones expected
+            return None
+
+        operands = []
+
+    return text_runs
+
+# Rows of text runs of a page, from the top of the page, each row from the left, the runs close to each other merged into cells
+def group_text_runs_into_rows(text_runs: list[PDFTextRun]) -> list[list[PDFTextRun]]:
+    rows: list[list[PDFTextRun]] = []
+
+    for text_run in sorted(text_runs, key=lambda text_run: (-text_run.y, text_run.x)):
+        if rows and abs(rows[-1][0].y - text_run.y) <= COORDINATES_ROW_TOLERANCE:
+            rows[-1].append(text_run)
+        else:
+            rows.append([text_run])
+
+    cells_rows: list[list[PDFTextRun]] = []
+    for row in rows:
+        cells: list[PDFTextRun] = []
+        for text_run in sorted(row, key=lambda text_run: text_run.x):
+            text = text_run.text.strip()
+            gap = text_run.x - cells[-1].x_end if cells else None
+            if gap is not None and gap < COORDINATES_CELL_GAP * text_run.font_size:
+                # Words shown separately are separated by a space, letters of a word (e.g. kerning) are not
+                separator = " " if gap > COORDINATES_WORD_GAP * text_run.font_size else ""
+                cells[-1].text += separator + text
+                cells[-1].x_end = max(cells[-1].x_end, text_run.x_end)
+            else:
+                cells.append(PDFTextRun(text_run.x, text_run.y, text_run.x_end, text, text_run.font_size))
+        cells_rows.append(cells)
+
+    return cells_rows
+
+# Position in points of the start and end of a column title in a row, None if not in the row
+def find_column_title_in_row(row: list[PDFTextRun], title: str) -> tuple[float, float] | None:
+    for cell in row:
+        title_start = cell.text.find(title)
+        if title_start > -1:
+            # Within a cell, the characters are taken as all the same width
+            character_width = (cell.x_end - cell.x) / len(cell.text)
+            return cell.x + title_start * character_width, cell.x + (title_start + len(title)) * character_width
+
+    return None
+
+# Line of a row whose cells are placed by their position, for the rows out of the transactions table
+def convert_row_into_line(row: list[PDFTextRun]) -> str:
+    line = ""
+    for cell in row:
+        position = round(cell.x / COORDINATES_POINTS_PER_CHARACTER)
+        line += " " * max(position - len(line), 1 if line else 0) + cell.text
+    return line
+
+# Lines of a page from the positions of its text: the rows of the transactions table (below the header row) in a fixed layout
+def convert_rows_into_lines(rows: list[list[PDFTextRun]]) -> list[str]:
+    PDF_page_lines: list[str] = []
+    header_row_index = None
+
+    for row_index, row in enumerate(rows):
+        titles = [find_column_title_in_row(row, title) for title in (COLUMN_TITLE_DETAILS, COLUMN_TITLE_PAID_OUT, COLUMN_TITLE_PAID_IN, COLUMN_TITLE_BALANCE)]
+        if all(titles) and titles[0][0] < titles[1][0] < titles[2][0] < titles[3][0]:
+            header_row_index = row_index
+            break
+
+    if header_row_index is None:
+        return [convert_row_into_line(row) for row in rows]
+
+    PDF_page_lines.extend(convert_row_into_line(row) for row in rows[:header_row_index])
+    details_title, paid_out_title, paid_in_title, balance_title = titles
+    amount_titles_ends = [paid_out_title[1], paid_in_title[1], balance_title[1]]
+
+    # Cells of each row of the table: date, details, paid out, paid in, balance
+    table_rows: list[list[str]] = []
+    for row in rows[header_row_index + 1:]:
+        table_row = ["", "", "", "", ""]
+        for cell in row:
+            if cell.x_end > paid_out_title[0] and REGEX_CELL_AMOUNT.fullmatch(cell.text):
+                # Right aligned amounts belong to the column whose title end is the closest to theirs
+                column = 2 + min(range(3), key=lambda amount_column: abs(amount_titles_ends[amount_column] - cell.x_end))
+            elif cell.text == OVERDRAWN_BALANCE_SUFFIX and cell.x > balance_title[0]:
+                # D of an overdrawn balance, printed apart
+                column = 4
+            elif cell.x < details_title[0] - COORDINATES_ROW_TOLERANCE:
+                column = 0
+            else:
+                column = 1
+            table_row[column] = f"{table_row[column]} {cell.text}".strip()
+        table_rows.append(table_row)
+
+    # Each column is as wide as its longest cell (or title), plus a gap
+    details_start = max([len(table_row[0]) for table_row in table_rows] + [len("Date")]) + COORDINATES_COLUMN_GAP
+    details_end = details_start + max([len(table_row[1]) for table_row in table_rows] + [len(COLUMN_TITLE_DETAILS)])
+    amounts_width = max([len(amount) for table_row in table_rows for amount in table_row[2:]] + [len(COLUMN_TITLE_PAID_OUT)]) + COORDINATES_COLUMN_GAP
+
+    def format_row(date: str, details: str, paid_out: str, paid_in: str, balance: str) -> str:
+        line = date.ljust(details_start) + details.ljust(details_end - details_start)
+        return (line + paid_out.rjust(amounts_width) + paid_in.rjust(amounts_width) + balance.rjust(amounts_width)).rstrip()
+
+    PDF_page_lines.append(format_row("Date", COLUMN_TITLE_DETAILS, COLUMN_TITLE_PAID_OUT, COLUMN_TITLE_PAID_IN, COLUMN_TITLE_BALANCE))
+    PDF_page_lines.extend(PDFTableLine(format_row(*table_row), table_row) for table_row in table_rows)
+
+    return PDF_page_lines
+
+# Lines of text of a page, from the positions of its text runs. None if they cannot be read from its content stream
+# Only for pages whose content stream is readable (see PDF_page_content_stream_is_readable), the others are left to the layout mode
+def extract_lines_from_PDF_page_with_coordinates(PDF_page) -> list[str] | None:
+    text_runs = get_text_runs_from_PDF_page_content_stream(PDF_page)
+    if text_runs is None:
+        return None
+
+    # An extracted page has at least one line, even if empty (see iterate_lines_from_PDF_bytes_pages)
+    return convert_rows_into_lines(group_text_runs_into_rows(text_runs)) or [""]
+
+
 #####
 # Extraction steps functions
-# load PDF pages into a list (of pages) containing a list of (pages lines) strings
-@log_wrapper
-def load_lines_from_all_pages_from_PDF(PDF_filename: str) -> list[list[str]]:
-    log("Loading PDF pages into a list of strings")
+# Key of a PDF in the page text cache: hash of the PDF content and of everything the extracted text depends on
+def get_page_text_cache_key(PDF_bytes: bytes | mmap.mmap) -> str:
+    from importlib.metadata import version
+
+    PDF_hash = hashlib.sha256(PDF_bytes).hexdigest()
+    extraction_parameters = json.dumps(
+        {**PDF_TEXT_EXTRACTION_PARAMETERS, "pypdf": version("pypdf"), "skip_non_transaction_pages": skip_non_transaction_pages,
+         "stop_after_last_transaction_page": stop_after_last_transaction_page, "text_extraction_engine": text_extraction_engine,
+         "cache_version": PAGE_TEXT_CACHE_VERSION},
+        sort_keys=True,
+    )
+    extraction_parameters_hash = hashlib.sha256(extraction_parameters.encode()).hexdigest()[:16]
+
+    return f"{PDF_hash}-{extraction_parameters_hash}"
+
+# Get the pages lines of a PDF from the cache, None if not cached
+# The lines of the transactions table extracted from the coordinates are stored with their cells, as [text, cells]
+def load_lines_from_page_text_cache(cache_key: str) -> list[list[str]] | None:
+    cache_filename = os.path.join(PAGE_TEXT_CACHE_FOLDER, cache_key + PAGE_TEXT_CACHE_EXTENSION)
+
+    try:
+        with gzip.open(cache_filename, "rt", encoding="utf-8") as cache_file:
+            PDF_pages_lines_list: list[list[str]] = [
+                [PDF_line if isinstance(PDF_line, str) else PDFTableLine(*PDF_line) for PDF_line in PDF_page_lines]
+                for PDF_page_lines in json.load(cache_file)
+            ]
+    except (OSError, ValueError, TypeError):
+        # not cached, or unreadable (e.g. partially deleted), so the PDF will be extracted again
+        return None
+
+    # The modification time records the last use, for the least recently used eviction
+    try:
+        os.utime(cache_filename)
+    except OSError:
+        pass
+
+    return PDF_pages_lines_list
+
+# Store the pages lines of a PDF in the cache, then keep the cache within its maximum size
+def save_lines_to_page_text_cache(cache_key: str, PDF_pages_lines_list: list[list[str]]) -> None:
+    os.makedirs(PAGE_TEXT_CACHE_FOLDER, exist_ok=True)
+    cache_filename = os.path.join(PAGE_TEXT_CACHE_FOLDER, cache_key + PAGE_TEXT_CACHE_EXTENSION)
+
+    # Written under a temporary name first so that other processes never read a partially written entry
+    temporary_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    with gzip.open(temporary_filename, "wt", encoding="utf-8") as cache_file:
+        json.dump([[[PDF_line, PDF_line.cells] if isinstance(PDF_line, PDFTableLine) else PDF_line for PDF_line in PDF_page_lines]
+                   for PDF_page_lines in PDF_pages_lines_list], cache_file)
+    os.replace(temporary_filename, cache_filename)
+
+    evict_least_recently_used_from_page_text_cache()
+
+# Delete the least recently used cache entries until the cache is within PAGE_TEXT_CACHE_MAX_SIZE
+def evict_least_recently_used_from_page_text_cache() -> None:
+    cache_entries: list[tuple[float, int, str]] = []
+
+    for entry in os.scandir(PAGE_TEXT_CACHE_FOLDER):
+        if entry.name.endswith(PAGE_TEXT_CACHE_EXTENSION):
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            cache_entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    cache_size = sum(size for _, size, _ in cache_entries)
+
+    for _, size, cache_filename in sorted(cache_entries):
+        if cache_size <= PAGE_TEXT_CACHE_MAX_SIZE:
+            break
+        log(f"Removing least recently used page text cache entry {os.path.basename(cache_filename)}")
+        try:
+            os.remove(cache_filename)
+        except OSError:
+            # Already removed by another process
+            pass
+        cache_size -= size
+
+# Check whether the strings in the content stream of a page are its text, i.e. no font re-encodes them and no text is in sub-streams
+# Readable: simple fonts (Type1, TrueType) with the standard, WinAnsi or MacRoman encoding, or not embedded and without encoding
+# Not readable: Type0 (composite, e.g. Identity-H) and Type3 fonts, encodings with differences, fonts embedded without encoding
+def PDF_page_content_stream_is_readable(PDF_page) -> bool:
+    resources = PDF_page.get("/Resources")
+    if resources is None:
+        return False
+    resources = resources.get_object()
+
+    XObjects = resources.get("/XObject")
+    if XObjects is not None:
+        for XObject in XObjects.get_object().values():
+            if XObject.get_object().get("/Subtype") == "/Form":
+                return False
+
+    fonts = resources.get("/Font")
+    if fonts is None:
+        return True
+
+    for font in fonts.get_object().values():
+        font = font.get_object()
+        if font.get("/Subtype") not in ("/Type1", "/TrueType"):
+            return False
+
+        encoding = font.get("/Encoding")
+        if encoding is None:
+            # Without encoding, only the standard (non embedded) fonts are known to use the standard encoding
+            if "/FontDescriptor" in font:
+                return False
+        elif encoding.get_object() not in READABLE_FONT_ENCODINGS:
+            return False
+
+    return True
+
+# Cheap check whether a page can contain transactions, to skip the costly layout extraction of the pages which cannot
+def PDF_page_may_contain_transactions(PDF_page) -> bool:
+    # If the content stream cannot be read as is, only the text extraction can tell
+    if not PDF_page_content_stream_is_readable(PDF_page):
+        return True
+
+    PDF_page_contents = PDF_page.get_contents()
+    if PDF_page_contents is None:
+        return False
+
+    PDF_page_strings: list[bytes] = []
+    for content_stream_string in REGEX_CONTENT_STREAM_STRING.findall(PDF_page_contents.get_data()):
+        if content_stream_string.startswith(b"<"):
+            PDF_page_strings.append(bytes.fromhex(content_stream_string[1:-1].decode("ascii")))
+        else:
+            PDF_page_strings.append(content_stream_string[1:-1])
+
+    return REGEX_TRANSACTION_PAGE_MARKER.search(b"".join(PDF_page_strings)) is not None
+
+# Extract the lines of text of one PDF page. No lines at all for a page skipped as it cannot contain transactions
+def extract_lines_from_PDF_page(PDF_page) -> list[str]:
+    if skip_non_transaction_pages and not PDF_page_may_contain_transactions(PDF_page):
+        return []
+
+    if text_extraction_engine in ("coordinates", "adaptive"):
+        # The pages whose fonts cannot be read from the content stream fall back to the layout mode, with either engine
+        if not PDF_page_content_stream_is_readable(PDF_page):
+            count_statistic("Pages extracted with the layout mode, fonts not readable from the content stream")
+        elif (PDF_page_lines := extract_lines_from_PDF_page_with_coordinates(PDF_page)) is None:
+            count_statistic("Pages extracted with the layout mode, content stream not supported")
+        elif text_extraction_engine == "coordinates":
+            return PDF_page_lines
+        elif PDF_page_balances_reconcile(PDF_page_lines):
+            count_statistic("Pages extracted from the coordinates, balances reconciled")
+            return PDF_page_lines
+        else:
+            count_statistic("Pages extracted again with the layout mode, balances not reconciled")
+
+    PDF_lines: str = PDF_page.extract_text(**PDF_TEXT_EXTRACTION_PARAMETERS)
+    return PDF_lines.split("\n")
+
+# Balance at the end of a line (e.g. balance brought forward) in pence, None if none
+def get_balance_at_end_of_line(PDF_line: str) -> int | None:
+    amounts = REGEX_CELL_AMOUNT.findall(PDF_line)
+    return get_amount_in_pence(amounts[-1]) if amounts else None
+
+# Balance brought forward on the first page of transactions in pence, from the non-transaction lines of the pages. None if none
+def find_balance_brought_forward(PDF_non_transactions_pages_lines: list[list[str]]) -> int | None:
+    for PDF_page_lines in PDF_non_transactions_pages_lines:
+        for PDF_line in PDF_page_lines:
+            if "BALANCE BROUGHT FORWARD" in PDF_line:
+                return get_balance_at_end_of_line(PDF_line)
+
+    return None
+
+# Check the transactions of a page against its balances: from the balance brought forward, adding each amount paid in and
+# taking off each amount paid out must give every balance printed, and the balance carried forward
+# A page with transactions but no balance to check them against does not reconcile
+def PDF_page_balances_reconcile(PDF_page_lines: list[str]) -> bool:
+    PDF_transaction_lines, PDF_non_transaction_lines = separate_transaction_lines_of_PDF_page(PDF_page_lines)
+
+    balance_brought_forward = balance_carried_forward = None
+    for PDF_line in PDF_non_transaction_lines:
+        if "BALANCE BROUGHT FORWARD" in PDF_line:
+            balance_brought_forward = get_balance_at_end_of_line(PDF_line)
+        elif "BALANCE CARRIED FORWARD" in PDF_line:
+            balance_carried_forward = get_balance_at_end_of_line(PDF_line)
+
+    # No transactions on the page
+    if not PDF_transaction_lines:
+        return True
+
+    columns = find_transaction_columns_in_PDF_page(PDF_non_transaction_lines)
+    if balance_brought_forward is None or columns is None:
+        return False
+
+    balance = balance_brought_forward
+    balances_checked = 0
+    for transaction in iterate_transactions_from_PDF_page_lines(PDF_transaction_lines, columns):
+        balance += get_amount_in_pence(transaction.paid_in) if transaction.paid_in else 0
+        balance -= get_amount_in_pence(transaction.paid_out) if transaction.paid_out else 0
+        if transaction.balance:
+            if get_amount_in_pence(transaction.balance) != balance:
+                return False
+            balances_checked += 1
+
+    if balance_carried_forward is not None:
+        if balance_carried_forward != balance:
+            return False
+        balances_checked += 1
+
+    return balances_checked > 0
+
+# Let pypdf forget the content streams of a page already extracted, which it would otherwise keep until the PDF is closed
+def release_PDF_page(PDF_file, PDF_page) -> None:
+    from pypdf.generic import ArrayObject, IndirectObject
+
+    if "/Contents" not in PDF_page:
+        return
+
+    PDF_page_contents = PDF_page.raw_get("/Contents")
+    content_streams = PDF_page_contents.get_object()
+    references = [PDF_page_contents] + (list(content_streams) if isinstance(content_streams, ArrayObject) else [])
+
+    for reference in references:
+        if isinstance(reference, IndirectObject):
+            PDF_file.resolved_objects.pop((reference.generation, reference.idnum), None)
+
+# PDF opened once by each page extraction worker process, see load_lines_from_all_pages_from_PDF_in_parallel
+page_extraction_worker_PDF_file = None
+
+# Page extraction worker process initialiser: open the PDF handed over by the parent process
+def open_PDF_in_page_extraction_worker(PDF_bytes: bytes, skip_non_transaction_pages_switch: bool, text_extraction_engine_switch: str) -> None:
+    import pypdf
+
+    global page_extraction_worker_PDF_file
+    global skip_non_transaction_pages
+    global text_extraction_engine
+
+    page_extraction_worker_PDF_file = pypdf.PdfReader(io.BytesIO(PDF_bytes))
+    skip_non_transaction_pages = skip_non_transaction_pages_switch
+    text_extraction_engine = text_extraction_engine_switch
+
+# Page extraction worker process task: extract the lines of a range of pages, returned with the statistics of their extraction
+def extract_lines_from_PDF_pages_in_worker(first_page: int, last_page: int) -> tuple[list[list[str]], dict[str, int]]:
     PDF_pages_lines_list: list[list[str]] = []
+    conversion_statistics.clear()
+
+    for page_number in range(first_page, last_page):
+        PDF_page = page_extraction_worker_PDF_file.pages[page_number]
+        PDF_pages_lines_list.append(extract_lines_from_PDF_page(PDF_page))
+        release_PDF_page(page_extraction_worker_PDF_file, PDF_page)
+
+    return PDF_pages_lines_list, dict(conversion_statistics)
+
+# Spread the extraction of the pages of one PDF over several processes, yielding the lines of the pages in page order
+def iterate_lines_from_PDF_pages_in_parallel(PDF_bytes: bytes, number_of_pages: int, workers: int) -> Iterator[list[str]]:
+    log(f"Extracting {number_of_pages} pages with {workers} processes")
+    from concurrent.futures import ProcessPoolExecutor
+
+    # A few ranges of consecutive pages per worker, so that workers finishing early can pick up more
+    pages_per_range = max(1, -(-number_of_pages // (workers * 4)))
+    first_pages = list(range(0, number_of_pages, pages_per_range))
+    last_pages = [min(first_page + pages_per_range, number_of_pages) for first_page in first_pages]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=open_PDF_in_page_extraction_worker, initargs=(PDF_bytes, skip_non_transaction_pages, text_extraction_engine)) as executor:
+        try:
+            # map() returns the ranges in page order, whatever the order the workers finish in
+            for PDF_pages_lines, worker_conversion_statistics in executor.map(extract_lines_from_PDF_pages_in_worker, first_pages, last_pages):
+                for name, count in worker_conversion_statistics.items():
+                    count_statistic(name, count)
+                yield from PDF_pages_lines
+        finally:
+            # The ranges not started are not extracted if the pages are not needed any more (see stop_after_last_transaction_page)
+            executor.shutdown(cancel_futures=True)
+
+# Yield the lines of each PDF page, one page after the other, each page being extracted only when it is needed
+@measured_stage("load")
+def iterate_lines_from_PDF_pages(PDF_filename: str) -> Iterator[list[str]]:
+    with read_PDF(PDF_filename) as PDF_bytes:
+        yield from iterate_lines_from_PDF_bytes_pages(PDF_bytes)
+
+def iterate_lines_from_PDF_bytes_pages(PDF_bytes: bytes | mmap.mmap) -> Iterator[list[str]]:
+    # If this PDF has already been extracted with the same parameters, no need to do it again
+    if use_page_text_cache:
+        cache_key = get_page_text_cache_key(PDF_bytes)
+        PDF_pages_lines_list_cached = load_lines_from_page_text_cache(cache_key)
+        if PDF_pages_lines_list_cached is not None:
+            log("PDF pages found in the page text cache, no extraction needed")
+            yield from PDF_pages_lines_list_cached
+            return
+
+    import pypdf
+
+    # pypdf reads a memory map as a file
+    PDF_file = pypdf.PdfReader(PDF_bytes if isinstance(PDF_bytes, mmap.mmap) else io.BytesIO(PDF_bytes))
+    number_of_pages = len(PDF_file.pages)
+
+    # Starting processes only pays off for PDFs with many pages
+    if page_extraction_workers > 1 and number_of_pages >= PARALLEL_PAGE_EXTRACTION_MIN_PAGES:
+        PDF_pages_lines_iterator = iterate_lines_from_PDF_pages_in_parallel(bytes(PDF_bytes), number_of_pages, page_extraction_workers)
+    else:
+        PDF_pages_lines_iterator = iterate_lines_from_PDF_pages_in_sequence(PDF_file)
+
+    # Only the text of the pages is kept, for the page text cache
+    PDF_pages_lines_list: list[list[str]] = []
+    PDF_pages_skipped = 0
+    PDF_pages_not_extracted = 0
+    closing_balance = None
+
+    for page_number, PDF_page_lines in enumerate(PDF_pages_lines_iterator):
+        # Skipped pages are the only ones without any line (an extracted page has at least an empty one)
+        if not PDF_page_lines:
+            PDF_pages_skipped += 1
+        if use_page_text_cache:
+            PDF_pages_lines_list.append(PDF_page_lines)
+        yield PDF_page_lines
+
+        if not stop_after_last_transaction_page:
+            continue
 
-    with open(PDF_filename, "rb") as file:
-        PDF_file = pypdf.PdfReader(file)
-        PDF_pages = PDF_file.pages
+        if closing_balance is None:
+            closing_balance = find_closing_balance_in_PDF_page(PDF_page_lines)
 
-        for PDF_page in PDF_pages:
-            PDF_lines: str = PDF_page.extract_text(
-                extraction_mode="layout",
-                layout_mode_space_vertically=False,
-                layout_mode_scale_weight=0.98,
-            )
-            PDF_pages_lines_list.append(PDF_lines.split("\n"))
+        # The transactions are complete, and the next page does not start new ones
+        if closing_balance is not None and transaction_section_ends_on_PDF_page(PDF_page_lines, closing_balance) \
+                and (page_number + 1 == number_of_pages or not PDF_page_may_contain_transactions(PDF_file.pages[page_number + 1])):
+            PDF_pages_not_extracted = number_of_pages - page_number - 1
+            PDF_pages_lines_iterator.close()
+            break
 
-    return PDF_pages_lines_list
+    log(f"{PDF_pages_skipped} of {number_of_pages} pages skipped as they cannot contain transactions")
+    count_statistic("Pages skipped before layout extraction", PDF_pages_skipped)
+
+    if stop_after_last_transaction_page:
+        log(f"{PDF_pages_not_extracted} of {number_of_pages} pages not extracted as they follow the last transactions")
+        count_statistic("Pages not extracted after the last transactions", PDF_pages_not_extracted)
+
+    if use_page_text_cache:
+        save_lines_to_page_text_cache(cache_key, PDF_pages_lines_list)
+
+# Extract the pages one after the other in this process, releasing each page once extracted
+def iterate_lines_from_PDF_pages_in_sequence(PDF_file) -> Iterator[list[str]]:
+    for PDF_page in PDF_file.pages:
+        PDF_page_lines = extract_lines_from_PDF_page(PDF_page)
+        release_PDF_page(PDF_file, PDF_page)
+        yield PDF_page_lines
+
+# load PDF pages into a list (of pages) containing a list of (pages lines) strings
+@measured_stage("load")
+def load_lines_from_all_pages_from_PDF(PDF_filename: str) -> list[list[str]]:
+    log("Loading PDF pages into a list of strings")
+
+    return list(iterate_lines_from_PDF_pages(PDF_filename))
 
 # Separate the lines containing transaction information from the non-transaction lines
-@log_wrapper
+@measured_stage("separate")
 def extract_transaction_specific_lines_from_pdf_import(all_lines_from_pdf: list[list[str]],) -> tuple[list[list[str]], list[list[str]]]:
     log("Separating the lines with transaction information from the non-transaction lines")
     transaction_lines_list: list[list[str]] = []
     non_transaction_lines_list: list[list[str]] = []
 
     for PDF_page in all_lines_from_pdf:
-        transaction_lines = []
-        transaction_section = False # Assuming that the first line of all lines is not a transaction yet
-        non_transaction_lines = []
-
-        for PDF_line in PDF_page:
-            # If the below text is discovered in a line, then we are at the END of a section containing transaction lines
-            if "BALANCE CARRIED FORWARD" in PDF_line:
-                transaction_section = False
-            
-            # If in a transaction section, add the line to the transaction list
-            if transaction_section:
-                transaction_lines.append(PDF_line)
-            # If not in a transaction section, record the line into the non-transaction list
-            else:
-                non_transaction_lines.append(PDF_line)
-                
-            # If the below text is discovered in a line, then we are at the START of a transaction section
-            if "BALANCE BROUGHT FORWARD" in PDF_line:
-                transaction_section = True
-        
+        transaction_lines, non_transaction_lines = separate_transaction_lines_of_PDF_page(PDF_page)
+
         # Add the page's transactions line to the transaction pages list
         transaction_lines_list.append(transaction_lines)
         # and the non-transaction lines to the non-transaction pages list
         non_transaction_lines_list.append(non_transaction_lines)
-        
-        # Could be about to start a new page so reset the transaction section indicator
-        transaction_section = False
 
     return transaction_lines_list, non_transaction_lines_list
 
+# Separate the lines containing transaction information from the non-transaction lines of one page
+@measured_stage("separate")
+def separate_transaction_lines_of_PDF_page(PDF_page: list[str]) -> tuple[list[str], list[str]]:
+    transaction_lines: list[str] = []
+    transaction_section = False # Assuming that the first line of all lines is not a transaction yet
+    non_transaction_lines: list[str] = []
+
+    for PDF_line in PDF_page:
+        # If the below text is discovered in a line, then we are at the END of a section containing transaction lines
+        if "BALANCE CARRIED FORWARD" in PDF_line:
+            transaction_section = False
+        
+        # If in a transaction section, add the line to the transaction list
+        if transaction_section:
+            transaction_lines.append(PDF_line)
+        # If not in a transaction section, record the line into the non-transaction list
+        else:
+            non_transaction_lines.append(PDF_line)
+            
+        # If the below text is discovered in a line, then we are at the START of a transaction section
+        if "BALANCE BROUGHT FORWARD" in PDF_line:
+            transaction_section = True
+
+    return transaction_lines, non_transaction_lines
+
+# Account and period of a statement, from the non-transaction lines of its first page
+def parse_statement_metadata(PDF_non_transaction_lines: list[str]) -> StatementMetadata:
+    statement_metadata = StatementMetadata()
+
+    for PDF_line in PDF_non_transaction_lines:
+        if statement_metadata.account_number is None and (sort_code_and_account_number := REGEX_SORT_CODE_AND_ACCOUNT_NUMBER.search(PDF_line)):
+            statement_metadata.sort_code, statement_metadata.account_number = sort_code_and_account_number.groups()
+
+        if statement_metadata.period_end is None and (statement_period := REGEX_STATEMENT_PERIOD.search(PDF_line)):
+            start_day, start_month, start_year, end_day, end_month, end_year = statement_period.groups()
+            try:
+                period_end = datetime.strptime(f"{end_day} {end_month} {end_year}", "%d %B %Y")
+                period_start = datetime.strptime(f"{start_day} {start_month} {start_year or end_year}", "%d %B %Y")
+            except ValueError:
+                # Not month names
+                continue
+            # Without its year, a period starting in December ends the next year
+            if period_start > period_end:
+                period_start = period_start.replace(year=period_start.year - 1)
+            statement_metadata.period_start = period_start.strftime("%Y-%m-%d")
+            statement_metadata.period_end = period_end.strftime("%Y-%m-%d")
+
+    return statement_metadata
+
+# Record the metadata of a statement being converted, from the non-transaction lines of its first page
+def record_statement_metadata(PDF_file: str, PDF_non_transaction_lines: list[str]) -> None:
+    statements_metadata[os.path.abspath(PDF_file)] = parse_statement_metadata(PDF_non_transaction_lines)
+
+# Balance at the end of the statement in pence, from the summary on its first page. None if not on this page
+def find_closing_balance_in_PDF_page(PDF_page_lines: list[str]) -> int | None:
+    for PDF_line in PDF_page_lines:
+        title_start = PDF_line.find(CLOSING_BALANCE_TITLE)
+        if title_start > -1:
+            amount = REGEX_CELL_AMOUNT.search(PDF_line, title_start)
+            return get_amount_in_pence(amount.group()) if amount else None
+
+    return None
+
+# Whether the transactions of the statement end on a page: the last transaction line of the page carries forward the closing balance
+# (the intermediate pages carry forward the balance of their last transaction)
+def transaction_section_ends_on_PDF_page(PDF_page_lines: list[str], closing_balance: int) -> bool:
+    for PDF_line in reversed(PDF_page_lines):
+        if "BALANCE CARRIED FORWARD" in PDF_line:
+            amounts = REGEX_CELL_AMOUNT.findall(PDF_line)
+            return bool(amounts) and get_amount_in_pence(amounts[-1]) == closing_balance
+        if "BALANCE BROUGHT FORWARD" in PDF_line:
+            return False
+
+    return False
+
+# Locate the columns of the transactions table from the header row of a page, None if the page has no header row
+@measured_stage("parse")
+def find_transaction_columns_in_PDF_page(PDF_page_lines: list[str]) -> dict[str, int] | None:
+    for PDF_line in PDF_page_lines:
+        paid_out_start = PDF_line.find(COLUMN_TITLE_PAID_OUT)
+        paid_in_start = PDF_line.find(COLUMN_TITLE_PAID_IN)
+        balance_start = PDF_line.find(COLUMN_TITLE_BALANCE)
+        details_start = PDF_line.find(COLUMN_TITLE_DETAILS)
+
+        if -1 < details_start < paid_out_start < paid_in_start < balance_start:
+            paid_out_end = paid_out_start + len(COLUMN_TITLE_PAID_OUT)
+            paid_in_end = paid_in_start + len(COLUMN_TITLE_PAID_IN)
+            balance_end = balance_start + len(COLUMN_TITLE_BALANCE)
+
+            return {
+                # Cells starting before this are in the date column
+                "details_start": details_start,
+                # Amounts ending before this are in the details, e.g. a reference number
+                "amounts_start": paid_out_start - COLUMN_AMOUNT_LEFT_MARGIN,
+                # Right aligned amounts belong to the column whose title end is the closest to theirs
+                "paid_in_boundary": (paid_out_end + paid_in_end) // 2,
+                "balance_boundary": (paid_in_end + balance_end) // 2,
+            }
+
+    return None
+
+# Split a transaction line into its details using the columns of its page
+# Linear in the line length, with a fixed number of steps whatever the number of words or spaces in the line
+def convert_transaction_line_into_a_dictionary_with_columns(PDF_transaction_line: str, columns: dict[str, int]) -> Transaction | None:
+
+    # Amounts: up to 3 right aligned amounts at the end of the line, from the right
+    amounts: list[tuple[int, int, str]] = []
+    text_end = len(PDF_transaction_line.rstrip())
+    while len(amounts) < 3 and text_end > columns["amounts_start"]:
+        amount_start = PDF_transaction_line.rfind(" ", 0, text_end) + 1
+        # The D of an overdrawn balance (the last amount of the line) can be apart from it
+        if not amounts and PDF_transaction_line[amount_start:text_end] == OVERDRAWN_BALANCE_SUFFIX:
+            amount_start = PDF_transaction_line.rfind(" ", 0, len(PDF_transaction_line[:amount_start].rstrip())) + 1
+        amount = PDF_transaction_line[amount_start:text_end]
+        if not REGEX_CELL_AMOUNT.fullmatch(amount):
+            break
+        amounts.append((amount_start, text_end, amount))
+        text_end = len(PDF_transaction_line[:amount_start].rstrip())
+
+    # Date, type and details: what is left on the left of the amounts
+    details_part = PDF_transaction_line[:text_end]
+    details_words = details_part.split()
+
+    if not details_words and not amounts:
+        # Empty line
+        return None
+
+    transaction = Transaction()
+    position = len(details_part) - len(details_part.lstrip())
+
+    if position < columns["details_start"] and len(details_words) >= 3 and REGEX_CELL_DATE.fullmatch(" ".join(details_words[:3])):
+        transaction.date = " ".join(details_words[:3])
+        position = details_part.find(details_words[2], position) + len(details_words[2])
+        details_words = details_words[3:]
+
+    if details_words and details_words[0] in TRANSACTION_TYPES:
+        transaction.type = details_words[0]
+        details_words = details_words[1:]
+
+    # Within the details, the words are only separated by single spaces
+    transaction.detail = " ".join(details_words)
+
+    # Each amount belongs to the column its right end is in
+    for _, amount_end, amount in amounts:
+        if amount_end <= columns["paid_in_boundary"]:
+            transaction.paid_out = amount
+        elif amount_end <= columns["balance_boundary"]:
+            transaction.paid_in = amount
+        else:
+            transaction.balance = get_balance_as_printed(amount)
+
+    return transaction
+
+# Transaction of a line of the transactions table extracted from the coordinates, from its cells instead of its text
+def convert_table_line_into_a_transaction(PDF_table_line: PDFTableLine) -> Transaction | None:
+    date, details, paid_out, paid_in, balance = PDF_table_line.cells
+
+    if not (date or details or paid_out or paid_in or balance):
+        # Empty line
+        return None
+
+    transaction = Transaction()
+    details_words = details.split()
+
+    # Anything else in the date column is part of the details, as with the columns engine
+    if REGEX_CELL_DATE.fullmatch(date):
+        transaction.date = date
+    else:
+        details_words = date.split() + details_words
+
+    if details_words and details_words[0] in TRANSACTION_TYPES:
+        transaction.type = details_words[0]
+        details_words = details_words[1:]
+
+    transaction.detail = " ".join(details_words)
+    transaction.paid_out = paid_out or None
+    transaction.paid_in = paid_in or None
+    transaction.balance = get_balance_as_printed(balance) if balance else None
+
+    return transaction
+
+# Split a transaction line into its details with LINE_DETAILS_EXTRACTION_REGEX (possibly several per line)
+def convert_transaction_line_into_dictionaries_with_regex(PDF_transaction_line: str) -> list[Transaction]:
+    transactions: list[Transaction] = []
+
+    # The crucial regex to extract the relevant info from the line
+    # Hopefully mostly working now
+    for match in LINE_DETAILS_EXTRACTION_PATTERN.finditer(PDF_transaction_line):
+        
+        # extract the dictionary from the regex search
+        transaction_details = match.groupdict()
+    
+        # Put the transaction details in a Transaction, the amount paid out until its column is known from the balances
+        transaction = Transaction(
+            date=transaction_details['date'],
+            type=transaction_details['type'],
+            detail=transaction_details['detail'],
+            paid_out=transaction_details['paid_out'],
+            balance=get_balance_as_printed(transaction_details['balance']) if transaction_details['balance'] else None,
+            )
+
+        transactions.append(transaction)
+
+    return transactions
+
 # extract and categorise the relevant info from the lines
-@log_wrapper
-def convert_transaction_details_per_line_into_a_dictionary(all_transaction_lines_from_PDF: list[list[str]]) -> list[dict[str, str]]:
-    log("Extracting each line into a dictionary")
+# The columns of each page, from find_transaction_columns_in_PDF_page, are needed by the "columns" engine.
+# Pages without columns are processed by the "regex" engine
+@measured_stage("parse")
+def convert_transaction_details_per_line_into_a_dictionary(all_transaction_lines_from_PDF: list[list[str]], PDF_pages_columns: list[dict[str, int] | None] | None = None) -> list[Transaction]:
+    log(f"Extracting each line into a dictionary with the {line_parser_engine} engine")
 
-    PDF_transaction_lines_detailed: list[dict[str, str]] = []
+    PDF_transaction_lines_detailed: list[Transaction] = []
 
     # Extract the relevant info from the lines into a list of lists of strings
-    for PDF_Page in all_transaction_lines_from_PDF:
-        
-        for PDF_transaction_line in PDF_Page:
-            
-            # The crucial regex to extract the relevant info from the line
-            # Hopefully mostly working now
-            for match in re.finditer(LINE_DETAILS_EXTRACTION_REGEX, PDF_transaction_line):
-                
-                # extract the dictionary from the regex search
-                transaction_details = match.groupdict()
-            
-                # Put the transaction details in an dictionary
-                transaction_details_dictionary = {
-                    'date': transaction_details['date'],
-                    'space1': transaction_details['space1'],
-                    'type': transaction_details['type'],
-                    'space2': transaction_details['space2'],
-                    'detail': transaction_details['detail'],
-                    'space3': transaction_details['space3'],
-                    'paid out': transaction_details['paid_out'],
-                    'space4': transaction_details['space4'],
-                    'paid in': transaction_details['paid_in'],
-                    'space5': transaction_details['space5'],
-                    'balance': transaction_details['balance'],
-                    }
-
-                # Store the dictionary in the list
-                PDF_transaction_lines_detailed.append(transaction_details_dictionary)
+    for page_number, PDF_Page in enumerate(all_transaction_lines_from_PDF):
+
+        columns = PDF_pages_columns[page_number] if line_parser_engine == "columns" and PDF_pages_columns else None
+
+        PDF_transaction_lines_detailed.extend(iterate_transactions_from_PDF_page_lines(PDF_Page, columns))
 
     return PDF_transaction_lines_detailed
 
+# Yield the transactions of the transaction lines of one page, with the columns engine if the columns of the page are known
+# The lines of the transactions table extracted from the coordinates already have their cells, whichever the engine
+@measured_stage("parse")
+def iterate_transactions_from_PDF_page_lines(PDF_Page: list[str], columns: dict[str, int] | None) -> Iterator[Transaction]:
+    for PDF_transaction_line in PDF_Page:
+        if isinstance(PDF_transaction_line, PDFTableLine):
+            transaction = convert_table_line_into_a_transaction(PDF_transaction_line)
+            if transaction:
+                yield transaction
+        elif columns:
+            transaction = convert_transaction_line_into_a_dictionary_with_columns(PDF_transaction_line, columns)
+            if transaction:
+                yield transaction
+        else:
+            yield from convert_transaction_line_into_dictionaries_with_regex(PDF_transaction_line)
+
 # Some lines are split over two or more lines. Combine them into one
-@log_wrapper
-def recombine_transaction_info_split_over_several_lines(PDF_transactions_extracted_and_converted: list[dict[str, str]]) -> list[dict[str, str]]:
+@measured_stage("recombine")
+def recombine_transaction_info_split_over_several_lines(PDF_transactions_extracted_and_converted: list[Transaction]) -> list[Transaction]:
     log("Combining lines split over two lines")
+
+    return list(iterate_transactions_with_split_transaction_info_recombined(PDF_transactions_extracted_and_converted))
+
+# Yield the transactions one by one, as soon as the line with their amounts is read
+# A state machine reading each line once: either no transaction is pending, or a line with a transaction type but no amount
+# is pending, waiting for the remainder of its detail and its amounts. These can be on the next page, as the lines of
+# the pages follow each other without the balances carried and brought forward
+@measured_stage("recombine")
+def iterate_transactions_with_split_transaction_info_recombined(PDF_transactions_extracted_and_converted: Iterable[Transaction]) -> Iterator[Transaction]:
     # Sometimes HSBC PDF present a statement over two lines. the amounts are on the second one.
     # For a decent output, we need to combine these two lines into one.
     # It seems the difference is that one line has the transaction type and the begining of the transaction detail.
     # The second line has the remainder of the transaction detail, and the amount(s)
     # Thankfully there is no line with a transaction 'type' and 'balance' without an amount
 
-    PDF_transactions_with_split_transaction_info_recombined: list[dict[str, str]] = []
-    
-    
-    for i in range(len(PDF_transactions_extracted_and_converted) - 1):
-
-        # 1) If the transation 'type' and the first 'amount' are found, the line is complete, copy over
-        if PDF_transactions_extracted_and_converted[i]["type"] and (
-                PDF_transactions_extracted_and_converted[i]["paid out"] 
-                or PDF_transactions_extracted_and_converted[i]["paid in"]):
-            PDF_transactions_with_split_transaction_info_recombined.append(PDF_transactions_extracted_and_converted[i])
+    # Line with a transaction 'type' but no amount, and the parts of its detail read so far
+    transaction_with_split_detail: Transaction | None = None
+    split_detail_parts: list[str] = []
+
+    for transaction in PDF_transactions_extracted_and_converted:
+        has_amount = transaction.paid_out or transaction.paid_in
+
+        if transaction_with_split_detail:
+            # A line without transaction type continues the detail of the pending transaction
+            if not transaction.type:
+                split_detail_parts.append(transaction.detail)
+
+                # No amount yet: more detail to come
+                if not has_amount:
+                    continue
+
+                # The line has an amount, meaning it is the end of the combining
+                # So complete the transaction of the first line (date and type) in place,
+                # with the combined detail and the amounts of this line
+                transaction_with_split_detail.detail = " ".join(split_detail_parts)
+                transaction_with_split_detail.paid_out = transaction.paid_out  # first amount from the next line
+                transaction_with_split_detail.paid_in = transaction.paid_in  # second amount from the next line
+                transaction_with_split_detail.balance = transaction.balance  # third amount from the next line - should be empty
+                yield transaction_with_split_detail
+                transaction_with_split_detail = None
+                continue
+
+            # Another transaction starts before any amount: the pending one cannot be completed
+            count_statistic("Transactions without amount dropped")
+            transaction_with_split_detail = None
+
+        # 1) If the transation 'type' and the first 'amount' are found, the line is complete
+        if transaction.type and has_amount:
+            yield transaction
 
         # 2) If the transaction type is found but no amount is found on the line,
-        # confirm that the next line has no transaction type but an amount.
+        # the next line(s) should have no transaction type but the rest of the detail and the amount.
         # In this case, combine
-        elif PDF_transactions_extracted_and_converted[i]["type"] and (
-                        not PDF_transactions_extracted_and_converted[i]["paid out"] and 
-                        not PDF_transactions_extracted_and_converted[i]["paid in"]):
-            temp_transaction_detail = PDF_transactions_extracted_and_converted[i]["detail"]
-            j = 1
-            
-            # Check if the next line has no transaction type and no amount
-            # in this case, combine the details
-            # otherwise, carry on
-            while not PDF_transactions_extracted_and_converted[i + j]["type"] and not (
-                            PDF_transactions_extracted_and_converted[i + j]["paid out"] or 
-                            PDF_transactions_extracted_and_converted[i + j]["paid in"]):
-                temp_transaction_detail = temp_transaction_detail + " " + PDF_transactions_extracted_and_converted[i + j]["detail"]
-                j = j + 1
-                if i == 33 and j == 2:
-                    break
-            
-            # if the current studied line i+j had either a type or a paid out, it reached here.
-            # Normally, it should be a paid out, meaning it is the end of the combining
-            # So combine this detail
-            if not PDF_transactions_extracted_and_converted[i + j]["type"] and (
-                                PDF_transactions_extracted_and_converted[i + j]["paid out"] or 
-                                PDF_transactions_extracted_and_converted[i + j]["paid in"]):
-                temp_transaction_detail = temp_transaction_detail + " " + PDF_transactions_extracted_and_converted[i + j]["detail"]
-
-                # Recreate the transaction
-                transaction_line_with_combined_detail = {
-                    "date": PDF_transactions_extracted_and_converted[i]["date"],  # date from current line
-                    "space1": PDF_transactions_extracted_and_converted[i]["space1"],
-                    "type": PDF_transactions_extracted_and_converted[i]["type"],  # type from current line
-                    "space2": PDF_transactions_extracted_and_converted[i]["space2"],
-                    "detail": temp_transaction_detail,
-                    "space3": PDF_transactions_extracted_and_converted[i+j]["space3"],
-                    "paid out": PDF_transactions_extracted_and_converted[i + j]["paid out"],  # first amount from the next line
-                    "space4": PDF_transactions_extracted_and_converted[i + j]["space4"],
-                    "paid in": PDF_transactions_extracted_and_converted[i + j]["paid in"],  # second amount from the next line
-                    "space5": PDF_transactions_extracted_and_converted[i + j]["space5"],
-                    "balance": PDF_transactions_extracted_and_converted[i + j]["balance"],  # third amount from the next line - should be empty
-                }
-                PDF_transactions_with_split_transaction_info_recombined.append(transaction_line_with_combined_detail)
-
-        # If we reach here, we're on the next line that has been processed in the second round
+        elif transaction.type:
+            transaction_with_split_detail = transaction
+            split_detail_parts = [transaction.detail]
+
+        # If we reach here, the line has no type, not following a split transaction line
         # so we have no processing to do
-        else:
-            continue
-        
-    return PDF_transactions_with_split_transaction_info_recombined
 
-# The amount is currently always in the paid_out column although always positive. Move the credit ones to the paid_in column
-# Hurray - now obsolete as the REGEX seems to about work now
-@log_wrapper
-def place_amount_in_the_credit_or_debit_column(PDF_transactions_with_recombined_lines: list[dict[str, str]]) -> list[dict[str, str]]:
+    if transaction_with_split_detail:
+        count_statistic("Transactions without amount dropped")
+
+# Each amount is in the column the line parser found it in (always paid_out with the regex engine). Move the amounts to the
+# column the balances printed tell, whatever the width of the spaces before them
+@measured_stage("amounts")
+def place_amount_in_the_credit_or_debit_column(PDF_transactions_with_recombined_lines: list[Transaction], balance_brought_forward: int | None) -> list[Transaction]:
    
     """Correcting the positioning of the amount, 
         depending on whether it is a Credit (paid in) or a Debit (paid out), 
         and the balance"""
     log("Correcting payment column (credit or debit)")
 
-    PDF_transactions_with_amount_in_correct_column: list[dict[str, str]] = []
+    return list(iterate_transactions_with_amount_in_the_credit_or_debit_column(PDF_transactions_with_recombined_lines, [balance_brought_forward]))
 
-    for PDF_transaction_line in PDF_transactions_with_recombined_lines:
-        
-        PDF_transaction_line_with_amount_in_correct_column = {
-            "date": PDF_transaction_line["date"],
-            "space1": PDF_transaction_line["space1"],
-            "type": PDF_transaction_line["type"],
-            "space2": PDF_transaction_line["space2"],
-            "detail": PDF_transaction_line["detail"], 
-            "space3": PDF_transaction_line["space3"], 
-            
-            "paid out": 
-                # VIS can be either paid in or paid out
-                # if 103 spaces before the VIS value, then it is a paid out
-                PDF_transaction_line["paid out"] if PDF_transaction_line["type"] == "VIS" 
-                                                 and PDF_transaction_line["paid out"] 
-                                                 and len(PDF_transaction_line["space3"]) < 103
-                    # but if more than 103 spaces, then it is a paid in
-                    else "" if PDF_transaction_line["type"] == "VIS" 
-                            and PDF_transaction_line["paid out"] 
-                            and len(PDF_transaction_line["space3"]) >= 103
-                        # all those not CR are paid out
-                        else PDF_transaction_line["paid out"] if PDF_transaction_line["type"] != "CR" 
-                            # CR will always be paid in, so nothing in this case
-                            else "", 
-                            
-            "space4": PDF_transaction_line["space4"], 
-            
-            "paid in": 
-                # VIS can be paid in if more than 103 spaces before the VIS value
-                PDF_transaction_line["paid out"] if PDF_transaction_line["type"] == "VIS" 
-                                                 and PDF_transaction_line["paid out"] 
-                                                 and len(PDF_transaction_line["space3"]) >= 103
-                    # CR are paid in
-                    else PDF_transaction_line["paid out"] if PDF_transaction_line["type"] == "CR" 
-                        # Otherwise, it was a paid out, so nothing
-                        else "",
-                        
-            "space5": PDF_transaction_line["space5"],
-            "balance": PDF_transaction_line["balance"], 
-        }
-        
-        PDF_transactions_with_amount_in_correct_column.append(PDF_transaction_line_with_amount_in_correct_column)
+# Yield the transactions with their amount in the paid in or paid out column, told by the balances printed:
+# the amounts of the transactions since the previous balance, paid in added and paid out taken off, make the difference
+# between the two balances. balances_brought_forward has the balance brought forward on the first page (filled in
+# as the pages are read), the balance before the first transactions. The transactions are held from one balance to the next
+@measured_stage("amounts")
+def iterate_transactions_with_amount_in_the_credit_or_debit_column(PDF_transactions_with_recombined_lines: Iterable[Transaction], balances_brought_forward: list[int | None]) -> Iterator[Transaction]:
+    previous_balance = None
+    transactions_since_previous_balance: list[Transaction] = []
+
+    for transaction in PDF_transactions_with_recombined_lines:
+        if previous_balance is None and balances_brought_forward:
+            previous_balance = balances_brought_forward[0]
+
+        transactions_since_previous_balance.append(transaction)
+        if not transaction.balance:
+            continue
 
-    return PDF_transactions_with_amount_in_correct_column
+        balance = get_amount_in_pence(transaction.balance)
+        if previous_balance is None:
+            place_amounts_by_transaction_type(transactions_since_previous_balance)
+        else:
+            place_amounts_by_balance_difference(transactions_since_previous_balance, balance - previous_balance)
+
+        yield from transactions_since_previous_balance
+        transactions_since_previous_balance = []
+        previous_balance = balance
+
+    # After the last balance printed, if any
+    place_amounts_by_transaction_type(transactions_since_previous_balance)
+    yield from transactions_since_previous_balance
+
+# Put the amounts of transactions in the paid in or paid out column so that they make the difference between two balances,
+# moving as few amounts as possible from the column the line parser put them in. If none or several ways, the amounts are
+# placed by their type (see place_amounts_by_transaction_type), then moved from there if that makes the difference in one way only
+def place_amounts_by_balance_difference(transactions: list[Transaction], balance_difference: int) -> None:
+    transactions_with_amount = [transaction for transaction in transactions if transaction.paid_in or transaction.paid_out]
+
+    if move_amounts_to_make_balance_difference(transactions_with_amount, balance_difference):
+        return
+
+    place_amounts_by_transaction_type(transactions_with_amount, "Amounts placed by the transaction type, the balances not telling")
+    if not move_amounts_to_make_balance_difference(transactions_with_amount, balance_difference):
+        count_statistic("Amounts whose column the balances cannot tell", len(transactions_with_amount))
+
+# Move the fewest amounts (at most AMOUNTS_TO_MOVE_MAX) of transactions to the other column so that they make the difference
+# between two balances. Returns whether the amounts make it, moved or not: not if no or several ways to make it
+def move_amounts_to_make_balance_difference(transactions_with_amount: list[Transaction], balance_difference: int) -> bool:
+    # Amount of each transaction in pence, positive if paid in
+    amounts = [get_amount_in_pence(transaction.paid_in) if transaction.paid_in else -get_amount_in_pence(transaction.paid_out) for transaction in transactions_with_amount]
+
+    # Moving an amount to the other column changes the total by twice the amount
+    difference_to_make_up = balance_difference - sum(amounts)
+    if not difference_to_make_up:
+        return True
+
+    for number_of_amounts_to_move in range(1, min(len(amounts), AMOUNTS_TO_MOVE_MAX) + 1):
+        # Only whether there is one way or more matters: stops at the second one
+        amounts_to_move = list(itertools.islice((indexes for indexes in itertools.combinations(range(len(amounts)), number_of_amounts_to_move)
+                                                 if sum(-2 * amounts[index] for index in indexes) == difference_to_make_up), 2))
+        if len(amounts_to_move) == 1:
+            for index in amounts_to_move[0]:
+                transaction = transactions_with_amount[index]
+                transaction.paid_in, transaction.paid_out = transaction.paid_out, transaction.paid_in
+            count_statistic("Amounts moved to the other column by the balances", number_of_amounts_to_move)
+            return True
+        if amounts_to_move:
+            return False
+
+    return False
+
+# Put the amounts of transactions in the paid in or paid out column by their type, when the balances do not tell:
+# CR is paid in, VIS (either) is left in the column of the line parser, the others are paid out
+def place_amounts_by_transaction_type(transactions: list[Transaction], statistic: str = "Amounts placed by the transaction type, no balance to tell") -> None:
+    for transaction in transactions:
+        amount = transaction.paid_in or transaction.paid_out
+        if not amount or transaction.type == "VIS":
+            continue
+
+        is_paid_in = transaction.type == "CR"
+        transaction.paid_out = "" if is_paid_in else amount
+        transaction.paid_in = amount if is_paid_in else ""
+        count_statistic(statistic)
 
 # Date for all transactions that day is only provided once in the PDF. Associates each transaction with its happening date
-@log_wrapper
-def set_correct_date_for_each_transaction(PDF_transactions_with_amount_in_correct_column: list[dict[str, str]]) -> list[dict[str, str]]:
-    # This assumes that the transaction lines in the dictionary will be read in the order from the PDF
-    # This should work fine with python 3.10+
+@measured_stage("date-fill")
+def set_correct_date_for_each_transaction(PDF_transactions_with_amount_in_correct_column: list[Transaction]) -> list[Transaction]:
     log("Inserting the missing dates")
 
+    return list(iterate_transactions_with_correct_date(PDF_transactions_with_amount_in_correct_column))
+
+# Yield the transactions one by one, with their date set
+@measured_stage("date-fill")
+def iterate_transactions_with_correct_date(PDF_transactions_with_amount_in_correct_column: Iterable[Transaction]) -> Iterator[Transaction]:
+    # This assumes that the transaction lines will be read in the order from the PDF
+    # This should work fine with python 3.10+
     previous_transaction_date = ""
 
     for transaction_line in PDF_transactions_with_amount_in_correct_column:
         # If no date, use the previous_transaction_date date. 
         # The first transaction will always have a date so no need to do anything to it
-        # This is processing the dictionary provided, not creating a new one
-        if not transaction_line["date"]:
-            transaction_line["date"] = previous_transaction_date
+        # This is processing the transactions provided, not creating new ones
+        if not transaction_line.date:
+            transaction_line.date = previous_transaction_date
         
         # set the previous date to the current line's. Either an old one repeated, or a new one if it already had a date
-        previous_transaction_date = transaction_line["date"]
+        previous_transaction_date = transaction_line.date
 
-    return PDF_transactions_with_amount_in_correct_column
+        yield transaction_line
 
 # QIF and memory manager ex requires that transaction are in the same column with a +/-. do this.
-@log_wrapper
-def change_amounts_to_one_column_with_pos_or_neg_values(list_with_dates_on_every_line: list[dict[str, str]]) -> list[dict[str, str]]:
+@measured_stage("amounts")
+def change_amounts_to_one_column_with_pos_or_neg_values(list_with_dates_on_every_line: list[Transaction]) -> list[Transaction]:
     log("Combining the amounts paid in and out")
 
     for line in list_with_dates_on_every_line:
-        # If there is an amount in "paid_out colum, then make it to negative"
-        if line["paid out"]:
-            line["paid out"] = str(0 - float(line["paid out"].replace(",", "")))
+        set_amount_with_pos_or_neg_value(line)
 
-        # If there is an amount in "paid_in column, then move it to "paid out" column and nullify the paid_in
-        if line["paid in"]:
-            line["paid out"] = line["paid in"]
-            line["paid in"] = ""
+    return list_with_dates_on_every_line
 
-        # Modify the dictionary to
-        # change the "paid out" key name into "Amount" and
-        # remove the "paid in" column
-        line["amount"] = line.pop("paid out")
-        line.pop("paid in")
+# Set the amount of one transaction, in pence: positive if paid in, negative if paid out
+def set_amount_with_pos_or_neg_value(line: Transaction) -> None:
+    # If there is an amount in "paid_in" column, then it is the amount
+    if line.paid_in:
+        line.amount = get_amount_in_pence(line.paid_in)
+    # If there is an amount in "paid_out" column, then make it to negative
+    elif line.paid_out:
+        line.amount = -get_amount_in_pence(line.paid_out)
+    else:
+        line.amount = None
 
-    return list_with_dates_on_every_line
+# Balance as shown in the PDF, an overdrawn balance always as "1,234.56 D" whatever the space before its D in the text extracted
+def get_balance_as_printed(balance: str) -> str:
+    if not balance.endswith(OVERDRAWN_BALANCE_SUFFIX):
+        return balance
+    return f"{balance.rstrip(OVERDRAWN_BALANCE_SUFFIX).rstrip()} {OVERDRAWN_BALANCE_SUFFIX}"
+
+# Amount as shown in the PDF (e.g. "1,234.5") in pence, as an integer so that no rounding can happen
+def get_amount_in_pence(amount: str) -> int:
+    # Overdrawn balance, e.g. "1,234.56 D": negative
+    overdrawn = amount.endswith(OVERDRAWN_BALANCE_SUFFIX)
+    pounds, _, pence = amount.rstrip(OVERDRAWN_BALANCE_SUFFIX + " ").replace(",", "").partition(".")
+    amount_in_pence = int(pounds) * 100 + int(pence.ljust(2, "0")[:2])
+    return -amount_in_pence if overdrawn else amount_in_pence
+
+# Amount in pence as pounds with 2 decimals and no thousands separator (e.g. "-1234.50"), empty if no amount
+def format_amount_in_pence(amount: int | None) -> str:
+    if amount is None:
+        return ""
+
+    pounds, pence = divmod(abs(amount), 100)
+    return f"{'-' if amount < 0 else ''}{pounds}.{pence:02d}"
 
 
 #####
 # PDF to Data conversion
-@log_wrapper
-def get_raw_text_transactions_from_PDF(PDF_file: str) -> list[list[str]]:
+# Returns the transaction lines and the non-transaction lines (which contain the header row of the transactions table)
+@measured_stage("load")
+def get_raw_text_transactions_from_PDF(PDF_file: str) -> tuple[list[list[str]], list[list[str]]]:
     
     log("Extracting data from PDF into a list of text lines in a list of pages")
     
@@ -559,198 +1866,50 @@ def get_raw_text_transactions_from_PDF(PDF_file: str) -> list[list[str]]:
     
     # step2:
     PDF_transactions_in_raw_text_format: list[list[str]]
-    PDF_transactions_in_raw_text_format, _ = extract_transaction_specific_lines_from_pdf_import(step1) # Ignore the second argument with "_" as it is the non-transaction lines
+    PDF_non_transactions_in_raw_text_format: list[list[str]]
+    PDF_transactions_in_raw_text_format, PDF_non_transactions_in_raw_text_format = extract_transaction_specific_lines_from_pdf_import(step1)
     
-    return PDF_transactions_in_raw_text_format
+    return PDF_transactions_in_raw_text_format, PDF_non_transactions_in_raw_text_format
 
-@log_wrapper
-def get_usable_dictionary_from_PDF(PDF_transactions_raw_text_pages: list[list[str]]) -> list[dict[str, str]]:
+@measured_stage("parse")
+def get_usable_dictionary_from_PDF(PDF_transactions_raw_text_pages: list[list[str]], PDF_non_transactions_raw_text_pages: list[list[str]] | None = None) -> list[Transaction]:
     # follows on from get_raw_text_transactions_from_PDF
     
-    log("Extracting data from PDF into a dict")
+    log("Extracting data from PDF into transactions")
+
+    # The column positions are in the header row of each page, with the non-transaction lines
+    PDF_pages_columns = None
+    if line_parser_engine == "columns" and PDF_non_transactions_raw_text_pages:
+        PDF_pages_columns = [find_transaction_columns_in_PDF_page(PDF_page_lines) for PDF_page_lines in PDF_non_transactions_raw_text_pages]
 
-    step3 = convert_transaction_details_per_line_into_a_dictionary(PDF_transactions_raw_text_pages)
+    step3 = convert_transaction_details_per_line_into_a_dictionary(PDF_transactions_raw_text_pages, PDF_pages_columns)
     step4 = recombine_transaction_info_split_over_several_lines(step3)
-    # step5 = place_amount_in_the_credit_or_debit_column(step4)
+    step5 = place_amount_in_the_credit_or_debit_column(step4, find_balance_brought_forward(PDF_non_transactions_raw_text_pages or []))
     # step6
-    PDF_transactions_in_usable_dictionary_format = set_correct_date_for_each_transaction(step4)
+    PDF_transactions_in_usable_dictionary_format = set_correct_date_for_each_transaction(step5)
 
     return PDF_transactions_in_usable_dictionary_format
 
 
 #####
 # File saving functions
-# Save a list of dict[str|str] to a TXT file
-@log_wrapper
-def Save_PDF_transactions_in_raw_TXT_format_file(PDF_transactions_raw_text_pages: list[list[str]], output_file) -> None:
-    log("Saving data to raw TXT file")
-
-    # Write the individual text file
-    with open(output_file, "w") as file:
-        for PDF_transaction_row_text_page in PDF_transactions_raw_text_pages:
-            for PDF_transaction_row_text in PDF_transaction_row_text_page:
-                file.write(PDF_transaction_row_text + "\n")
-    
-    # Write the combined text file            
-    if combine_all_output_statements:
-        output_raw_combined_filename = OUTPUT_FOLDER_RAW + "\\" + OUTPUT_FILENAME_RAW_COMBINED
-        with open(output_raw_combined_filename, "a") as file:
-            for PDF_transaction_row_text_page in PDF_transactions_raw_text_pages:
-                for PDF_transaction_row_text in PDF_transaction_row_text_page:
-                    file.write(PDF_transaction_row_text + "\n")
-
-# Save a list of dict[str|str] to a CSV file
-@log_wrapper
-def save_PDF_transactions_in_generic_CSV_format_file(PDF_transactions_in_dict_pages: list[dict[str, str]], output_file) -> None:
-    log("Saving data to generic CSV file as tab separated")
-    
-    global csv_writer_combined_header_present
-
-    with open(output_file, "w", newline="") as csvfile:
-        csv_writer = csv.writer(csvfile, delimiter="\t")
-        
-        if output_spaces_in_csv: # should be mainly be for debugging
-                        
-            # Write Header for generic CSV file
-            csv_writer.writerow(
-                [
-                    "Date",
-                    "space1",
-                    "Transaction Type",
-                    "space2",
-                    "Transaction Detail",
-                    "space3",
-                    "Paid Out",
-                    "space4",
-                    "Paid In",
-                    "space5",
-                    "Balance",
-                ]
-            )
-
-            # Write data for generic CSV file
-            for transaction in PDF_transactions_in_dict_pages:               
-                csv_writer.writerow(
-                [
-                    transaction["date"],
-                    transaction["space1"],
-                    transaction["type"],
-                    transaction["space2"],
-                    transaction["detail"],
-                    transaction["space3"],
-                    transaction["paid out"],
-                    transaction["space4"],
-                    transaction["paid in"],
-                    transaction["space5"],
-                    transaction["balance"],
-                ]
-            )
-
-        else:
-            # Write Header for generic CSV file
-            csv_writer.writerow(
-                [
-                    "Date",
-                    "Transaction Type",
-                    "Transaction Detail",
-                    "Paid Out",
-                    "Paid In",
-                    "Balance",
-                ]
-            )
-            
-            # Write data for generic CSV file
-            for transaction in PDF_transactions_in_dict_pages:
-                csv_writer.writerow(
-                        [
-                            transaction["date"],
-                            transaction["type"],
-                            transaction["detail"],
-                            transaction["paid out"],
-                            transaction["paid in"],
-                            transaction["balance"],
-                        ]
-                    )
-
-
-        if combine_all_output_statements:
-            output_csv_combined_filename = OUTPUT_FOLDER_CSV + "\\" + OUTPUT_FILENAME_CSV_COMBINED
-            with open(output_csv_combined_filename, "a", newline="") as csvfile_combined:
-                csv_writer_combined = csv.writer(csvfile_combined, delimiter="\t")
-
-
-                if output_spaces_in_csv: # should be mainly be for debugging
-                
-                    # Write header for combined CSV file if new file
-                    if not csv_writer_combined_header_present:
-                        csv_writer_combined.writerow(
-                            [
-                                "Date",
-                                "space1",
-                                "Transaction Type",
-                                "space2",
-                                "Transaction Detail",
-                                "space3",
-                                "Paid Out",
-                                "space4",
-                                "Paid In",
-                                "space5",
-                                "Balance",
-                            ]
-                        )
-                        csv_writer_combined_header_present = True
-                    
-                    # Write data for combined CSV file
-                    for transaction in PDF_transactions_in_dict_pages:
-                        csv_writer_combined.writerow(
-                                [
-                                    transaction["date"],
-                                    transaction["space1"],
-                                    transaction["type"],
-                                    transaction["space2"],
-                                    transaction["detail"],
-                                    transaction["space3"],
-                                    transaction["paid out"],
-                                    transaction["space4"],
-                                    transaction["paid in"],
-                                    transaction["space5"],
-                                    transaction["balance"],
-                                ]
-                            )
-                    
-                else:
-                    # Write header for combined CSV file
-                    if not csv_writer_combined_header_present:
-                        csv_writer_combined.writerow(
-                            [
-                                "Date",
-                                "Transaction Type",
-                                "Transaction Detail",
-                                "Paid Out",
-                                "Paid In",
-                                "Balance",
-                            ]
-                        )
-                        csv_writer_combined_header_present = True
-                    
-                    # Write data for combined CSV file
-                    for transaction in PDF_transactions_in_dict_pages:
-                        csv_writer_combined.writerow(
-                            [
-                                transaction["date"],
-                                transaction["type"],
-                                transaction["detail"],
-                                transaction["paid out"],
-                                transaction["paid in"],
-                                transaction["balance"],
-                            ]
-                        )
-                    
-# Save PDF transactions in MoneyManagerE CSV format
-@log_wrapper
-def save_PDF_transactions_in_mmx_CSV_format_file(PDF_transactions_in_dict_form_with_one_amounts_column: list[dict[str, str]], output_file) -> None:
-    log("Saving MoneyManagerEx CSV file as tab separated")
-
+# Header of the generic CSV file
+def get_generic_CSV_header() -> list[str]:
+    return ["Date", "Transaction Type", "Transaction Detail", "Paid Out", "Paid In", "Balance"]
+
+# One transaction as a row of the generic CSV file
+def get_generic_CSV_row(transaction: Transaction) -> list[str | None]:
+    return [
+        transaction.date,
+        transaction.type,
+        transaction.detail,
+        transaction.paid_out,
+        transaction.paid_in,
+        transaction.balance,
+    ]
+
+# Header of the MoneyManagerEx CSV file
+def get_mmx_CSV_header() -> list[str]:
     # to import:
     # File > Import > as CSV
     # - Column "Date", select "Date"
@@ -767,101 +1926,327 @@ def save_PDF_transactions_in_mmx_CSV_format_file(PDF_transactions_in_dict_form_w
     # - then you can save the preset (3rd line from the top)
     #     - give it a memorable name like "from HSBC_UK_Advance_Acct_Monthly_Statement_PDF_to_CSV_and_QIF"
     #     - This can then be recalled for the next import
-
-    global mmx_writer_combined_header_present
-
-    with open(output_file, "w", newline="") as mmxfile:
-        mmx_writer = csv.writer(mmxfile, delimiter="\t")
-
-        # Write Header to MemoryManagerEx CSV file
+    return ["Date", "Notes", "Payee", "Amount"]
+
+# One transaction (with its amount set) as a row of the MoneyManagerEx CSV file
+def get_mmx_CSV_row(transaction: Transaction) -> list[str | None]:
+    return [
+        transaction.date,
+        transaction.type,
+        transaction.detail,
+        format_amount_in_pence(transaction.amount),
+    ]
+
+# First line of the QIF file
+def get_QIF_header() -> list[str]:
+    return ["!Type:Bank"]
+
+# One transaction (with its amount set) as the lines of the QIF file
+def get_QIF_lines(transaction: Transaction) -> list[str]:
+    # Transform the date to the required format for QIF
+    date = datetime.strptime(transaction.date, "%d %b %y").strftime("%d/%m/%y")
+
+    return [
+        f"D{date}",
+        f"M{transaction.type}",  # HSBC Type saved as memo
+        f"T{format_amount_in_pence(transaction.amount)}",
+        f"P{transaction.detail}",
+        "^",
+    ]
+
+# Write a list of Transaction as generic CSV to a stream (e.g. stdout for shell pipelines)
+@measured_stage("write stdout")
+def write_PDF_transactions_in_generic_CSV_format_to_stream(PDF_transactions_in_dict_pages: Iterable[Transaction], stream: TextIO, include_header: bool) -> None:
+    log("Writing data as generic CSV to a stream as tab separated")
+
+    csv_writer = csv.writer(stream, delimiter="\t", lineterminator="\n")
+
+    if include_header:
+        csv_writer.writerow(get_generic_CSV_header())
+
+    csv_writer.writerows(get_generic_CSV_row(transaction) for transaction in PDF_transactions_in_dict_pages)
+
+# File name of an account (e.g. of its combined files): the account after the base name. The file name itself without account
+def get_account_filename(filename: str, account: str | None) -> str:
+    if account is None:
+        return filename
+
+    base_filename, extension = os.path.splitext(filename)
+    return f"{base_filename}_{account}{extension}"
+
+# The combined files of the formats currently requested (of one account if given, see StatementMetadata.account)
+def get_requested_combined_output_filenames(account: str | None = None) -> dict[str, str]:
+    combined_output_filenames: dict[str, str] = {}
+    if output_raw:
+        combined_output_filenames["raw"] = os.path.join(OUTPUT_FOLDER_RAW, get_account_filename(OUTPUT_FILENAME_RAW_COMBINED, account))
+    if output_generic_csv:
+        combined_output_filenames["csv"] = os.path.join(OUTPUT_FOLDER_CSV, get_account_filename(OUTPUT_FILENAME_CSV_COMBINED, account))
+    if output_mmx:
+        combined_output_filenames["mmx"] = os.path.join(OUTPUT_FOLDER_MMX, get_account_filename(OUTPUT_FILENAME_MMX_COMBINED, account))
+    if output_qif:
+        combined_output_filenames["qif"] = os.path.join(OUTPUT_FOLDER_QIF, get_account_filename(OUTPUT_FILENAME_QIF_COMBINED, account))
+
+    return combined_output_filenames
+
+# All the files written during a conversion run: the individual files of each PDF, one after the other, and the combined files
+# Each transaction is formatted once per format and written to the individual and combined files in the same pass
+# The combined files stay open for the whole run. Every file is written under a temporary name and only renamed once complete,
+# so an interrupted run never leaves truncated files behind. With an account, the combined files are those of the account
+class OutputFilesWriterSession:
+    def __init__(self, combine: bool = False, account: str | None = None) -> None:
+        self.combine = combine
+        self.account = account
+        # Final name of each open file, by open file
+        self.final_filenames: dict[TextIO, str] = {}
+        # Open files of each format: individual file of the current PDF and combined file
+        self.combined_files: dict[str, TextIO] = {}
+        self.PDF_files: dict[str, TextIO] = {}
+        self.PDF_file = ""
+        self.ledger_transactions: list[Transaction] = []
+        # Fingerprints of the transactions of the current PDF, and the date and position in its day of the last one (see get_transaction_fingerprint)
+        self.PDF_fingerprints: list[str] | None = None
+        self.PDF_day = (None, 0)
+        # Statement (PDF file and transaction number) of each transaction already in the combined files, by fingerprint,
+        # and the report rows of the transactions left out of them (see DUPLICATE_TRANSACTIONS_REPORT_FIELDS)
+        self.combined_fingerprints: dict[str, tuple[str, int]] | None = {} if combine and transaction_fingerprints_needed() else None
+        self.duplicate_transactions: list[list] = []
+
+        if combine:
+            for output_format, combined_output_filename in get_requested_combined_output_filenames(account).items():
+                self.combined_files[output_format] = self.open_file(combined_output_filename, output_format)
+
+            # The combined CSV files have a single header. The QIF header is repeated for each PDF (see open_PDF_files)
+            self.write_rows(self.combined_files, "csv", [get_generic_CSV_header()])
+            if use_mmx_header:
+                self.write_rows(self.combined_files, "mmx", [get_mmx_CSV_header()])
+
+    def __enter__(self) -> "OutputFilesWriterSession":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def open_file(self, output_filename: str, output_format: str) -> TextIO:
+        # No newline translation, so that the individual files can be copied as they are into the combined files (see write_lines)
+        file = open(output_filename + OUTPUT_TEMPORARY_EXTENSION, "w", buffering=OUTPUT_FILE_BUFFER_SIZE, newline="")
+        self.final_filenames[file] = output_filename
+        return file
+
+    # Close a file and give it its final name
+    def close_file(self, file: TextIO) -> None:
+        file.close()
+        os.replace(file.name, self.final_filenames.pop(file))
+
+    # Start the individual files of a PDF
+    def open_PDF_files(self, SelectedPath: str, SelectedFile: str) -> None:
+        self.PDF_file = os.path.join(SelectedPath, SelectedFile)
+        self.PDF_fingerprints = [] if transaction_fingerprints_needed() else None
+        self.PDF_day = (None, 0)
+
+        for output_format, output_filename in get_requested_output_filenames(SelectedFile).items():
+            if output_format != "ledger":
+                self.PDF_files[output_format] = self.open_file(output_filename, output_format)
+
+        self.write_rows(self.PDF_files, "csv", [get_generic_CSV_header()])
         if use_mmx_header:
-            mmx_writer.writerow(
-                [
-                    "Date",
-                    "Notes",
-                    "Payee",
-                    "Amount",
-                ]
-            )
-
-        # Write transactions to MemoryManagerEx CSV file
-        for transaction in PDF_transactions_in_dict_form_with_one_amounts_column:
-            mmx_writer.writerow(
-                [
-                    transaction["date"],
-                    transaction["type"],
-                    transaction["detail"],
-                    float(transaction["amount"].replace(",", "")),
-                ]
-            )
-
-        if combine_all_output_statements:
-            output_mmx_combined_filename = OUTPUT_FOLDER_MMX + "\\" + OUTPUT_FILENAME_MMX_COMBINED
-            with open(output_mmx_combined_filename, "a", newline="") as mmxfile_combined:
-                mmx_writer_combined = csv.writer(mmxfile_combined, delimiter="\t")
-
-                # Write Header for MemoryManagerEx CSV combined file, if new
-                if use_mmx_header:
-                    if not mmx_writer_combined_header_present:
-                        mmx_writer_combined.writerow(
-                            [
-                                "Date",
-                                "Notes",
-                                "Payee",
-                                "Amount",
-                            ]
-                        )
-                        mmx_writer_combined_header_present = True
-
-                # Write transactions to MemoryManagerEx CSV combined file
-                for transaction in PDF_transactions_in_dict_form_with_one_amounts_column:
-                    mmx_writer_combined.writerow(
-                        [
-                            transaction["date"],
-                            transaction["type"],
-                            transaction["detail"],
-                            float(transaction["amount"].replace(",", "")),
-                        ]
-                    )
-
-# Save PDF transactions in QIF format
-@log_wrapper
-def save_PDF_transactions_in_QIF_format_file(PDF_transactions_in_dict_form_with_one_amounts_column: list[dict[str, str]], output_file) -> None:
-    log("Saving data to QIF file")
-
-    qif_data: list[str] = ["!Type:Bank"]
-
-    for transaction in PDF_transactions_in_dict_form_with_one_amounts_column:
-        # Transform the date to the required format for QIF
-        date = datetime.strptime(transaction["date"], "%d %b %y").strftime("%d/%m/%y")
-        
-        qif_data.extend(
-            [
-                f"D{date}",
-                f"M{transaction['type']}",  # HSBC Type saved as memo
-                f"T{transaction['amount']}",
-                f"P{transaction['detail']}",
-                "^",                            
-            ]
-        )
-
-    with open(output_file, "w", newline="") as qif_file:
-        # QIF requires one information per line
-        for line in qif_data:
-            qif_file.write(line + "\n")
-            
-        if combine_all_output_statements:
-            output_qif_combined_filename = OUTPUT_FOLDER_QIF + "\\" + OUTPUT_FILENAME_QIF_COMBINED
-            with open(output_qif_combined_filename, "a", newline="") as qif_file_combined:
-                for line in qif_data:
-                    qif_file_combined.write(line + "\n")
+            self.write_rows(self.PDF_files, "mmx", [get_mmx_CSV_header()])
+        self.write_lines("qif", get_QIF_header())
+
+    # Complete the individual files of the current PDF, and load its transactions into the ledger
+    def close_PDF_files(self) -> None:
+        for file in self.PDF_files.values():
+            self.close_file(file)
+        self.PDF_files = {}
+
+        if output_ledger:
+            with measure_stage("write ledger", len(self.ledger_transactions)):
+                load_transactions_into_ledger(self.PDF_file, self.ledger_transactions)
+        self.ledger_transactions = []
+
+        if self.PDF_fingerprints is not None:
+            statement_transaction_fingerprints[os.path.abspath(self.PDF_file)] = self.PDF_fingerprints
+        self.PDF_fingerprints = None
+
+    # Write lines to the individual and combined files of a format (or only to those of to_files)
+    # The raw text has the line endings of the platform, the QIF file always "\n"
+    def write_lines(self, output_format: str, lines: Iterable[str], to_files: tuple[dict[str, TextIO], ...] | None = None) -> None:
+        files = [files[output_format] for files in (to_files or (self.PDF_files, self.combined_files)) if output_format in files]
+        if files:
+            line_ending = os.linesep if output_format == "raw" else "\n"
+            text = "".join(line + line_ending for line in lines)
+            for file in files:
+                file.write(text)
+
+    # Write CSV rows to the file of a format, if requested
+    def write_rows(self, files: dict[str, TextIO], output_format: str, rows: list[list]) -> None:
+        if output_format in files:
+            csv.writer(files[output_format], delimiter="\t").writerows(rows)
+
+    # Raw text lines of a page of the current PDF
+    @measured_stage("write raw")
+    def write_raw_lines(self, PDF_lines: list[str]) -> None:
+        self.write_lines("raw", PDF_lines)
+
+    # Transactions of the current PDF, to all the formats requested, in batches of OUTPUT_ROWS_BATCH_SIZE
+    def write_transactions(self, PDF_transactions: Iterable[Transaction]) -> None:
+        PDF_transactions = iter(PDF_transactions)
+        while transactions_batch := list(itertools.islice(PDF_transactions, OUTPUT_ROWS_BATCH_SIZE)):
+            self.write_transactions_batch(transactions_batch)
+
+    # Each format is a stage of its own for the stage metrics
+    def write_transactions_batch(self, transactions_batch: list[Transaction]) -> None:
+        combined_transactions_kept = self.fingerprint_transactions_batch(transactions_batch)
+
+        if output_generic_csv:
+            with measure_stage("write csv", len(transactions_batch)):
+                generic_CSV_rows = [get_generic_CSV_row(transaction) for transaction in transactions_batch]
+                self.write_rows(self.PDF_files, "csv", generic_CSV_rows)
+                self.write_rows(self.combined_files, "csv", keep_combined_rows(generic_CSV_rows, combined_transactions_kept))
+
+        # mmx CSV, QIF and the ledger need the amounts pos/neg in one column
+        if output_mmx or output_qif or output_ledger:
+            with measure_stage("amounts", len(transactions_batch)):
+                for transaction in transactions_batch:
+                    set_amount_with_pos_or_neg_value(transaction)
+
+        if output_mmx:
+            with measure_stage("write mmx", len(transactions_batch)):
+                mmx_rows = [get_mmx_CSV_row(transaction) for transaction in transactions_batch]
+                self.write_rows(self.PDF_files, "mmx", mmx_rows)
+                self.write_rows(self.combined_files, "mmx", keep_combined_rows(mmx_rows, combined_transactions_kept))
+
+        if output_qif:
+            with measure_stage("write qif", len(transactions_batch)):
+                if combined_transactions_kept is None:
+                    self.write_lines("qif", itertools.chain.from_iterable(get_QIF_lines(transaction) for transaction in transactions_batch))
+                else:
+                    QIF_transactions_lines = [get_QIF_lines(transaction) for transaction in transactions_batch]
+                    self.write_lines("qif", itertools.chain.from_iterable(QIF_transactions_lines), (self.PDF_files,))
+                    self.write_lines("qif", itertools.chain.from_iterable(keep_combined_rows(QIF_transactions_lines, combined_transactions_kept)), (self.combined_files,))
+
+        # The transactions of the statement are loaded into the ledger all at once, when its files are complete
+        if output_ledger:
+            self.ledger_transactions.extend(transactions_batch)
+
+    # Fingerprint a batch of transactions of the current PDF, and tell which of them go to the combined files (None: all of them)
+    @measured_stage("duplicates")
+    def fingerprint_transactions_batch(self, transactions_batch: list[Transaction]) -> list[bool] | None:
+        if self.PDF_fingerprints is None:
+            return None
+
+        first_transaction = len(self.PDF_fingerprints)
+        day, position_in_day = self.PDF_day
+        for transaction in transactions_batch:
+            day, position_in_day = (day, position_in_day + 1) if transaction.date == day else (transaction.date, 0)
+            self.PDF_fingerprints.append(get_transaction_fingerprint(transaction, position_in_day))
+        self.PDF_day = (day, position_in_day)
+
+        return self.keep_transactions_not_in_combined_files(self.PDF_file, self.PDF_fingerprints, first_transaction)
+
+    # Tell which of the transactions of a PDF, from its transaction number first_transaction, go to the combined files (None: all of them):
+    # not those already there from another PDF. The transactions of the PDF are recorded as in the combined files
+    def keep_transactions_not_in_combined_files(self, PDF_file: str, PDF_fingerprints: list[str], first_transaction: int) -> list[bool] | None:
+        if self.combined_fingerprints is None:
+            return None
+
+        combined_transactions_kept = [self.keep_transaction_in_combined_files(PDF_file, fingerprint, transaction_number)
+                                      for transaction_number, fingerprint in enumerate(PDF_fingerprints[first_transaction:], first_transaction)]
+
+        return None if all(combined_transactions_kept) else combined_transactions_kept
+
+    # Whether a transaction of a PDF goes to the combined files: not if already there from another PDF. It is then recorded as there
+    def keep_transaction_in_combined_files(self, PDF_file: str, fingerprint: str, transaction_number: int) -> bool:
+        combined_PDF_file, combined_transaction_number = self.combined_fingerprints.setdefault(fingerprint, (PDF_file, transaction_number))
+        if combined_PDF_file == PDF_file:
+            return True
+
+        self.duplicate_transactions.append([PDF_file, transaction_number + 1, combined_PDF_file, combined_transaction_number + 1, fingerprint])
+        count_statistic("Duplicate transactions left out of the combined files")
+        return False
+
+    # Add the individual files of a PDF not converted in this session (e.g. unchanged) to the combined files
+    # Its transactions already in the combined files from another PDF are left out, except from the raw text
+    @measured_stage("write combined")
+    def append_PDF_files_to_combined_files(self, SelectedPath: str, SelectedFile: str) -> None:
+        PDF_file = os.path.join(SelectedPath, SelectedFile)
+        PDF_fingerprints = statement_transaction_fingerprints.get(os.path.abspath(PDF_file))
+        combined_transactions_kept = self.keep_transactions_not_in_combined_files(PDF_file, PDF_fingerprints, 0) if PDF_fingerprints is not None else None
+
+        for output_format, output_filename in get_requested_output_filenames(SelectedFile).items():
+            if output_format not in self.combined_files:
+                continue
+
+            with open(output_filename, "r", buffering=OUTPUT_FILE_BUFFER_SIZE, newline="") as file:
+                # The combined CSV files keep the header of the first file only
+                if output_format == "csv" or (output_format == "mmx" and use_mmx_header):
+                    file.readline()
+                if combined_transactions_kept is None or output_format == "raw":
+                    shutil.copyfileobj(file, self.combined_files[output_format], OUTPUT_FILE_BUFFER_SIZE)
+                else:
+                    self.combined_files[output_format].writelines(iterate_transaction_lines_kept(file, output_format, combined_transactions_kept))
+
+    # Write the transactions of the individual files of groups of PDFs (see group_PDF_files_by_overlapping_period) to the combined
+    # files in date order: the transactions of the PDFs of a group are merged, those of a PDF staying in their order within a day.
+    # Only the current transaction of each PDF of the group is held in memory
+    @measured_stage("write combined")
+    def merge_PDF_files_into_combined_files(self, PDF_files_groups: list[list[tuple[str, str]]]) -> None:
+        self.write_lines("qif", get_QIF_header())
+        output_formats = [output_format for output_format in ("csv", "mmx", "qif") if output_format in self.combined_files]
+
+        for PDF_files_group in PDF_files_groups:
+            # The raw text has no transactions to merge
+            if "raw" in self.combined_files:
+                for SelectedPath, SelectedFile in PDF_files_group:
+                    with open(get_requested_output_filenames(SelectedFile)["raw"], "r", buffering=OUTPUT_FILE_BUFFER_SIZE, newline="") as file:
+                        shutil.copyfileobj(file, self.combined_files["raw"], OUTPUT_FILE_BUFFER_SIZE)
+
+            if not output_formats:
+                continue
+
+            with ExitStack() as individual_files:
+                PDFs_transactions = [iterate_PDF_files_transactions(SelectedPath, SelectedFile, output_formats, individual_files) for SelectedPath, SelectedFile in PDF_files_group]
+                # Equal dates come from the PDFs in the order of the group
+                transactions = heapq.merge(*PDFs_transactions, key=lambda transaction: transaction[0]) if len(PDFs_transactions) > 1 else PDFs_transactions[0]
+
+                for _, PDF_file, transaction_number, transaction_lines in transactions:
+                    if self.combined_fingerprints is not None:
+                        PDF_fingerprints = statement_transaction_fingerprints.get(os.path.abspath(PDF_file))
+                        if PDF_fingerprints is not None and not self.keep_transaction_in_combined_files(PDF_file, PDF_fingerprints[transaction_number], transaction_number):
+                            continue
+
+                    for output_format, lines in zip(output_formats, transaction_lines):
+                        self.combined_files[output_format].writelines(lines)
+
+    # Complete the combined files, and the report of the duplicate transactions left out of them
+    def close(self) -> None:
+        if self.combined_fingerprints is not None:
+            report_file = self.open_file(get_account_filename(DUPLICATE_TRANSACTIONS_REPORT_FILENAME, self.account), "duplicates")
+            csv.writer(report_file, delimiter="\t").writerows([DUPLICATE_TRANSACTIONS_REPORT_FIELDS] + self.duplicate_transactions)
+            self.close_file(report_file)
+
+        for file in self.combined_files.values():
+            self.close_file(file)
+        self.combined_files = {}
+
+    # After an error: delete the files not complete, keeping the previous versions if any
+    def discard(self) -> None:
+        for file in list(self.final_filenames):
+            file.close()
+            os.remove(file.name)
+        self.final_filenames = {}
+        self.combined_files = {}
+        self.PDF_files = {}
 
 
 #####
 # File generation functions
 # Extract info and generate files from individual PDF
-@log_wrapper
-def generate_requested_files_from_PDF(SelectedPath: str, SelectedFile: str) -> None:
+# With no writer session given, the files are written by a session of their own (without combined files)
+@measured_stage("convert PDF")
+def generate_requested_files_from_PDF(SelectedPath: str, SelectedFile: str, output_files_writer_session: OutputFilesWriterSession | None = None) -> None:
     
     # The global variable will be modified so we must allow the function to do this
     global file_generation_log_entry_already_displayed
@@ -882,45 +2267,1568 @@ def generate_requested_files_from_PDF(SelectedPath: str, SelectedFile: str) -> N
         ... #display no log or it would be overly verbose
 
     # Identify the source PDF file
-    PDF_file = SelectedPath + "\\" + SelectedFile
-    
-    # Extract the base name to use with the output requested
-    BASE_FILENAME = os.path.basename(SelectedFile).split(".")[0]
-    
-    
-    # Get the data in raw text format
-    PDF_transactions_in_text_raw_format = get_raw_text_transactions_from_PDF(PDF_file)
-    
-    # if opted to save the raw data (generally for debugging), do it
+    PDF_file = os.path.join(SelectedPath, SelectedFile)
+
+    if output_files_writer_session is None:
+        with OutputFilesWriterSession() as output_files_writer_session:
+            generate_requested_files_from_PDF(SelectedPath, SelectedFile, output_files_writer_session)
+        return
+
+    set_stage_metrics_PDF_file(PDF_file)
+    try:
+        with profile_PDF_conversion(SelectedFile):
+            output_files_writer_session.open_PDF_files(SelectedPath, SelectedFile)
+
+            if stream_conversion:
+                # Going through the transactions also writes the raw text, even when only the raw text is requested
+                output_files_writer_session.write_transactions(iterate_transactions_from_PDF(PDF_file, output_files_writer_session.write_raw_lines))
+
+            else:
+                # Get the data in raw text format
+                PDF_transactions_in_text_raw_format, PDF_non_transactions_in_text_raw_format = get_raw_text_transactions_from_PDF(PDF_file)
+
+                # The header of the statement is on its first page (not skipped)
+                record_statement_metadata(PDF_file, next((PDF_non_transaction_lines for PDF_non_transaction_lines in PDF_non_transactions_in_text_raw_format if PDF_non_transaction_lines), []))
+
+                # if opted to save the raw data (generally for debugging), do it
+                for PDF_transaction_lines in PDF_transactions_in_text_raw_format:
+                    output_files_writer_session.write_raw_lines(PDF_transaction_lines)
+
+                # If more than raw requested, adjust the PDF transactions usable for generating the CSV and QIF files
+                if output_generic_csv or output_mmx or output_qif or output_ledger:
+                    output_files_writer_session.write_transactions(get_usable_dictionary_from_PDF(PDF_transactions_in_text_raw_format, PDF_non_transactions_in_text_raw_format))
+
+            output_files_writer_session.close_PDF_files()
+    finally:
+        set_stage_metrics_PDF_file("")
+
+
+# Yield the transactions of a PDF one by one, as soon as they are final, extracting its pages only when needed
+# Only the page being processed and the transaction being recombined are kept in memory, whatever the length of the PDF
+# If given, on_PDF_transaction_lines is called with the transaction lines of each page as the pages are extracted
+def iterate_transactions_from_PDF(PDF_file: str, on_PDF_transaction_lines: Callable[[list[str]], None] | None = None) -> Iterator[Transaction]:
+    # follows the steps of get_raw_text_transactions_from_PDF and get_usable_dictionary_from_PDF
+    balances_brought_forward: list[int | None] = []
+    PDF_transactions = iterate_transactions_from_PDF_pages(PDF_file, on_PDF_transaction_lines, balances_brought_forward)
+    PDF_transactions = iterate_transactions_with_split_transaction_info_recombined(PDF_transactions)
+    PDF_transactions = iterate_transactions_with_amount_in_the_credit_or_debit_column(PDF_transactions, balances_brought_forward)
+    return iterate_transactions_with_correct_date(PDF_transactions)
+
+# Yield the transactions of each line of a PDF, page after page
+# If given, the balance brought forward of each page with transactions is appended to balances_brought_forward
+def iterate_transactions_from_PDF_pages(PDF_file: str, on_PDF_transaction_lines: Callable[[list[str]], None] | None = None,
+                                        balances_brought_forward: list[int | None] | None = None) -> Iterator[Transaction]:
+    statement_metadata_recorded = False
+
+    for PDF_page_lines in iterate_lines_from_PDF_pages(PDF_file):
+        PDF_transaction_lines, PDF_non_transaction_lines = separate_transaction_lines_of_PDF_page(PDF_page_lines)
+
+        # The header of the statement is on its first page (not skipped)
+        if not statement_metadata_recorded and PDF_page_lines:
+            record_statement_metadata(PDF_file, PDF_non_transaction_lines)
+            statement_metadata_recorded = True
+
+        if balances_brought_forward is not None and PDF_transaction_lines:
+            balances_brought_forward.append(find_balance_brought_forward([PDF_non_transaction_lines]))
+
+        if on_PDF_transaction_lines:
+            on_PDF_transaction_lines(PDF_transaction_lines)
+
+        # The column positions are in the header row of the page, with the non-transaction lines
+        columns = find_transaction_columns_in_PDF_page(PDF_non_transaction_lines) if line_parser_engine == "columns" else None
+
+        yield from iterate_transactions_from_PDF_page_lines(PDF_transaction_lines, columns)
+
+
+#####
+# Manifest functions
+# The manifest records the PDFs already converted, so that a folder conversion only converts the new or changed ones.
+# Each PDF converted is first appended to the journal, so an interrupted conversion resumes where it stopped
+MANIFEST_VERSION = 1
+# Version of the content of the individual files: to increase with any change of the conversion changing the transactions
+# converted (pages extracted, lines parsed, amounts placed...), so that the PDFs converted by the previous versions are converted again
+CONVERSION_OUTPUT_VERSION = 2
+
+# Settings changing the content of the generated files. If any differs from the manifest, the PDF is converted again
+def get_manifest_settings() -> dict[str, str | bool | int]:
+    return {
+        "version": __version__,
+        "output_version": CONVERSION_OUTPUT_VERSION,
+        "use_mmx_header": use_mmx_header,
+        "text_extraction_engine": text_extraction_engine,
+        "line_parser_engine": line_parser_engine,
+        "skip_non_transaction_pages": skip_non_transaction_pages,
+        "stop_after_last_transaction_page": stop_after_last_transaction_page,
+        "stream_conversion": stream_conversion,
+    }
+
+# Name of the individual files of a PDF, from its path in the folder (or zip archive) selected, e.g. 2023/Statement.pdf
+# or Statements_2023.zip/January.pdf: 2023_Statement or Statements_2023_January. A PDF of the folder keeps its own name
+def get_output_base_filename(SelectedFile: str) -> str:
+    *PDF_folders, PDF_filename = os.path.normpath(SelectedFile).split(os.sep)
+    PDF_folders = [PDF_folder[:-len(ARCHIVE_EXTENSION)] if PDF_folder.lower().endswith(ARCHIVE_EXTENSION) else PDF_folder for PDF_folder in PDF_folders]
+    return "_".join(PDF_folders + [PDF_filename.split(".")[0]])
+
+# The individual files generated for a PDF with the formats currently requested
+def get_requested_output_filenames(SelectedFile: str) -> dict[str, str]:
+    BASE_FILENAME = get_output_base_filename(SelectedFile)
+
+    output_filenames: dict[str, str] = {}
     if output_raw:
-        output_raw_filename = OUTPUT_FOLDER_RAW + "\\" + BASE_FILENAME + OUTPUT_EXTENSION_RAW
-        Save_PDF_transactions_in_raw_TXT_format_file(PDF_transactions_in_text_raw_format, output_raw_filename)
-    
-    
-    # If more than raw requested, adjust the PDF transactions in a dictionary usable for generating the CSV and QIF files
-    if output_generic_csv or output_mmx or output_qif:
-        PDF_transactions_in_dictionary_format = get_usable_dictionary_from_PDF(PDF_transactions_in_text_raw_format)
-    
+        output_filenames["raw"] = os.path.join(OUTPUT_FOLDER_RAW, BASE_FILENAME + OUTPUT_EXTENSION_RAW)
     if output_generic_csv:
-        output_generic_csv_filename = OUTPUT_FOLDER_CSV + "\\" + BASE_FILENAME + OUTPUT_EXTENSION_CSV
-        save_PDF_transactions_in_generic_CSV_format_file(PDF_transactions_in_dictionary_format, output_generic_csv_filename)
-    
-    
-    # If mmx CSV or QIF requested, adjust amounts so that they are pos/neg in one column instead of one col for in and one for out
-    if output_mmx or output_qif:
-        PDF_transactions_in_dictionary_format_with_one_amounts_column = change_amounts_to_one_column_with_pos_or_neg_values(PDF_transactions_in_dictionary_format)
-    
+        output_filenames["csv"] = os.path.join(OUTPUT_FOLDER_CSV, BASE_FILENAME + OUTPUT_EXTENSION_CSV)
     if output_mmx:
-        output_mmx_filename = OUTPUT_FOLDER_MMX + "\\" + BASE_FILENAME + OUTPUT_EXTENSION_MMX
-        save_PDF_transactions_in_mmx_CSV_format_file(PDF_transactions_in_dictionary_format_with_one_amounts_column, output_mmx_filename)
-    
+        output_filenames["mmx"] = os.path.join(OUTPUT_FOLDER_MMX, BASE_FILENAME + OUTPUT_EXTENSION_MMX)
     if output_qif:
-        output_qif_filename = OUTPUT_FOLDER_QIF + "\\" + BASE_FILENAME + OUTPUT_EXTENSION_QIF
-        save_PDF_transactions_in_QIF_format_file(PDF_transactions_in_dictionary_format_with_one_amounts_column, output_qif_filename)
+        output_filenames["qif"] = os.path.join(OUTPUT_FOLDER_QIF, BASE_FILENAME + OUTPUT_EXTENSION_QIF)
+    # One database for all the PDFs
+    if output_ledger:
+        output_filenames["ledger"] = LEDGER_FILENAME
+
+    return output_filenames
+
+# Check that no two PDFs would be converted into the same individual files (e.g. a/b_c.pdf and a_b/c.pdf, or Statement.pdf
+# of two folders given on the command line), the second overwriting the first
+def check_PDF_output_filenames_are_unique(pdf_files: list[tuple[str, str]]) -> None:
+    PDF_files_by_output_filename: dict[str, str] = {}
+
+    for SelectedPath, SelectedFile in pdf_files:
+        PDF_file = os.path.join(SelectedPath, SelectedFile)
+        for output_format, output_filename in get_requested_output_filenames(SelectedFile).items():
+            # One database for all the PDFs
+            if output_format == "ledger":
+                continue
+            other_PDF_file = PDF_files_by_output_filename.setdefault(os.path.normcase(output_filename), PDF_file)
+            if other_PDF_file != PDF_file:
+                raise ValueError(f"{other_PDF_file} and {PDF_file} would both be converted into {output_filename}: rename one of them")
+
+# Hash of the content of a PDF
+def get_PDF_file_hash(PDF_filename: str) -> str:
+    PDF_hash = hashlib.sha256()
+    with open_PDF(PDF_filename) as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            PDF_hash.update(chunk)
+    return PDF_hash.hexdigest()
+
+# Load the manifest, completed with the PDFs recorded in the journal by a conversion that did not finish
+@measured_stage("manifest")
+def load_manifest() -> dict[str, dict]:
+    log("Loading the manifest of the PDFs already converted")
+
+    manifest: dict[str, dict] = {}
+
+    try:
+        with open(MANIFEST_FILENAME, "r", encoding="utf-8") as manifest_file:
+            manifest_content = json.load(manifest_file)
+        if manifest_content.get("manifest_version") == MANIFEST_VERSION:
+            manifest = manifest_content["statements"]
+    except (OSError, ValueError, KeyError):
+        # No manifest yet, or unreadable: everything will be converted
+        pass
+
+    try:
+        with open(MANIFEST_JOURNAL_FILENAME, "r", encoding="utf-8") as journal_file:
+            for journal_line in journal_file:
+                try:
+                    manifest_entry = json.loads(journal_line)
+                except ValueError:
+                    # Last line partially written when the conversion was interrupted
+                    break
+                manifest[manifest_entry["pdf"]] = manifest_entry
+    except OSError:
+        pass
+
+    return manifest
+
+# Write the manifest (through a temporary file so it is never left partially written) and clear the journal it now includes
+@measured_stage("manifest")
+def save_manifest(manifest: dict[str, dict]) -> None:
+    log("Saving the manifest of the PDFs converted")
+
+    temporary_filename = MANIFEST_FILENAME + ".tmp"
+    with open(temporary_filename, "w", encoding="utf-8") as manifest_file:
+        json.dump({"manifest_version": MANIFEST_VERSION, "statements": manifest}, manifest_file, indent=1)
+    os.replace(temporary_filename, MANIFEST_FILENAME)
+
+    if os.path.exists(MANIFEST_JOURNAL_FILENAME):
+        os.remove(MANIFEST_JOURNAL_FILENAME)
+
+# Record a PDF that has just been converted, in the manifest and straight away in the journal
+@measured_stage("manifest")
+def record_PDF_in_manifest(manifest: dict[str, dict], SelectedPath: str, SelectedFile: str) -> None:
+    PDF_filename = os.path.abspath(os.path.join(SelectedPath, SelectedFile))
+    PDF_size, PDF_time = get_PDF_size_and_time(PDF_filename)
+
+    manifest_entry = {
+        "pdf": PDF_filename,
+        "size": PDF_size,
+        "mtime": PDF_time,
+        "sha256": get_PDF_file_hash(PDF_filename),
+        "settings": get_manifest_settings(),
+        "outputs": get_requested_output_filenames(SelectedFile),
+    }
+    if PDF_filename in statements_metadata:
+        manifest_entry["statement"] = asdict(statements_metadata[PDF_filename])
+    manifest[PDF_filename] = manifest_entry
+
+    with open(MANIFEST_JOURNAL_FILENAME, "a", encoding="utf-8") as journal_file:
+        journal_file.write(json.dumps(manifest_entry) + "\n")
+
+# Check whether a PDF has already been converted, unchanged, into all the files requested
+def PDF_is_up_to_date_in_manifest(manifest: dict[str, dict], SelectedPath: str, SelectedFile: str) -> bool:
+    PDF_filename = os.path.abspath(os.path.join(SelectedPath, SelectedFile))
+    manifest_entry = manifest.get(PDF_filename)
+
+    if not manifest_entry or manifest_entry["settings"] != get_manifest_settings():
+        return False
+
+    # Converted without the fingerprints of its transactions, needed to leave the duplicates out of the combined files
+    if transaction_fingerprints_needed() and PDF_filename not in statement_transaction_fingerprints:
+        return False
+
+    for output_format, output_filename in get_requested_output_filenames(SelectedFile).items():
+        if manifest_entry["outputs"].get(output_format) != output_filename or not os.path.exists(output_filename):
+            return False
+
+    PDF_size, PDF_time = get_PDF_size_and_time(PDF_filename)
+    if PDF_size != manifest_entry["size"]:
+        return False
+
+    # Same size and date: unchanged. Same size but another date (e.g. downloaded again): compare the content
+    if PDF_time != manifest_entry["mtime"]:
+        if get_PDF_file_hash(PDF_filename) != manifest_entry["sha256"]:
+            return False
+        manifest_entry["mtime"] = PDF_time
+
+    return True
 
-        
 
-def main() -> int:
+#####
+# Duplicate transactions functions
+# Overlapping statements (e.g. a statement downloaded twice, or a monthly statement and a yearly export) have transactions in common,
+# which would otherwise be in the combined files twice. Each transaction has a fingerprint (see get_transaction_fingerprint), and
+# the fingerprints of each statement are kept in TRANSACTION_FINGERPRINTS_FILENAME, so that the statements not converted again
+# are checked too. As the combined files are written, the statement of each fingerprint is recorded: a transaction whose
+# fingerprint is already there from another statement is left out, and listed in DUPLICATE_TRANSACTIONS_REPORT_FILENAME
+TRANSACTION_FINGERPRINTS_VERSION = 1
+DUPLICATE_TRANSACTIONS_REPORT_FIELDS = ["pdf", "transaction", "duplicate_of_pdf", "duplicate_of_transaction", "fingerprint"]
+
+# Fingerprints of the transactions of each statement converted, in the order of its transactions, by PDF file (absolute path)
+statement_transaction_fingerprints: dict[str, list[str]] = {}
+
+# Whether the fingerprints of the transactions are needed: combined files without duplicates requested
+def transaction_fingerprints_needed() -> bool:
+    return combine_all_output_statements and skip_duplicate_transactions_in_combined_files
+
+# Fingerprint of a transaction (with its date set): its date, type, detail, amount, balance (if printed on its line)
+# and position among the transactions of its day in the statement, so that two identical payments the same day are told apart
+def get_transaction_fingerprint(transaction: Transaction, position_in_day: int) -> str:
+    transaction_fields = (transaction.date, transaction.type, transaction.detail, transaction.paid_out, transaction.paid_in, transaction.balance, position_in_day)
+    return hashlib.blake2b("\t".join(str(field or "") for field in transaction_fields).encode(), digest_size=8).hexdigest()
+
+# The rows (or lines) of the transactions of a batch which go to the combined files (combined_rows_kept None: all of them)
+def keep_combined_rows(rows: list, combined_rows_kept: list[bool] | None) -> list:
+    return rows if combined_rows_kept is None else list(itertools.compress(rows, combined_rows_kept))
+
+# Lines of the individual file of a PDF (after its CSV header) with only the transactions kept: the QIF header if QIF,
+# then the lines of the transactions kept (see iterate_individual_file_transactions_lines)
+def iterate_transaction_lines_kept(file: TextIO, output_format: str, transactions_kept: list[bool]) -> Iterator[str]:
+    if output_format == "qif":
+        yield file.readline()
+
+    for transaction_lines, transaction_kept in zip(iterate_individual_file_transactions_lines(file, output_format), transactions_kept):
+        if transaction_kept:
+            yield from transaction_lines
+
+# Load the fingerprints of the statements converted by previous runs, keeping those of the statements converted since
+@measured_stage("duplicates")
+def load_transaction_fingerprints() -> None:
+    log("Loading the fingerprints of the transactions of the statements already converted")
+
+    try:
+        with open(TRANSACTION_FINGERPRINTS_FILENAME, "r", encoding="utf-8") as fingerprints_file:
+            fingerprints_content = json.load(fingerprints_file)
+        if fingerprints_content.get("fingerprints_version") == TRANSACTION_FINGERPRINTS_VERSION:
+            for PDF_filename, PDF_fingerprints in fingerprints_content["statements"].items():
+                statement_transaction_fingerprints.setdefault(PDF_filename, PDF_fingerprints)
+    except (OSError, ValueError, KeyError):
+        # No fingerprints yet, or unreadable: the statements are converted again (see PDF_is_up_to_date_in_manifest)
+        pass
+
+# Write the fingerprints (through a temporary file so they are never left partially written), without those of the PDFs gone
+@measured_stage("duplicates")
+def save_transaction_fingerprints() -> None:
+    log("Saving the fingerprints of the transactions")
+
+    statements = {PDF_filename: PDF_fingerprints for PDF_filename, PDF_fingerprints in statement_transaction_fingerprints.items()
+                  if PDF_source_exists(PDF_filename)}
+
+    temporary_filename = TRANSACTION_FINGERPRINTS_FILENAME + ".tmp"
+    with open(temporary_filename, "w", encoding="utf-8") as fingerprints_file:
+        json.dump({"fingerprints_version": TRANSACTION_FINGERPRINTS_VERSION, "statements": statements}, fingerprints_file)
+    os.replace(temporary_filename, TRANSACTION_FINGERPRINTS_FILENAME)
+
+
+#####
+# Date order functions
+# The combined files are in date order (combine_in_date_order switch) whatever the order of the PDF files: once the individual
+# files of the statements are generated, the statements are ordered by their period (see StatementMetadata), and the transactions
+# of the statements whose periods overlap (e.g. a monthly statement and a yearly export) are merged by date with a heap, one
+# transaction of each statement at a time
+
+# The PDF files (as in pdf_files) in groups of PDF files whose periods overlap, in the order of their periods (then of pdf_files)
+# The PDF files whose period is not known come last, in one group
+def group_PDF_files_by_overlapping_period(pdf_files: list[tuple[str, str]], manifest: dict[str, dict]) -> list[list[tuple[str, str]]]:
+    PDF_files_periods: list[tuple[str, str, tuple[str, str]]] = []
+    PDF_files_without_period: list[tuple[str, str]] = []
+    for SelectedPath, SelectedFile in pdf_files:
+        statement_metadata = get_statement_metadata(SelectedPath, SelectedFile, manifest)
+        if statement_metadata.period_start and statement_metadata.period_end:
+            PDF_files_periods.append((statement_metadata.period_start, statement_metadata.period_end, (SelectedPath, SelectedFile)))
+        else:
+            PDF_files_without_period.append((SelectedPath, SelectedFile))
+
+    PDF_files_groups: list[list[tuple[str, str]]] = []
+    group_period_end = ""
+    for period_start, period_end, pdf_file in sorted(PDF_files_periods, key=lambda PDF_file_period: PDF_file_period[:2]):
+        if PDF_files_groups and period_start <= group_period_end:
+            PDF_files_groups[-1].append(pdf_file)
+            group_period_end = max(group_period_end, period_end)
+        else:
+            PDF_files_groups.append([pdf_file])
+            group_period_end = period_end
+
+    if PDF_files_without_period:
+        PDF_files_groups.append(PDF_files_without_period)
+
+    return PDF_files_groups
+
+# Lines of each transaction of an individual file, after its header: its line, or for QIF its lines down to its "^" line
+def iterate_individual_file_transactions_lines(file: TextIO, output_format: str) -> Iterator[list[str]]:
+    if output_format != "qif":
+        for line in file:
+            yield [line]
+        return
+
+    transaction_lines: list[str] = []
+    for line in file:
+        transaction_lines.append(line)
+        if line.rstrip("\r\n") == "^":
+            yield transaction_lines
+            transaction_lines = []
+
+# Date of a transaction as YYYY-MM-DD, from its date in an individual file. Empty if not a date
+@functools.lru_cache(maxsize=4096)
+def get_sortable_date(date: str, date_format: str) -> str:
+    try:
+        return datetime.strptime(date, date_format).strftime("%Y-%m-%d")
+    except ValueError:
+        return ""
+
+# Transactions of the individual files of a PDF, read in step (opened in individual_files): for each, its date (YYYY-MM-DD),
+# the PDF file, its number in the PDF and its lines in each of output_formats. A transaction without date keeps the previous one
+def iterate_PDF_files_transactions(SelectedPath: str, SelectedFile: str, output_formats: list[str], individual_files: ExitStack) -> Iterator[tuple[str, str, int, tuple[list[str], ...]]]:
+    PDF_file = os.path.join(SelectedPath, SelectedFile)
+    output_filenames = get_requested_output_filenames(SelectedFile)
+
+    files_transactions_lines = []
+    for output_format in output_formats:
+        file = individual_files.enter_context(open(output_filenames[output_format], "r", buffering=OUTPUT_FILE_BUFFER_SIZE, newline=""))
+        # Headers: generic CSV, MoneyManagerEx CSV if requested, QIF
+        if output_format != "mmx" or use_mmx_header:
+            file.readline()
+        files_transactions_lines.append(iterate_individual_file_transactions_lines(file, output_format))
+
+    # The date starts the first line of each transaction: DD Mon YY in the CSV files, D followed by DD/MM/YY in the QIF file
+    date_from_QIF = output_formats[0] == "qif"
+    date = ""
+    for transaction_number, transaction_lines in enumerate(zip(*files_transactions_lines)):
+        first_line = transaction_lines[0][0]
+        if date_from_QIF:
+            date = get_sortable_date(first_line[1:].rstrip("\r\n"), "%d/%m/%y") or date
+        else:
+            date = get_sortable_date(first_line.split("\t", 1)[0], "%d %b %y") or date
+        yield date, PDF_file, transaction_number, transaction_lines
+
+
+#####
+# Ledger functions
+# The ledger is a SQLite database of the transactions of all the PDFs converted, to query them without the PDFs or the files generated
+# Amounts are in pence, dates as YYYY-MM-DD so that they sort and compare as dates
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    statement_hash TEXT PRIMARY KEY,
+    statement_filename TEXT NOT NULL,
+    imported TEXT NOT NULL,
+    transactions INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    statement_hash TEXT NOT NULL REFERENCES statements (statement_hash),
+    line INTEGER NOT NULL,
+    date TEXT,
+    type TEXT,
+    payee TEXT COLLATE NOCASE,
+    paid_out INTEGER,
+    paid_in INTEGER,
+    balance INTEGER,
+    amount INTEGER,
+    UNIQUE (statement_hash, line)
+);
+CREATE INDEX IF NOT EXISTS transactions_by_date ON transactions (date);
+CREATE INDEX IF NOT EXISTS transactions_by_type ON transactions (type, date);
+CREATE INDEX IF NOT EXISTS transactions_by_payee ON transactions (payee, date);
+"""
+
+# Open the ledger, creating it if needed
+def open_ledger() -> sqlite3.Connection:
+    # Parallel conversions wait for each other to write
+    ledger = sqlite3.connect(LEDGER_FILENAME, timeout=60)
+    ledger.executescript(LEDGER_SCHEMA)
+    return ledger
+
+# One transaction as a row of the transactions table, line being its position in its statement
+def get_ledger_row(statement_hash: str, line: int, transaction: Transaction) -> tuple:
+    return (
+        statement_hash,
+        line,
+        datetime.strptime(transaction.date, "%d %b %y").strftime("%Y-%m-%d") if transaction.date else None,
+        transaction.type,
+        transaction.detail,
+        get_amount_in_pence(transaction.paid_out) if transaction.paid_out else None,
+        get_amount_in_pence(transaction.paid_in) if transaction.paid_in else None,
+        get_amount_in_pence(transaction.balance) if transaction.balance else None,
+        transaction.amount,
+    )
+
+# Replace the transactions of a statement in the ledger, all at once
+# A statement is identified by the hash of its PDF, so importing it again (even renamed) does not duplicate its transactions
+@measured_stage("write ledger")
+def load_transactions_into_ledger(PDF_file: str, PDF_transactions: Iterable[Transaction]) -> None:
+    log("Loading the transactions into the ledger")
+
+    statement_hash = get_PDF_file_hash(PDF_file)
+    ledger_rows = [get_ledger_row(statement_hash, line, transaction) for line, transaction in enumerate(PDF_transactions)]
+
+    ledger = open_ledger()
+    try:
+        # One database transaction: the statement is either fully replaced or not at all
+        with ledger:
+            ledger.execute("DELETE FROM transactions WHERE statement_hash = ?", (statement_hash,))
+            ledger.execute(
+                "INSERT OR REPLACE INTO statements (statement_hash, statement_filename, imported, transactions) VALUES (?, ?, ?, ?)",
+                (statement_hash, os.path.basename(PDF_file), datetime.now().isoformat(timespec="seconds"), len(ledger_rows)),
+            )
+            ledger.executemany(
+                "INSERT INTO transactions (statement_hash, line, date, type, payee, paid_out, paid_in, balance, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ledger_rows,
+            )
+    finally:
+        ledger.close()
+
+# Amount in pence as in the PDF (e.g. "1,234.50", or "1,234.50 D" for an overdrawn balance), None if no amount
+def format_ledger_amount(amount: int | None) -> str | None:
+    if amount is None:
+        return None
+
+    pounds, pence = divmod(abs(amount), 100)
+    return f"{pounds:,}.{pence:02d} {OVERDRAWN_BALANCE_SUFFIX}" if amount < 0 else f"{pounds:,}.{pence:02d}"
+
+def query_ledger(
+    payee: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    transaction_type: str | None = None,
+) -> list[Transaction]:
+    """Transactions of the ledger, in date order (then in statement order).
+
+    payee: only the transactions whose payee starts with this text (case insensitive)
+    date_from, date_to: only the transactions between these dates (YYYY-MM-DD), included
+    transaction_type: only the transactions of this type (e.g. "DD", "VIS")"""
+
+    conditions: list[str] = []
+    parameters: list[str] = []
+
+    if payee:
+        # Escaped so that the payee is a plain prefix, and the payee index can be used
+        conditions.append("transactions.payee LIKE ? ESCAPE '\\'")
+        parameters.append(payee.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if date_from:
+        conditions.append("transactions.date >= ?")
+        parameters.append(date_from)
+    if date_to:
+        conditions.append("transactions.date <= ?")
+        parameters.append(date_to)
+    if transaction_type:
+        conditions.append("transactions.type = ?")
+        parameters.append(transaction_type)
+
+    query = (
+        "SELECT transactions.date, transactions.type, transactions.payee, transactions.paid_out, transactions.paid_in, transactions.balance, transactions.amount"
+        " FROM transactions JOIN statements USING (statement_hash)"
+        + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        + " ORDER BY transactions.date, statements.statement_filename, transactions.line"
+    )
+
+    if not os.path.exists(LEDGER_FILENAME):
+        return []
+
+    ledger = open_ledger()
+    try:
+        return [
+            Transaction(
+                date=datetime.strptime(date, "%Y-%m-%d").strftime("%d %b %y") if date else None,
+                type=transaction_type,
+                detail=payee,
+                paid_out=format_ledger_amount(paid_out),
+                paid_in=format_ledger_amount(paid_in),
+                balance=format_ledger_amount(balance),
+                amount=amount,
+            )
+            for date, transaction_type, payee, paid_out, paid_in, balance, amount in ledger.execute(query, parameters)
+        ]
+    finally:
+        ledger.close()
+
+def export_ledger(
+    formats: tuple[str, ...] | list[str] = ("csv",),
+    csv_stream: TextIO | None = None,
+    payee: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    transaction_type: str | None = None,
+) -> list[str]:
+    """Generate files from the transactions of the ledger instead of the PDFs.
+
+    formats: files to generate, any of "csv", "mmx" and "qif", named after LEDGER_QUERY_BASE_FILENAME
+    csv_stream: if provided (e.g. sys.stdout), write the transactions to it as generic CSV instead of generating files
+    payee, date_from, date_to, transaction_type: which transactions, see query_ledger
+
+    Returns the files generated"""
+
+    global output_generic_csv, output_mmx, output_qif, output_raw, output_ledger
+
+    unknown_formats = set(formats) - {"csv", "mmx", "qif"}
+    if unknown_formats:
+        raise ValueError(f"Output format(s) not available from the ledger: {', '.join(sorted(unknown_formats))}")
+
+    ledger_transactions = query_ledger(payee, date_from, date_to, transaction_type)
+
+    if csv_stream is not None:
+        write_PDF_transactions_in_generic_CSV_format_to_stream(ledger_transactions, csv_stream, include_header=True)
+        return []
+
+    # The file names and folders follow the switches, so set them for the time of the export only
+    previous_switches = (output_generic_csv, output_mmx, output_qif, output_raw, output_ledger)
+    output_generic_csv, output_mmx, output_qif, output_raw, output_ledger = "csv" in formats, "mmx" in formats, "qif" in formats, False, False
+
+    try:
+        create_output_folders()
+        output_filenames = get_requested_output_filenames(LEDGER_QUERY_BASE_FILENAME)
+
+        with OutputFilesWriterSession() as output_files_writer_session:
+            output_files_writer_session.open_PDF_files(OUTPUT_FOLDER_GENERIC, LEDGER_QUERY_BASE_FILENAME)
+            output_files_writer_session.write_transactions(ledger_transactions)
+            output_files_writer_session.close_PDF_files()
+    finally:
+        output_generic_csv, output_mmx, output_qif, output_raw, output_ledger = previous_switches
+
+    return list(output_filenames.values())
+
+
+#####
+# Parallel conversion functions
+# Snapshot of the switches the conversion depends on.
+# Worker processes do not necessarily inherit the user selections (e.g. on Windows, where they are spawned) so they are handed over
+def get_conversion_switches() -> dict[str, bool]:
+    return {
+        "output_raw": output_raw,
+        "output_generic_csv": output_generic_csv,
+        "output_mmx": output_mmx,
+        "output_qif": output_qif,
+        "output_ledger": output_ledger,
+        "use_mmx_header": use_mmx_header,
+        "combine_all_output_statements": combine_all_output_statements,
+        "skip_duplicate_transactions_in_combined_files": skip_duplicate_transactions_in_combined_files,
+        "combine_in_date_order": combine_in_date_order,
+        "show_log": show_log,
+        "use_page_text_cache": use_page_text_cache,
+        "skip_non_transaction_pages": skip_non_transaction_pages,
+        "stop_after_last_transaction_page": stop_after_last_transaction_page,
+        "text_extraction_engine": text_extraction_engine,
+        "line_parser_engine": line_parser_engine,
+        "stream_conversion": stream_conversion,
+        "collect_stage_metrics": collect_stage_metrics,
+        "trace_stage_memory": trace_stage_memory,
+        "PDF_profiles_folder": PDF_profiles_folder,
+    }
+
+# Worker process initialiser: apply the switches of the parent process
+def set_conversion_switches(switches: dict[str, bool]) -> None:
+    global file_generation_log_entry_already_displayed
+    global page_extraction_workers
+    global conversion_workers
+
+    globals().update(switches)
+
+    # The parent process is the only one writing to the combined files (see generate_requested_files_from_PDFs)
+    file_generation_log_entry_already_displayed = True
+
+    # The PDFs (or the accounts) are already converted in parallel, one per process
+    page_extraction_workers = 1
+    conversion_workers = 1
+
+    if collect_stage_metrics and trace_stage_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# Worker process task: generate the individual files of one PDF, returning the results of its conversion (see get_worker_conversion_results)
+def generate_requested_files_from_PDF_in_worker(SelectedPath: str, SelectedFile: str) -> tuple:
+    clear_worker_conversion_results()
+    generate_requested_files_from_PDF(SelectedPath, SelectedFile)
+    return SelectedPath, SelectedFile, *get_worker_conversion_results()
+
+# Start a worker process task with no results from the previous ones
+def clear_worker_conversion_results() -> None:
+    conversion_statistics.clear()
+    stage_metrics.clear()
+    statement_transaction_fingerprints.clear()
+    statements_metadata.clear()
+
+# Results of the conversions of a worker process task for the parent process: statistics, stage metrics,
+# fingerprints of the transactions and metadata of the statements
+def get_worker_conversion_results() -> tuple[dict[str, int], dict[tuple[str, str], list], dict[str, list[str]], dict[str, StatementMetadata]]:
+    return dict(conversion_statistics), dict(stage_metrics), dict(statement_transaction_fingerprints), dict(statements_metadata)
+
+# Add the results of the conversions of a worker process task (see get_worker_conversion_results) to those of the parent process
+def merge_worker_conversion_results(worker_conversion_statistics: dict[str, int], worker_stage_metrics: dict[tuple[str, str], list],
+                                    worker_transaction_fingerprints: dict[str, list[str]], worker_statements_metadata: dict[str, StatementMetadata]) -> None:
+    for name, count in worker_conversion_statistics.items():
+        count_statistic(name, count)
+    for (PDF_file, stage), metrics in worker_stage_metrics.items():
+        merge_stage_metrics(stage_metrics.setdefault((PDF_file, stage), [0, 0, 0.0, 0.0, 0]), metrics)
+    statement_transaction_fingerprints.update(worker_transaction_fingerprints)
+    statements_metadata.update(worker_statements_metadata)
+
+# Convert several PDFs in several processes, calling on_PDF_converted for each as soon as it is done
+@measured_stage("parallel conversion")
+def generate_requested_files_from_PDFs_in_parallel(pdf_files: list[tuple[str, str]], workers: int, on_PDF_converted: Callable[[str, str], None]) -> None:
+    log(f"Converting {len(pdf_files)} PDF files with {workers} processes")
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_conversion_switches, initargs=(get_conversion_switches(),)) as executor:
+        conversions = [executor.submit(generate_requested_files_from_PDF_in_worker, SelectedPath, SelectedFile) for SelectedPath, SelectedFile in pdf_files]
+
+        # In the order they finish, so that an interruption loses as little work as possible
+        for conversion in as_completed(conversions):
+            SelectedPath, SelectedFile, *worker_conversion_results = conversion.result()
+            merge_worker_conversion_results(*worker_conversion_results)
+            on_PDF_converted(SelectedPath, SelectedFile)
+
+
+#####
+# Several PDFs conversion functions
+# Convert several PDFs (only the new or changed ones if incremental), then regenerate the combined files if requested
+@measured_stage("convert PDFs")
+def generate_requested_files_from_PDFs(pdf_files: list[tuple[str, str]]) -> None:
+    log(f"Converting {len(pdf_files)} PDF files")
+    check_PDF_output_filenames_are_unique(pdf_files)
+
+    if transaction_fingerprints_needed():
+        load_transaction_fingerprints()
+
+    if incremental_conversion:
+        manifest = load_manifest()
+        pdf_files_to_convert = [(SelectedPath, SelectedFile) for SelectedPath, SelectedFile in pdf_files
+                                if not PDF_is_up_to_date_in_manifest(manifest, SelectedPath, SelectedFile)]
+        print(f"{len(pdf_files) - len(pdf_files_to_convert)} PDF files unchanged since their last conversion, {len(pdf_files_to_convert)} to convert")
+    else:
+        manifest = {}
+        pdf_files_to_convert = pdf_files
+
+    def on_PDF_converted(SelectedPath: str, SelectedFile: str) -> None:
+        record_PDF_in_manifest(manifest, SelectedPath, SelectedFile)
+
+    # The metadata of the PDFs changed since their last conversion is read again
+    for SelectedPath, SelectedFile in pdf_files_to_convert:
+        statements_metadata.pop(os.path.abspath(os.path.join(SelectedPath, SelectedFile)), None)
+
+    # With combined files per account, the statements of each account are a shard with its own combined files
+    if combine_all_output_statements and combine_per_account:
+        PDF_files_shards = group_PDF_files_by_account(pdf_files, manifest)
+        if conversion_workers > 1 and len(PDF_files_shards) > 1:
+            generate_account_shards_in_parallel(PDF_files_shards, pdf_files_to_convert, manifest, conversion_workers)
+        else:
+            PDF_files_to_convert = set(pdf_files_to_convert)
+            for account, PDF_files_shard in PDF_files_shards.items():
+                generate_requested_files_from_PDFs_shard(PDF_files_shard, [pdf_file for pdf_file in PDF_files_shard if pdf_file in PDF_files_to_convert], on_PDF_converted, manifest, account)
+    else:
+        generate_requested_files_from_PDFs_shard(pdf_files, pdf_files_to_convert, on_PDF_converted, manifest)
+
+    save_manifest(manifest)
+    if transaction_fingerprints_needed():
+        save_transaction_fingerprints()
+
+# Convert the PDFs to convert of pdf_files, then generate the combined files of pdf_files if requested (those of an account, if given)
+# The statements periods are in manifest (or in statements_metadata) for the combined files in date order
+def generate_requested_files_from_PDFs_shard(pdf_files: list[tuple[str, str]], pdf_files_to_convert: list[tuple[str, str]],
+                                             on_PDF_converted: Callable[[str, str], None], manifest: dict[str, dict], account: str | None = None) -> None:
+    # In the order of pdf_files, the combined files are written with the individual files, and include the PDFs not converted again
+    # from their individual files. In date order, they are written from all the individual files once complete
+    combine_in_order_of_PDF_files = combine_all_output_statements and not combine_in_date_order
+    with OutputFilesWriterSession(combine=combine_in_order_of_PDF_files, account=account) as output_files_writer_session:
+        if conversion_workers > 1 and len(pdf_files_to_convert) > 1:
+            generate_requested_files_from_PDFs_in_parallel(pdf_files_to_convert, conversion_workers, on_PDF_converted)
+            PDF_files_converted = set()
+        else:
+            PDF_files_converted = set(pdf_files_to_convert)
+
+        for SelectedPath, SelectedFile in pdf_files:
+            # Converted here: written to the individual and combined files at once
+            if (SelectedPath, SelectedFile) in PDF_files_converted:
+                generate_requested_files_from_PDF(SelectedPath, SelectedFile, output_files_writer_session)
+                on_PDF_converted(SelectedPath, SelectedFile)
+            elif output_files_writer_session.combine:
+                output_files_writer_session.append_PDF_files_to_combined_files(SelectedPath, SelectedFile)
+
+    if combine_all_output_statements and combine_in_date_order:
+        with OutputFilesWriterSession(combine=True, account=account) as output_files_writer_session:
+            output_files_writer_session.merge_PDF_files_into_combined_files(group_PDF_files_by_overlapping_period(pdf_files, manifest))
+
+
+#####
+# Account functions
+# The statements of several accounts can be in the same folder. The account (sort code and account number) and period of each
+# statement are parsed once from the header of its first page, and kept in the manifest. The combined files can then be
+# generated per account (combine_per_account switch), each account being a shard converted independently of the others
+
+# Metadata of each statement, by PDF file (absolute path): parsed during its conversion, or read from its first page
+statements_metadata: dict[str, StatementMetadata] = {}
+
+# Metadata of a statement from its first page only, without extracting the others
+@measured_stage("metadata")
+def read_statement_metadata_from_PDF(PDF_filename: str) -> StatementMetadata:
+    PDF_pages_lines = iterate_lines_from_PDF_pages(PDF_filename)
+    try:
+        for PDF_page_lines in PDF_pages_lines:
+            # The header of the statement is on its first page (not skipped)
+            if PDF_page_lines:
+                return parse_statement_metadata(separate_transaction_lines_of_PDF_page(PDF_page_lines)[1])
+    finally:
+        PDF_pages_lines.close()
+
+    return StatementMetadata()
+
+# Metadata of a statement: from its conversion in this run, from the manifest if the PDF has not changed since its conversion,
+# or else from its first page
+def get_statement_metadata(SelectedPath: str, SelectedFile: str, manifest: dict[str, dict]) -> StatementMetadata:
+    PDF_filename = os.path.abspath(os.path.join(SelectedPath, SelectedFile))
+    if PDF_filename in statements_metadata:
+        return statements_metadata[PDF_filename]
+
+    manifest_entry = manifest.get(PDF_filename)
+    if manifest_entry and (manifest_entry["size"], manifest_entry["mtime"]) != get_PDF_size_and_time(PDF_filename):
+        manifest_entry = None
+
+    if manifest_entry and "statement" in manifest_entry:
+        statement_metadata = StatementMetadata(**manifest_entry["statement"])
+    else:
+        statement_metadata = read_statement_metadata_from_PDF(PDF_filename)
+        # Converted before its metadata was recorded: recorded now, for the next runs
+        if manifest_entry:
+            manifest_entry["statement"] = asdict(statement_metadata)
+
+    statements_metadata[PDF_filename] = statement_metadata
+    return statement_metadata
+
+# The PDF files of each account, in the order of pdf_files
+def group_PDF_files_by_account(pdf_files: list[tuple[str, str]], manifest: dict[str, dict]) -> dict[str, list[tuple[str, str]]]:
+    PDF_files_shards: dict[str, list[tuple[str, str]]] = {}
+    for SelectedPath, SelectedFile in pdf_files:
+        PDF_files_shards.setdefault(get_statement_metadata(SelectedPath, SelectedFile, manifest).account, []).append((SelectedPath, SelectedFile))
+
+    return PDF_files_shards
+
+# Check that no file is written by two account shards, which are converted at the same time: the individual files of their PDFs
+# (see check_PDF_output_filenames_are_unique), their combined files and their report of the duplicate transactions
+# The ledger is the exception, a database shared by all the PDFs
+def check_account_shards_output_filenames_are_distinct(PDF_files_shards: dict[str, list[tuple[str, str]]]) -> None:
+    accounts_by_output_filename: dict[str, str] = {}
+
+    for account, PDF_files_shard in PDF_files_shards.items():
+        shard_output_filenames = {get_account_filename(DUPLICATE_TRANSACTIONS_REPORT_FILENAME, account), *get_requested_combined_output_filenames(account).values()}
+        for SelectedPath, SelectedFile in PDF_files_shard:
+            shard_output_filenames.update(output_filename for output_format, output_filename in get_requested_output_filenames(SelectedFile).items() if output_format != "ledger")
+
+        for output_filename in shard_output_filenames:
+            other_account = accounts_by_output_filename.setdefault(os.path.normcase(output_filename), account)
+            if other_account != account:
+                raise ValueError(f"The statements of the accounts {other_account} and {account} would both be written to {output_filename}")
+
+# Worker process task: convert the PDFs of an account shard and generate its combined files, with the fingerprints and metadata
+# of its PDFs known by the parent process. Returns the manifest entries of the PDFs converted and the results of the conversions
+# (see get_worker_conversion_results)
+def generate_account_shard_in_worker(pdf_files: list[tuple[str, str]], pdf_files_to_convert: list[tuple[str, str]], account: str,
+                                     shard_transaction_fingerprints: dict[str, list[str]], shard_statements_metadata: dict[str, StatementMetadata]) -> tuple:
+    clear_worker_conversion_results()
+    statement_transaction_fingerprints.update(shard_transaction_fingerprints)
+    statements_metadata.update(shard_statements_metadata)
+
+    # The manifest is saved by the parent process (the PDFs converted are still recorded in the journal straight away)
+    shard_manifest: dict[str, dict] = {}
+    generate_requested_files_from_PDFs_shard(pdf_files, pdf_files_to_convert,
+                                             lambda SelectedPath, SelectedFile: record_PDF_in_manifest(shard_manifest, SelectedPath, SelectedFile), shard_manifest, account)
+    return shard_manifest, *get_worker_conversion_results()
+
+# Convert the account shards in several processes, one shard per process
+@measured_stage("parallel conversion")
+def generate_account_shards_in_parallel(PDF_files_shards: dict[str, list[tuple[str, str]]], pdf_files_to_convert: list[tuple[str, str]],
+                                        manifest: dict[str, dict], workers: int) -> None:
+    log(f"Converting the statements of {len(PDF_files_shards)} accounts with {workers} processes")
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    check_account_shards_output_filenames_are_distinct(PDF_files_shards)
+
+    PDF_files_to_convert = set(pdf_files_to_convert)
+    with ProcessPoolExecutor(max_workers=min(workers, len(PDF_files_shards)), initializer=set_conversion_switches, initargs=(get_conversion_switches(),)) as executor:
+        shard_conversions = []
+        for account, PDF_files_shard in PDF_files_shards.items():
+            PDF_filenames = [os.path.abspath(os.path.join(SelectedPath, SelectedFile)) for SelectedPath, SelectedFile in PDF_files_shard]
+            shard_conversions.append(executor.submit(
+                generate_account_shard_in_worker,
+                PDF_files_shard,
+                [pdf_file for pdf_file in PDF_files_shard if pdf_file in PDF_files_to_convert],
+                account,
+                {PDF_filename: statement_transaction_fingerprints[PDF_filename] for PDF_filename in PDF_filenames if PDF_filename in statement_transaction_fingerprints},
+                {PDF_filename: statements_metadata[PDF_filename] for PDF_filename in PDF_filenames if PDF_filename in statements_metadata},
+            ))
+
+        for shard_conversion in as_completed(shard_conversions):
+            shard_manifest, *worker_conversion_results = shard_conversion.result()
+            manifest.update(shard_manifest)
+            merge_worker_conversion_results(*worker_conversion_results)
+
+
+#####
+# Watch mode functions
+# Convert the statements as they arrive in a folder, the process (with pypdf) staying loaded in between.
+# A file is only converted once it has not changed for WATCH_SETTLE_SECONDS, so that downloads in progress are not read
+
+# inotify constants (see inotify(7))
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+# Whether a file can contain statements: PDF or zip archive
+def is_PDF_source_filename(filename: str) -> bool:
+    return filename.endswith(".pdf") or filename.lower().endswith(ARCHIVE_EXTENSION)
+
+# PDF files and zip archives of a folder and its sub-folders, in the order of find_PDF_files
+def find_PDF_sources(folder: str) -> list[str]:
+    PDF_sources: list[str] = []
+
+    for sub_folder, sub_folders, filenames in os.walk(folder):
+        sub_folders.sort()
+        PDF_sources.extend(os.path.join(sub_folder, filename) for filename in sorted(filenames) if is_PDF_source_filename(filename))
+
+    return PDF_sources
+
+# PDFs of PDF files and zip archives of the folder watched, as (folder, path of the PDF in the folder) like find_PDF_files([folder]),
+# skipping the ones which cannot be read (e.g. archive still being written or removed since)
+def find_readable_PDF_files(folder: str, PDF_sources: Iterable[str]) -> list[tuple[str, str]]:
+    pdf_files: list[tuple[str, str]] = []
+
+    for PDF_source in PDF_sources:
+        try:
+            pdf_files.extend((folder, os.path.relpath(os.path.join(SelectedPath, SelectedFile), folder)) for SelectedPath, SelectedFile in find_PDF_files([PDF_source]))
+        except (OSError, zipfile.BadZipFile) as error:
+            print(f"{PDF_source} cannot be read, skipped: {error}")
+
+    return pdf_files
+
+# Changes of the files of a folder and its sub-folders, told by the Linux kernel (inotify)
+class InotifyFolderWatcher:
+    def __init__(self, folder: str) -> None:
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.inotify_file_descriptor = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.inotify_file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify is not available")
+
+        self.folder = folder
+        # Folder watched, by watch descriptor
+        self.watched_folders: dict[int, str] = {}
+        self.watch_folder(folder)
+
+    # Watch a folder and its sub-folders, returning the files already in them
+    def watch_folder(self, folder: str) -> set[str]:
+        files: set[str] = set()
+
+        for sub_folder, _, filenames in os.walk(folder):
+            watch_descriptor = self.libc.inotify_add_watch(self.inotify_file_descriptor, os.fsencode(sub_folder),
+                                                           IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if watch_descriptor >= 0:
+                self.watched_folders[watch_descriptor] = sub_folder
+            files.update(os.path.join(sub_folder, filename) for filename in filenames)
+
+        return files
+
+    # Files changed (created, written or moved in) until the timeout, or until the first changes
+    def wait_for_changes(self, timeout: float) -> set[str]:
+        changed_files: set[str] = set()
+
+        readable, _, _ = select.select([self.inotify_file_descriptor], [], [], timeout)
+        if not readable:
+            return changed_files
+
+        events = os.read(self.inotify_file_descriptor, 64 * 1024)
+        offset = 0
+        while offset < len(events):
+            watch_descriptor, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(events, offset)
+            name = os.fsdecode(events[offset + INOTIFY_EVENT_HEADER.size:offset + INOTIFY_EVENT_HEADER.size + name_length].rstrip(b"\0"))
+            offset += INOTIFY_EVENT_HEADER.size + name_length
+
+            # Events lost: look at all the files again
+            if mask & IN_Q_OVERFLOW:
+                changed_files.update(self.watch_folder(self.folder))
+                continue
+
+            folder = self.watched_folders.get(watch_descriptor)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                # Folder removed
+                del self.watched_folders[watch_descriptor]
+            elif mask & IN_ISDIR:
+                # New folder: its files may have been created before it was watched
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed_files.update(self.watch_folder(os.path.join(folder, name)))
+            elif name:
+                changed_files.add(os.path.join(folder, name))
+
+        return changed_files
+
+    def close(self) -> None:
+        os.close(self.inotify_file_descriptor)
+
+# Changes of the files of a folder and its sub-folders, by scanning them every WATCH_POLL_INTERVAL
+class PollingFolderWatcher:
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.files_state = self.get_files_state()
+
+    # Size and modification time of each file
+    def get_files_state(self) -> dict[str, tuple[int, int]]:
+        files_state: dict[str, tuple[int, int]] = {}
+
+        for folder, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                file = os.path.join(folder, filename)
+                try:
+                    file_stat = os.stat(file)
+                except OSError:
+                    # Removed since
+                    continue
+                files_state[file] = (file_stat.st_size, file_stat.st_mtime_ns)
+
+        return files_state
+
+    def wait_for_changes(self, timeout: float) -> set[str]:
+        time.sleep(min(timeout, WATCH_POLL_INTERVAL))
+
+        files_state = self.get_files_state()
+        changed_files = {file for file, file_state in files_state.items() if self.files_state.get(file) != file_state}
+        self.files_state = files_state
+
+        return changed_files
+
+    def close(self) -> None:
+        pass
+
+# inotify on Linux, scanning the folder otherwise
+def open_folder_watcher(folder: str) -> InotifyFolderWatcher | PollingFolderWatcher:
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyFolderWatcher(folder)
+        except (OSError, AttributeError) as error:
+            log(f"inotify not available ({error}), scanning the folder instead")
+
+    return PollingFolderWatcher(folder)
+
+# Convert the PDFs of PDF files and zip archives arrived in the watched folder, one by one, then update the combined files
+# A PDF which cannot be converted is skipped (and reported) until it changes
+def convert_watched_PDF_sources(folder: str, PDF_sources: list[str], PDFs_failed: dict[str, tuple[int, int]]) -> None:
+    manifest = load_manifest()
+    if transaction_fingerprints_needed():
+        load_transaction_fingerprints()
+
+    # The PDFs arrived are checked against all those of the folder, already converted or not
+    check_PDF_output_filenames_are_unique(find_readable_PDF_files(folder, find_PDF_sources(folder)))
+
+    for SelectedPath, SelectedFile in find_readable_PDF_files(folder, dict.fromkeys(PDF_sources)):
+        if PDF_is_up_to_date_in_manifest(manifest, SelectedPath, SelectedFile):
+            continue
+
+        PDF_filename = os.path.join(SelectedPath, SelectedFile)
+        PDF_size_and_time = get_PDF_size_and_time(PDF_filename)
+        if PDFs_failed.get(PDF_filename) == PDF_size_and_time:
+            continue
+
+        try:
+            generate_requested_files_from_PDF(SelectedPath, SelectedFile)
+        except Exception as error:
+            PDFs_failed[PDF_filename] = PDF_size_and_time
+            print(f"{PDF_filename} cannot be converted, skipped until it changes: {error!r}")
+            continue
+
+        record_PDF_in_manifest(manifest, SelectedPath, SelectedFile)
+        print(f"[{datetime.now():%H:%M:%S}] Converted {PDF_filename}")
+
+    if combine_all_output_statements:
+        # All converted already: the combined files are regenerated from the individual files
+        generate_requested_files_from_PDFs([pdf_file for pdf_file in find_readable_PDF_files(folder, find_PDF_sources(folder))
+                                            if PDF_is_up_to_date_in_manifest(manifest, *pdf_file)])
+    else:
+        save_manifest(manifest)
+
+# Conversion thread of the watch mode: convert the batches of PDF files and zip archives settled, until given None
+def convert_watched_PDF_sources_from_queue(folder: str, PDF_sources_queue) -> None:
+    import queue
+
+    PDFs_failed: dict[str, tuple[int, int]] = {}
+    stop = False
+
+    while not stop:
+        PDF_sources = PDF_sources_queue.get()
+        if PDF_sources is None:
+            return
+
+        # The batches settled during the previous conversion are converted together
+        while True:
+            try:
+                more_PDF_sources = PDF_sources_queue.get_nowait()
+            except queue.Empty:
+                break
+            if more_PDF_sources is None:
+                stop = True
+                break
+            PDF_sources.extend(more_PDF_sources)
+
+        try:
+            convert_watched_PDF_sources(folder, PDF_sources, PDFs_failed)
+        except Exception as error:
+            # e.g. an archive being written when the combined files were regenerated: done again with the next batch
+            print(f"Conversion failed, watching on: {error!r}")
+
+# Watch a folder, converting the statements arriving in it (and the ones already there, if not converted yet)
+# until stop_event is set or the process is interrupted
+def watch_folder_for_PDFs(folder: str, stop_event: threading.Event | None = None) -> None:
+    import queue
+    from importlib import import_module
+
+    # Loaded once for all the statements to come
+    import_module("pypdf")
+
+    watcher = open_folder_watcher(folder)
+    PDF_sources_queue: queue.Queue[list[str] | None] = queue.Queue()
+    conversion_thread = threading.Thread(target=convert_watched_PDF_sources_from_queue, args=(folder, PDF_sources_queue), name="conversion")
+    conversion_thread.start()
+
+    PDF_sources_queue.put(find_PDF_sources(folder))
+    print(f"Watching {folder} for statements ({'inotify' if isinstance(watcher, InotifyFolderWatcher) else 'scanning'}), Ctrl+C to stop")
+
+    # Files changed and not converted yet, with the time of their last change
+    PDF_sources_changed: dict[str, float] = {}
+
+    try:
+        while not (stop_event and stop_event.is_set()):
+            for PDF_source in watcher.wait_for_changes(WATCH_SETTLE_SECONDS if PDF_sources_changed else WATCH_IDLE_TIMEOUT):
+                if is_PDF_source_filename(os.path.basename(PDF_source)):
+                    PDF_sources_changed[PDF_source] = time.monotonic()
+
+            settle_time = time.monotonic() - WATCH_SETTLE_SECONDS
+            PDF_sources_settled = [PDF_source for PDF_source, change_time in PDF_sources_changed.items() if change_time <= settle_time]
+            if PDF_sources_settled:
+                for PDF_source in PDF_sources_settled:
+                    del PDF_sources_changed[PDF_source]
+                PDF_sources_queue.put(PDF_sources_settled)
+
+    except KeyboardInterrupt:
+        print("Stopping once the current conversion is complete")
+
+    finally:
+        watcher.close()
+        PDF_sources_queue.put(None)
+        conversion_thread.join()
+
+
+#####
+# Benchmark functions
+# Header row and lines laid out as the layout extraction does, with the adversarial cases of long whitespace runs
+def get_line_parser_benchmark_lines() -> tuple[str, dict[str, list[str]]]:
+    header_line = "Date".ljust(20) + COLUMN_TITLE_DETAILS.ljust(85) + COLUMN_TITLE_PAID_OUT.ljust(20) + COLUMN_TITLE_PAID_IN.ljust(20) + COLUMN_TITLE_BALANCE
+
+    benchmark_lines = {
+        "typical": [
+            "01 Jan 24".ljust(20) + "BP".ljust(10) + "TESCO STORES".ljust(80) + "168.16".ljust(40) + "1,536.29",
+            "".ljust(20) + "VIS".ljust(10) + "AMAZON".ljust(100) + "138.59".ljust(18) + "1,674.88",
+            "".ljust(20) + ")))".ljust(10) + "CAFE NERO",
+            "".ljust(30) + "LONDON".ljust(80) + "457.02",
+        ],
+        "adversarial long whitespace": [
+            " " * 5000 + "12.00",
+            "".ljust(20) + "VIS".ljust(10) + "AMAZON" + " " * 5000,
+            "".ljust(20) + "DD".ljust(10) + "BRITISH GAS" + " " * 2000 + "45.00" + " " * 2000 + "1,234.56",
+            "".ljust(20) + "SO".ljust(10) + "AB    " * 800 + "!",
+            "".ljust(20) + "CR".ljust(10) + "1    " * 1000 + "!",
+        ],
+    }
+
+    return header_line, benchmark_lines
+
+# Time both line parser engines on the same lines, in microseconds per line
+# PDF files can be given to also time their actual transaction lines
+@measured_stage("benchmark")
+def benchmark_line_parser_engines(PDF_filenames: list[str] | None = None, repeat: int = 5) -> list[tuple[str, str, int, float]]:
+    log("Benchmarking the line parser engines")
+    from time import perf_counter
+
+    header_line, benchmark_lines = get_line_parser_benchmark_lines()
+    benchmark_pages: dict[str, list[tuple[dict[str, int] | None, list[str]]]] = {
+        lines_name: [(find_transaction_columns_in_PDF_page([header_line]), lines)] for lines_name, lines in benchmark_lines.items()
+    }
+
+    for PDF_filename in PDF_filenames or []:
+        PDF_transaction_pages, PDF_non_transaction_pages = get_raw_text_transactions_from_PDF(PDF_filename)
+        benchmark_pages[os.path.basename(PDF_filename)] = [
+            (find_transaction_columns_in_PDF_page(PDF_non_transaction_page), PDF_transaction_page)
+            for PDF_transaction_page, PDF_non_transaction_page in zip(PDF_transaction_pages, PDF_non_transaction_pages)
+        ]
+
+    benchmark_results: list[tuple[str, str, int, float]] = []
+
+    for lines_name, pages in benchmark_pages.items():
+        number_of_lines = sum(len(lines) for _, lines in pages)
+        if not number_of_lines:
+            continue
+
+        for engine in ("regex", "columns"):
+            best_duration = float("inf")
+            for _ in range(repeat):
+                start = perf_counter()
+                for columns, lines in pages:
+                    for line in lines:
+                        if engine == "columns" and columns:
+                            convert_transaction_line_into_a_dictionary_with_columns(line, columns)
+                        else:
+                            convert_transaction_line_into_dictionaries_with_regex(line)
+                best_duration = min(best_duration, perf_counter() - start)
+
+            benchmark_results.append((lines_name, engine, number_of_lines, best_duration / number_of_lines * 1_000_000))
+
+    return benchmark_results
+
+
+#####
+# Headless functions (command line and library use)
+OUTPUT_FORMATS = ("csv", "mmx", "qif", "raw", "ledger")
+
+# identify the PDFs to convert from a list of PDF files, folders and zip archives, as (folder, file name)
+# The PDFs of the folders are found in their sub-folders and zip archives too, as (folder, path of the PDF in the folder)
+# A PDF found twice (e.g. given with its folder) is converted once
+def find_PDF_files(paths: list[str]) -> list[tuple[str, str]]:
+    pdf_files: list[tuple[str, str]] = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            # hopefully only the proper HSBC monthly statements PDF are present or the app will crash
+            # sorted so that the combined files come out in the same order whatever the platform
+            for folder, sub_folders, filenames in os.walk(path):
+                sub_folders.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith(".pdf"):
+                        pdf_files.append((path, os.path.relpath(os.path.join(folder, filename), path)))
+                    elif filename.lower().endswith(ARCHIVE_EXTENSION):
+                        pdf_files.extend(find_PDF_files_in_archive(os.path.join(folder, filename), selected_folder=path))
+        elif os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSION):
+            pdf_files.extend(find_PDF_files_in_archive(path))
+        elif os.path.isfile(path):
+            pdf_files.append((os.path.dirname(path), os.path.basename(path)))
+        elif PDF_source_exists(path):
+            # PDF or folder in a zip archive
+            pdf_files.extend(find_PDF_files_in_archive(*split_PDF_archive_member(path)))
+        else:
+            raise FileNotFoundError(f"No such PDF file or folder: {path}")
+
+    PDF_files_found: dict[str, tuple[str, str]] = {}
+    for pdf_file in pdf_files:
+        PDF_files_found.setdefault(os.path.abspath(os.path.join(*pdf_file)), pdf_file)
+
+    return list(PDF_files_found.values())
+
+def convert(
+    paths: str | list[str],
+    formats: tuple[str, ...] | list[str] = ("csv",),
+    combine: bool = False,
+    mmx_header: bool = True,
+    workers: int = 1,
+    csv_stream: TextIO | None = None,
+    dry_run: bool = False,
+    use_cache: bool = True,
+    incremental: bool = True,
+    page_workers: int = 1,
+    metrics_report: str | None = None,
+    trace_memory: bool = False,
+    profiles_folder: str | None = None,
+    text_engine: str = "adaptive",
+    keep_duplicates: bool = False,
+    per_account: bool = False,
+    in_file_order: bool = False,
+) -> list[str]:
+    """Convert HSBC UK statement PDFs without going through the selection window.
+
+    paths: PDF file(s) and/or folder(s) containing the PDF files
+    formats: files to generate, any of "csv", "mmx", "qif", "raw" and "ledger" (the SQLite database LEDGER_FILENAME, see query_ledger)
+    combine: also generate the files combining the transactions of all the PDFs
+    mmx_header: include the header in the MoneyManagerEx CSV files
+    workers: number of processes converting the PDFs in parallel
+    csv_stream: if provided (e.g. sys.stdout), write all the transactions to it as generic CSV instead of generating files
+    dry_run: only identify the PDF files that would be converted
+    use_cache: reuse the text already extracted from unchanged PDFs
+    incremental: only convert the PDFs new or changed since their last conversion (the combined files still include all of them)
+    page_workers: number of processes extracting the pages of each PDF in parallel (for long PDFs converted one at a time)
+    metrics_report: if provided, write the time spent in each stage of the conversion, per PDF, to this .json or .csv file
+    trace_memory: with metrics_report, also record the peak memory of each stage (tracemalloc, slower)
+    profiles_folder: if provided, save a cProfile profile of the conversion of each PDF in this folder
+    text_engine: "layout" (pypdf layout mode), "coordinates" (the text placed by its position in the page, faster)
+        or "adaptive" (coordinates, and layout mode for the pages whose balances do not reconcile)
+    keep_duplicates: with combine, keep the transactions of overlapping statements as many times as they are in the statements
+        (by default, those already in the combined files from another statement are left out, and listed in DUPLICATE_TRANSACTIONS_REPORT_FILENAME)
+    per_account: with combine, generate the combined files of each account (named with its sort code and account number)
+        instead of one for all, the accounts being converted in parallel with workers
+    in_file_order: with combine, the transactions of the combined files in the order of the PDF files instead of in date order
+        (statements ordered by their period, the transactions of the statements whose periods overlap merged by date)
+
+    Returns the PDF files converted (or to be converted if dry_run)"""
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    unknown_formats = set(formats) - set(OUTPUT_FORMATS)
+    if unknown_formats:
+        raise ValueError(f"Unknown output format(s): {', '.join(sorted(unknown_formats))}")
+
+    if text_engine not in TEXT_EXTRACTION_ENGINES:
+        raise ValueError(f"Unknown text extraction engine: {text_engine}")
+
+    pdf_files = find_PDF_files(paths)
+    pdf_filenames = [os.path.join(SelectedPath, SelectedFile) for SelectedPath, SelectedFile in pdf_files]
+
+    if dry_run:
+        return pdf_filenames
+
+    # The conversion functions rely on the switches, so set them for the time of the conversion only
+    switches = {
+        "output_generic_csv": "csv" in formats,
+        "output_mmx": "mmx" in formats,
+        "output_qif": "qif" in formats,
+        "output_raw": "raw" in formats,
+        "output_ledger": "ledger" in formats,
+        "combine_all_output_statements": combine,
+        "use_mmx_header": mmx_header,
+        "conversion_workers": workers,
+        "use_page_text_cache": use_cache,
+        "incremental_conversion": incremental,
+        "page_extraction_workers": page_workers,
+        "file_generation_log_entry_already_displayed": False,
+        "collect_stage_metrics": metrics_report is not None,
+        "trace_stage_memory": trace_memory,
+        "PDF_profiles_folder": profiles_folder or "",
+        "text_extraction_engine": text_engine,
+        "skip_duplicate_transactions_in_combined_files": not keep_duplicates,
+        "combine_per_account": per_account,
+        "combine_in_date_order": not in_file_order,
+    }
+    previous_switches = {name: globals()[name] for name in switches}
+    globals().update(switches)
+    conversion_statistics.clear()
+    stage_metrics.clear()
+
+    tracing_memory = metrics_report is not None and trace_memory and not tracemalloc.is_tracing()
+    if tracing_memory:
+        tracemalloc.start()
+
+    try:
+        # What no other stage counts (e.g. finding the PDFs) is counted in "run"
+        with measure_stage("run"):
+            if csv_stream is not None:
+                for index, (SelectedPath, SelectedFile) in enumerate(pdf_files):
+                    PDF_filename = os.path.join(SelectedPath, SelectedFile)
+                    set_stage_metrics_PDF_file(PDF_filename)
+                    with profile_PDF_conversion(SelectedFile):
+                        if stream_conversion:
+                            PDF_transactions = iterate_transactions_from_PDF(PDF_filename)
+                        else:
+                            PDF_transactions_in_text_raw_format, PDF_non_transactions_in_text_raw_format = get_raw_text_transactions_from_PDF(PDF_filename)
+                            PDF_transactions = get_usable_dictionary_from_PDF(PDF_transactions_in_text_raw_format, PDF_non_transactions_in_text_raw_format)
+                        write_PDF_transactions_in_generic_CSV_format_to_stream(PDF_transactions, csv_stream, include_header=index == 0)
+                set_stage_metrics_PDF_file("")
+            else:
+                create_output_folders()
+                generate_requested_files_from_PDFs(pdf_files)
+
+        if metrics_report is not None:
+            write_stage_metrics_report(metrics_report)
+    finally:
+        if tracing_memory:
+            tracemalloc.stop()
+        set_stage_metrics_PDF_file("")
+        globals().update(previous_switches)
+
+    return pdf_filenames
+
+def watch(
+    folder: str = INPUT_FOLDER,
+    formats: tuple[str, ...] | list[str] = ("csv",),
+    combine: bool = False,
+    mmx_header: bool = True,
+    use_cache: bool = True,
+    stop_event: threading.Event | None = None,
+    keep_duplicates: bool = False,
+    per_account: bool = False,
+    in_file_order: bool = False,
+) -> None:
+    """Convert the statement PDFs arriving in a folder (created if needed), and the ones already there if not converted yet,
+    until stop_event is set or the process is interrupted (Ctrl+C).
+
+    Its sub-folders and zip archives are watched too. A file is converted once it has not changed for WATCH_SETTLE_SECONDS.
+    The other parameters are the ones of convert()"""
+
+    unknown_formats = set(formats) - set(OUTPUT_FORMATS)
+    if unknown_formats:
+        raise ValueError(f"Unknown output format(s): {', '.join(sorted(unknown_formats))}")
+
+    switches = {
+        "output_generic_csv": "csv" in formats,
+        "output_mmx": "mmx" in formats,
+        "output_qif": "qif" in formats,
+        "output_raw": "raw" in formats,
+        "output_ledger": "ledger" in formats,
+        "combine_all_output_statements": combine,
+        "skip_duplicate_transactions_in_combined_files": not keep_duplicates,
+        "combine_per_account": per_account,
+        "combine_in_date_order": not in_file_order,
+        "use_mmx_header": mmx_header,
+        "use_page_text_cache": use_cache,
+        # Each statement is converted as it arrives, the others are only added to the combined files
+        "incremental_conversion": True,
+        "file_generation_log_entry_already_displayed": False,
+    }
+    previous_switches = {name: globals()[name] for name in switches}
+    globals().update(switches)
+
+    try:
+        os.makedirs(folder, exist_ok=True)
+        create_output_folders()
+        watch_folder_for_PDFs(folder, stop_event)
+    finally:
+        globals().update(previous_switches)
+
+def list_statements(paths: str | list[str]) -> list[dict[str, str | None]]:
+    """Account and period of HSBC UK statement PDFs, without converting them.
+
+    paths: PDF file(s) and/or folder(s) containing the PDF files
+    Only the first page of the PDFs not converted yet (or changed since their conversion) is read, the others are in the manifest
+
+    Returns one dictionary per PDF, in the order of the PDFs: pdf, sort_code, account_number, period_start and period_end (YYYY-MM-DD),
+    the ones not found being None"""
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    manifest = load_manifest()
+
+    return [{"pdf": os.path.join(SelectedPath, SelectedFile), **asdict(get_statement_metadata(SelectedPath, SelectedFile, manifest))}
+            for SelectedPath, SelectedFile in find_PDF_files(paths)]
+
+# Command line options. Without any PDF file or folder, the selection window is used instead
+def parse_command_line(argv: list[str] | None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert HSBC UK Consumer Monthly Statement PDFs into CSV, MoneyManagerEx CSV and QIF files. "
+                    "Without any PDF file or folder, a selection window is opened instead."
+    )
+    parser.add_argument("paths", nargs="*", metavar="PDF_FILE_OR_FOLDER",
+                        help=f"statement PDF files, folders and/or zip archives containing them, or PDFs in zip archives (e.g. Statements.zip{os.sep}January.pdf)")
+    parser.add_argument("--csv", action="store_true", help="generate the generic CSV files (default if no other format is requested)")
+    parser.add_argument("--mmx", action="store_true", help="generate the MoneyManagerEx CSV files")
+    parser.add_argument("--qif", action="store_true", help="generate the QIF files")
+    parser.add_argument("--raw", action="store_true", help="generate the raw text files (for debugging)")
+    parser.add_argument("--ledger", action="store_true", help=f"load the transactions into the SQLite ledger database ({LEDGER_FILENAME})")
+    parser.add_argument("--combine", action="store_true", help="also generate files combining all the statements")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="with --combine, keep the transactions of overlapping statements twice in the combined files "
+                             f"(by default, they are left out and listed in {DUPLICATE_TRANSACTIONS_REPORT_FILENAME})")
+    parser.add_argument("--per-account", action="store_true",
+                        help="with --combine, generate the combined files of each account (sort code and account number) instead of one for all, "
+                             "the accounts being converted in parallel with --workers")
+    parser.add_argument("--combine-in-file-order", action="store_true",
+                        help="with --combine, the transactions of the combined files in the order of the PDF files instead of in date order")
+    parser.add_argument("--no-mmx-header", action="store_true", help="do not include the header in the MoneyManagerEx CSV files")
+    parser.add_argument("--workers", type=int, default=conversion_workers, help="number of processes converting PDFs in parallel (default: %(default)s)")
+    parser.add_argument("--page-workers", type=int, default=page_extraction_workers, help="number of processes extracting the pages of each PDF in parallel, for long PDFs (default: %(default)s)")
+    parser.add_argument("--text-engine", choices=TEXT_EXTRACTION_ENGINES, default=text_extraction_engine,
+                        help="extract the text of the pages with the pypdf layout mode, from the coordinates of the text (faster), "
+                             "or from the coordinates and with the layout mode for the pages whose balances do not reconcile (default: %(default)s)")
+    parser.add_argument("--stdout", action="store_true", help="write the transactions as tab separated CSV to the standard output instead of generating files")
+    parser.add_argument("--full", action="store_true", help="convert all the PDFs again, not only the ones new or changed since their last conversion")
+    parser.add_argument("--no-cache", action="store_true", help="extract the text of the PDFs again even if it is in the page text cache")
+    parser.add_argument("--benchmark-line-parsers", action="store_true", help="time the regex and columns line parser engines per line, on sample lines and on the lines of the PDFs given")
+    parser.add_argument("--dry-run", action="store_true", help="only list the PDF files that would be converted")
+    parser.add_argument("--list-statements", action="store_true",
+                        help="only list the sort code, account number and period of each PDF (reading the first page of the PDFs not converted yet)")
+    parser.add_argument("--watch", nargs="?", const=INPUT_FOLDER, metavar="FOLDER",
+                        help="keep running, converting the statements as they arrive in FOLDER (default: %(const)s), and updating the combined files")
+    parser.add_argument("--log", action="store_true", help="display log messages")
+    parser.add_argument("--metrics", nargs="?", const=STAGE_METRICS_REPORT_FILENAME, metavar="REPORT_FILE",
+                        help="write the wall time, CPU time and pages of each stage of the conversion, per PDF, to REPORT_FILE, "
+                             "as JSON or as CSV if it ends with .csv (default: %(const)s)")
+    parser.add_argument("--metrics-memory", action="store_true", help="with --metrics, also record the peak memory of each stage (slower)")
+    parser.add_argument("--profile-folder", metavar="FOLDER", help=f"save a cProfile profile of the conversion of each PDF in FOLDER (PDF name + {PROFILE_EXTENSION})")
+
+    ledger_query = parser.add_argument_group("ledger query", "generate the files (or --stdout) from the ledger instead of PDFs")
+    ledger_query.add_argument("--query-ledger", action="store_true", help=f"generate the requested files from the transactions of the ledger, named {LEDGER_QUERY_BASE_FILENAME}")
+    ledger_query.add_argument("--payee", help="only the transactions whose payee starts with PAYEE (case insensitive)")
+    ledger_query.add_argument("--from", dest="date_from", metavar="YYYY-MM-DD", help="only the transactions from this date")
+    ledger_query.add_argument("--to", dest="date_to", metavar="YYYY-MM-DD", help="only the transactions until this date")
+    ledger_query.add_argument("--type", dest="transaction_type", help="only the transactions of this type (e.g. DD, VIS)")
+
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be 1 or more")
+
+    if args.page_workers < 1:
+        parser.error("--page-workers must be 1 or more")
+
+    for path in args.paths:
+        if not PDF_source_exists(path):
+            parser.error(f"no such PDF file or folder: {path}")
+
+    for date in (args.date_from, args.date_to):
+        if date:
+            try:
+                datetime.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                parser.error(f"not a YYYY-MM-DD date: {date}")
+
+    if args.query_ledger and (args.raw or args.ledger):
+        parser.error("--raw and --ledger are not available with --query-ledger")
+
+    if args.metrics_memory and not args.metrics:
+        parser.error("--metrics-memory needs --metrics")
+
+    if args.per_account and not args.combine:
+        parser.error("--per-account needs --combine")
+
+    if args.combine_in_file_order and not args.combine:
+        parser.error("--combine-in-file-order needs --combine")
+
+    if args.list_statements and not args.paths:
+        parser.error("--list-statements needs PDF files or folders")
+
+    if args.watch and (args.paths or args.stdout or args.query_ledger):
+        parser.error("--watch converts the PDFs of its folder only, to files")
+
+    return args
+
+def main(argv: list[str] | None = None) -> int:
+
+    global show_log
+
+    args = parse_command_line(argv)
+    show_log = show_log or args.log
+
+    if args.benchmark_line_parsers:
+        print(f"{'Lines':<30} {'Engine':<8} {'Lines':>6} {'us/line':>10}")
+        for lines_name, engine, number_of_lines, duration_per_line in benchmark_line_parser_engines(
+                [os.path.join(SelectedPath, SelectedFile) for SelectedPath, SelectedFile in find_PDF_files(args.paths)]):
+            print(f"{lines_name:<30} {engine:<8} {number_of_lines:>6} {duration_per_line:>10.2f}")
+        return 0
+
+    # Metadata only: no conversion
+    if args.list_statements:
+        print("\t".join(["Sort code", "Account number", "From", "To", "PDF"]))
+        for statement in sorted(list_statements(args.paths), key=lambda statement: (statement["sort_code"] or "", statement["account_number"] or "", statement["period_start"] or "")):
+            print("\t".join(statement[field] or "" for field in ("sort_code", "account_number", "period_start", "period_end", "pdf")))
+        return 0
+
+    # Files generated from the ledger: no PDF needed
+    if args.query_ledger:
+        formats = [output_format for output_format in ("csv", "mmx", "qif") if getattr(args, output_format)] or ["csv"]
+
+        output_filenames = export_ledger(
+            formats=formats,
+            csv_stream=sys.stdout if args.stdout else None,
+            payee=args.payee,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            transaction_type=args.transaction_type,
+        )
+
+        for output_filename in output_filenames:
+            print(output_filename)
+        return 0
+
+    # Statements converted as they arrive: no dialog window
+    if args.watch:
+        formats = [output_format for output_format in OUTPUT_FORMATS if getattr(args, output_format)] or ["csv"]
+
+        watch(args.watch, formats=formats, combine=args.combine, mmx_header=not args.no_mmx_header, use_cache=not args.no_cache,
+              keep_duplicates=args.keep_duplicates, per_account=args.per_account, in_file_order=args.combine_in_file_order)
+        return 0
+
+    # PDF files or folders given on the command line: no dialog window
+    if args.paths:
+        formats = [output_format for output_format in OUTPUT_FORMATS if getattr(args, output_format)] or ["csv"]
+
+        PDF_filenames = convert(
+            args.paths,
+            formats=formats,
+            combine=args.combine,
+            mmx_header=not args.no_mmx_header,
+            workers=args.workers,
+            csv_stream=sys.stdout if args.stdout else None,
+            dry_run=args.dry_run,
+            use_cache=not args.no_cache,
+            incremental=not args.full,
+            page_workers=args.page_workers,
+            metrics_report=args.metrics,
+            trace_memory=args.metrics_memory,
+            profiles_folder=args.profile_folder,
+            text_engine=args.text_engine,
+            keep_duplicates=args.keep_duplicates,
+            per_account=args.per_account,
+            in_file_order=args.combine_in_file_order,
+        )
+
+        if args.dry_run:
+            for PDF_filename in PDF_filenames:
+                print(PDF_filename)
+            return 0
+
+        # Keep the standard output for the transactions when they are streamed
+        report_stream = sys.stderr if args.stdout else sys.stdout
+        report_conversion_statistics(report_stream)
+        print("Done!", file=report_stream)
+        return 0
 
     # Get the file/folder selection with a dialog window
     SelectedPath, SelectedFile = select_input_file_or_folder()
@@ -936,44 +3844,31 @@ def main() -> int:
 
     # Create the required output folders
     create_output_folders()
-    
+
+    # The stage metrics switches apply to the selection window conversion too
+    if collect_stage_metrics and trace_stage_memory:
+        tracemalloc.start()
     
     # if a specific file had been selected
-    if SelectedFile:
+    if SelectedFile and not SelectedFile.lower().endswith(ARCHIVE_EXTENSION):
         generate_requested_files_from_PDF(SelectedPath, SelectedFile)
-        
-        print("Done!")
-        return 0
+
+    # if a zip archive had been selected, it is converted as a folder
+    elif SelectedFile:
+        generate_requested_files_from_PDFs(find_PDF_files([os.path.join(SelectedPath, SelectedFile)]))
 
     # if a folder had been selected
     else:
         # identify all the pdf under SelectedPath
-        # hopefully only the proper HSBC monthly statements PDF are present or the app will crash
-        pdf_files = [f for f in os.listdir(SelectedPath) if f.endswith(".pdf")]
-        
-        # if the combined file already exists, and is about to be regenerated, delete the old one
-        if combine_all_output_statements:
-            if output_generic_csv:
-                csv_combined = OUTPUT_FOLDER_CSV + "\\" + OUTPUT_FILENAME_CSV_COMBINED
-                if os.path.exists(csv_combined):
-                    os.remove(csv_combined)
-                    
-            if output_mmx:
-                mmx_combined = OUTPUT_FOLDER_MMX + "\\" + OUTPUT_FILENAME_MMX_COMBINED
-                if os.path.exists(mmx_combined):
-                    os.remove(mmx_combined)
-        
-            if output_qif:      
-                qif_combined = OUTPUT_FOLDER_QIF + "\\" + OUTPUT_FILENAME_QIF_COMBINED
-                if os.path.exists(qif_combined):
-                    os.remove(qif_combined)
-                
-        for pdf_file in pdf_files:
-            generate_requested_files_from_PDF(SelectedPath, pdf_file)
-        
-        print("Done!")
-        return 0
+        generate_requested_files_from_PDFs(find_PDF_files([SelectedPath]))
+
+    if collect_stage_metrics:
+        write_stage_metrics_report(STAGE_METRICS_REPORT_FILENAME)
+
+    report_conversion_statistics()
+    print("Done!")
+    return 0
 
 
 if __name__ in "__main__":
-    main()
+    sys.exit(main())
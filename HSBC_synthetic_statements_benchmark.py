@@ -0,0 +1,446 @@
+""" Generator of synthetic HSBC UK Consumer Monthly Statement PDFs, and benchmark
+of their conversion, so that the conversion can be timed without any real bank statement"""
+
+__author__ = "Squizzy"
+__copyright__ = "Copyright 2024, Squizzy"
+__credits__ = ""
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Squizzy"
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from datetime import date, timedelta
+from importlib import import_module
+
+import HSBC_UK_Advance_Acct_Monthly_Statement_PDF_to_CSV_and_QIF as converter
+
+#####
+# Constants
+
+# Statement layout, in PDF points from the bottom left corner of an A4 page
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+PAGE_TOP = 800
+LINE_HEIGHT = 11
+FONT_SIZE = 8
+
+COLUMN_DATE_X = 50
+COLUMN_TYPE_X = 110
+COLUMN_DETAILS_X = 140
+# The amounts are right aligned on these
+COLUMN_PAID_OUT_RIGHT_X = 420
+COLUMN_PAID_IN_RIGHT_X = 490
+COLUMN_BALANCE_RIGHT_X = 565
+# D of the overdrawn balances, left aligned after the balance
+COLUMN_OVERDRAWN_X = 568
+# The column titles, left aligned
+COLUMN_TITLE_PAID_OUT_X = 385
+COLUMN_TITLE_PAID_IN_X = 455
+COLUMN_TITLE_BALANCE_X = 530
+
+# Width of the Helvetica characters from " " to "~", in thousandths of the font size
+# Given in the font dictionary, as the PDF text extraction places the text with them
+HELVETICA_FIRST_CHARACTER = 32
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+HELVETICA_DEFAULT_WIDTH = 556
+# Encoding of the font: the WinAnsi encoding, or the same with differences (remapping the space to itself) for the statements
+# whose pages the coordinates text extraction does not read (see converter.PDF_page_content_stream_is_readable)
+HELVETICA_ENCODING = b"/WinAnsiEncoding"
+HELVETICA_ENCODING_WITH_DIFFERENCES = b"<< /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [32 /space] >>"
+
+# Transactions generated: type, whether it is paid in (None: either), payees
+SYNTHETIC_TRANSACTION_TYPES = {
+    "ATM": (False, ["CASH HSBC MAY23 LONDON", "CASH NATWEST JUN23 LEEDS"]),
+    "BP": (False, ["JOHN SMITH", "RENT FLAT 2", "HMRC SELF ASSESSMENT"]),
+    "CR": (True, ["SALARY ACME LTD", "JOHN SMITH", "INTEREST"]),
+    "DD": (False, ["BRITISH GAS", "COUNCIL TAX", "THAMES WATER", "VODAFONE LTD"]),
+    "DR": (False, ["OVERDRAFT FEE"]),
+    "SO": (False, ["SAVINGS ACCOUNT", "J SMITH RENT"]),
+    "VIS": (None, ["TESCO STORES 3245", "AMAZON.CO.UK*MK1", "SAINSBURYS S/MKT", "TFL TRAVEL CH"]),
+    ")))": (False, ["CAFE NERO", "PRET A MANGER", "COSTA COFFEE"]),
+}
+SYNTHETIC_DETAIL_CONTINUATIONS = ["LONDON", "REF 0012345678", "MANCHESTER GB", "VISA RATE 1.1754", "ON 12 MAY BCC"]
+
+SYNTHETIC_STATEMENT_FILENAME = "HSBC_synthetic_statement_{:04d}.pdf"
+# Account of the statements, the account number plus the seed, so that the statements of each seed are of another account
+SYNTHETIC_SORT_CODE = "40-11-22"
+SYNTHETIC_FIRST_ACCOUNT_NUMBER = 12345678
+SYNTHETIC_FIRST_STATEMENT_DATE = date(2020, 1, 1)
+
+# Benchmark
+BENCHMARK_STATEMENT_COUNTS = (1, 100, 1000)
+BENCHMARK_BASELINE_FILENAME = "HSBC_benchmark_baseline.json"
+BENCHMARK_REGRESSION_THRESHOLD = 0.2           # fraction of the baseline throughput that can be lost before failing
+BENCHMARK_FORMATS = ("csv", "mmx", "qif")
+
+
+#####
+# Statement generation functions
+
+# Amount in pence as shown in the statements, e.g. "1,234.50"
+def format_statement_amount(amount: int) -> str:
+    return f"{amount // 100:,}.{amount % 100:02d}"
+
+# Balance cells as shown in the statements: the amount, and D if overdrawn
+def get_statement_balance_cells(balance: int) -> list[tuple[float, str, bool]]:
+    balance_cells = [(COLUMN_BALANCE_RIGHT_X, format_statement_amount(abs(balance)), True)]
+    if balance < 0:
+        balance_cells.append((COLUMN_OVERDRAWN_X, converter.OVERDRAWN_BALANCE_SUFFIX, False))
+    return balance_cells
+
+# Width of a text in the statement font, in points
+def get_text_width(text: str) -> float:
+    widths = [HELVETICA_WIDTHS[ord(character) - HELVETICA_FIRST_CHARACTER] if HELVETICA_FIRST_CHARACTER <= ord(character) < HELVETICA_FIRST_CHARACTER + len(HELVETICA_WIDTHS)
+              else HELVETICA_DEFAULT_WIDTH for character in text]
+    return sum(widths) * FONT_SIZE / 1000
+
+# Text as a PDF literal string
+def escape_PDF_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+# Transactions of one statement month: (date, type, detail lines, amount in pence, paid in, balance after in pence), in date order
+def generate_statement_transactions(rnd: random.Random, first_day: date, opening_balance: int, number_of_transactions: int) -> list[tuple[date, str, list[str], int, bool, int]]:
+    transactions = []
+    balance = opening_balance
+    transaction_date = first_day
+
+    for _ in range(number_of_transactions):
+        # A few transactions a day on average, over the month
+        if rnd.random() < 0.4 and transaction_date.day < 28:
+            transaction_date += timedelta(days=1)
+
+        transaction_type = rnd.choice(list(SYNTHETIC_TRANSACTION_TYPES))
+        paid_in, payees = SYNTHETIC_TRANSACTION_TYPES[transaction_type]
+        if paid_in is None:
+            # Refunds
+            paid_in = rnd.random() < 0.15
+
+        amount = rnd.randint(100, 250000) if transaction_type in ("CR", "BP", "SO") else rnd.randint(100, 25000)
+        # Overdrawn at times, as the statements show it
+        balance += amount if paid_in else -amount
+
+        # Some details are split over 2 or 3 lines
+        detail_lines = [rnd.choice(payees)]
+        while len(detail_lines) < 3 and rnd.random() < 0.25:
+            detail_lines.append(rnd.choice(SYNTHETIC_DETAIL_CONTINUATIONS))
+
+        transactions.append((transaction_date, transaction_type, detail_lines, amount, paid_in, balance))
+
+    return transactions
+
+# One statement: first and last day of its month, opening balance in pence and transactions (see generate_statement_transactions)
+# The same statement number and seed always generate the same statement
+def generate_statement(statement_number: int, number_of_transactions: int, seed: int) -> tuple[date, date, int, list[tuple[date, str, list[str], int, bool, int]]]:
+    rnd = random.Random(seed * 1_000_003 + statement_number)
+
+    month = SYNTHETIC_FIRST_STATEMENT_DATE.month - 1 + statement_number
+    first_day = date(SYNTHETIC_FIRST_STATEMENT_DATE.year + month // 12, month % 12 + 1, 1)
+    last_day = date(first_day.year + (first_day.month == 12), first_day.month % 12 + 1, 1) - timedelta(days=1)
+
+    # Overdrawn at some point in about half of the statements, as in the statements of a current account
+    opening_balance = rnd.randint(-100_000, 500_000) + number_of_transactions * 20_000
+    return first_day, last_day, opening_balance, generate_statement_transactions(rnd, first_day, opening_balance, number_of_transactions)
+
+# Transactions of one statement as the converter should write them in the CSV files, without the header:
+# date, type, details (the detail lines joined), paid out, paid in, balance (only on the last transaction of the day, as printed)
+def get_statement_CSV_rows(statement_number: int, number_of_transactions: int, seed: int) -> list[list[str]]:
+    transactions = generate_statement(statement_number, number_of_transactions, seed)[3]
+
+    CSV_rows = []
+    for index, (transaction_date, transaction_type, detail_lines, amount, paid_in, balance) in enumerate(transactions):
+        balance_as_printed = ""
+        if index == len(transactions) - 1 or transactions[index + 1][0] != transaction_date:
+            balance_as_printed = format_statement_amount(abs(balance)) + (f" {converter.OVERDRAWN_BALANCE_SUFFIX}" if balance < 0 else "")
+
+        CSV_rows.append([f"{transaction_date:%d %b %y}", transaction_type, " ".join(detail_lines),
+                         "" if paid_in else format_statement_amount(amount), format_statement_amount(amount) if paid_in else "", balance_as_printed])
+
+    return CSV_rows
+
+# Text lines of the statement pages. Each line is a list of (x, text, right aligned)
+def generate_statement_pages(statement_number: int, number_of_transactions: int, rows_per_page: int, terms_pages: int, seed: int) -> list[list[list[tuple[float, str, bool]]]]:
+    first_day, last_day, opening_balance, transactions = generate_statement(statement_number, number_of_transactions, seed)
+    closing_balance = transactions[-1][5] if transactions else opening_balance
+
+    def get_page_header_lines(first_page: bool) -> list[list[tuple[float, str, bool]]]:
+        header_lines = [
+            [(COLUMN_DATE_X, "Your Statement", False)],
+            [(COLUMN_DATE_X, "MR JOHN SMITH", False)],
+            [(COLUMN_DATE_X, "Account Name", False), (COLUMN_TITLE_PAID_OUT_X, "Sortcode", False), (COLUMN_TITLE_BALANCE_X, "Account Number", False)],
+            [(COLUMN_DATE_X, "MR JOHN SMITH", False), (COLUMN_TITLE_PAID_OUT_X, SYNTHETIC_SORT_CODE, False), (COLUMN_TITLE_BALANCE_X, f"{SYNTHETIC_FIRST_ACCOUNT_NUMBER + seed:08d}", False)],
+            [(COLUMN_DATE_X, f"{first_day.day} {first_day:%B} to {last_day.day} {last_day:%B %Y}", False)],
+        ]
+        if first_page:
+            header_lines += [
+                [(COLUMN_DATE_X, "Opening Balance", False), *get_statement_balance_cells(opening_balance)],
+                [(COLUMN_DATE_X, "Closing Balance", False), *get_statement_balance_cells(closing_balance)],
+            ]
+        header_lines.append([
+            (COLUMN_DATE_X, "Date", False),
+            (COLUMN_TYPE_X, converter.COLUMN_TITLE_DETAILS, False),
+            (COLUMN_TITLE_PAID_OUT_X, converter.COLUMN_TITLE_PAID_OUT, False),
+            (COLUMN_TITLE_PAID_IN_X, converter.COLUMN_TITLE_PAID_IN, False),
+            (COLUMN_TITLE_BALANCE_X, converter.COLUMN_TITLE_BALANCE, False),
+        ])
+        return header_lines
+
+    pages = []
+    page_lines = get_page_header_lines(first_page=True)
+    page_lines.append([(COLUMN_DATE_X, f"{first_day:%d %b %y}", False), (COLUMN_TYPE_X, "BALANCE BROUGHT FORWARD", False),
+                       *get_statement_balance_cells(opening_balance)])
+    page_rows = 0
+    previous_date = None
+    # Balance after the last complete transaction, carried forward at the end of a page
+    page_balance = opening_balance
+
+    for index, (transaction_date, transaction_type, detail_lines, amount, paid_in, balance) in enumerate(transactions):
+        # As in the statements, the date is only shown on the first transaction of the day (of the page),
+        # the balance only on the last one of the day, and the amounts on the last line of the detail
+        first_line: list[tuple[float, str, bool]] = []
+        if transaction_date != previous_date:
+            first_line.append((COLUMN_DATE_X, f"{transaction_date:%d %b %y}", False))
+        previous_date = transaction_date
+        first_line += [(COLUMN_TYPE_X, transaction_type, False), (COLUMN_DETAILS_X, detail_lines[0], False)]
+
+        transaction_lines = [first_line] + [[(COLUMN_DETAILS_X, detail_line, False)] for detail_line in detail_lines[1:]]
+        transaction_lines[-1].append((COLUMN_PAID_IN_RIGHT_X if paid_in else COLUMN_PAID_OUT_RIGHT_X, format_statement_amount(amount), True))
+        if index == len(transactions) - 1 or transactions[index + 1][0] != transaction_date:
+            transaction_lines[-1].extend(get_statement_balance_cells(balance))
+
+        # A page can end within a transaction split over several lines, its amounts being on the next page
+        for transaction_line in transaction_lines:
+            if page_rows >= rows_per_page:
+                page_lines.append([(COLUMN_TYPE_X, "BALANCE CARRIED FORWARD", False), *get_statement_balance_cells(page_balance)])
+                pages.append(page_lines)
+                page_lines = get_page_header_lines(first_page=False)
+                page_lines.append([(COLUMN_TYPE_X, "BALANCE BROUGHT FORWARD", False), *get_statement_balance_cells(page_balance)])
+                page_rows = 0
+                previous_date = None
+
+            page_lines.append(transaction_line)
+            page_rows += 1
+
+        page_balance = balance
+
+    page_lines.append([(COLUMN_TYPE_X, "BALANCE CARRIED FORWARD", False), *get_statement_balance_cells(closing_balance)])
+    pages.append(page_lines)
+
+    # Pages without transactions at the end, as the terms and conditions of the statements
+    for _ in range(terms_pages):
+        pages.append([[(COLUMN_DATE_X, f"Financial Services Compensation Scheme information, line {line_number}", False)] for line_number in range(60)])
+
+    return pages
+
+# Write the pages as a PDF, with the standard Helvetica font so that no font needs embedding
+# With encoding_differences, the font has an encoding with differences, which the text extraction of the converter reads with the layout mode
+def write_statement_PDF(pages: list[list[list[tuple[float, str, bool]]]], PDF_filename: str, encoding_differences: bool = False) -> None:
+    PDF_objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # Pages, once their references are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding %s /FirstChar %d /LastChar %d /Widths [%s] >>"
+        % (HELVETICA_ENCODING_WITH_DIFFERENCES if encoding_differences else HELVETICA_ENCODING,
+           HELVETICA_FIRST_CHARACTER, HELVETICA_FIRST_CHARACTER + len(HELVETICA_WIDTHS) - 1, " ".join(map(str, HELVETICA_WIDTHS)).encode("ascii")),
+    ]
+    page_references = []
+
+    for page_lines in pages:
+        # One text object per cell, as the text extraction lays out the text of an object relative to its start
+        operators = []
+        for line_number, line in enumerate(page_lines):
+            y = PAGE_TOP - line_number * LINE_HEIGHT
+            for x, text, right_aligned in line:
+                if right_aligned:
+                    x -= get_text_width(text)
+                operators.append(f"BT /F1 {FONT_SIZE} Tf 1 0 0 1 {x:.2f} {y} Tm ({escape_PDF_string(text)}) Tj ET")
+
+        content = zlib.compress("\n".join(operators).encode("cp1252"))
+        PDF_objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(content), content))
+        PDF_objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+                           % (PAGE_WIDTH, PAGE_HEIGHT, len(PDF_objects)))
+        page_references.append(b"%d 0 R" % len(PDF_objects))
+
+    PDF_objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(page_references), len(page_references))
+
+    PDF_content = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for object_number, PDF_object in enumerate(PDF_objects, 1):
+        offsets.append(len(PDF_content))
+        PDF_content += b"%d 0 obj\n%s\nendobj\n" % (object_number, PDF_object)
+
+    cross_reference_offset = len(PDF_content)
+    PDF_content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(PDF_objects) + 1)
+    PDF_content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    PDF_content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(PDF_objects) + 1, cross_reference_offset)
+
+    with open(PDF_filename, "wb") as PDF_file:
+        PDF_file.write(PDF_content)
+
+# Generate statements (one per month from SYNTHETIC_FIRST_STATEMENT_DATE) in a folder, returning their file names
+# The same seed always generates the same statements
+def generate_synthetic_statements(output_folder: str, statements: int, transactions: int = 60, rows_per_page: int = 30, terms_pages: int = 2, seed: int = 0) -> list[str]:
+    os.makedirs(output_folder, exist_ok=True)
+
+    PDF_filenames = []
+    for statement_number in range(statements):
+        PDF_filename = os.path.join(output_folder, SYNTHETIC_STATEMENT_FILENAME.format(statement_number + 1))
+        write_statement_PDF(generate_statement_pages(statement_number, transactions, rows_per_page, terms_pages, seed), PDF_filename)
+        PDF_filenames.append(PDF_filename)
+
+    return PDF_filenames
+
+
+#####
+# Benchmark functions
+
+# Convert a number of synthetic statements in a temporary folder, returning the duration, throughput and time of each stage
+def benchmark_conversion(statements: int, transactions: int, workers: int, seed: int) -> dict:
+    previous_folder = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as benchmark_folder:
+        # The converted files are written relative to the current folder
+        os.chdir(benchmark_folder)
+        try:
+            generate_synthetic_statements("statements", statements, transactions, seed=seed)
+
+            start = time.perf_counter()
+            converter.convert(["statements"], formats=BENCHMARK_FORMATS, combine=True, workers=workers,
+                              use_cache=False, incremental=False, metrics_report="metrics.json")
+            duration = time.perf_counter() - start
+
+            with open("metrics.json", "r", encoding="utf-8") as metrics_file:
+                metrics_rows = json.load(metrics_file)["stages"]
+        finally:
+            os.chdir(previous_folder)
+
+    stages = {row["stage"]: row for row in metrics_rows if row["pdf"] == converter.STAGE_METRICS_ALL_PDF_FILES}
+    transactions_converted = stages["write csv"]["items"] if "write csv" in stages else 0
+
+    return {
+        "statements": statements,
+        "transactions_generated": statements * transactions,
+        "transactions_converted": transactions_converted,
+        "pages": stages["load"]["items"] if "load" in stages else 0,
+        "seconds": round(duration, 3),
+        "statements_per_second": round(statements / duration, 2),
+        "transactions_per_second": round(transactions_converted / duration, 1),
+        "stage_seconds": {stage: row["wall_seconds"] for stage, row in stages.items()},
+    }
+
+# Throughput lost compared to the baseline results of the same number of statements, as a fraction (negative if faster)
+def get_throughput_regression(result: dict, baseline_result: dict) -> float:
+    return 1 - result["transactions_per_second"] / baseline_result["transactions_per_second"]
+
+# Run the benchmark for each number of statements, comparing with the baseline if any
+# Returns the results and the numbers of statements whose throughput regressed beyond the threshold
+def run_benchmark(statement_counts: list[int], transactions: int, workers: int, seed: int, baseline: dict, threshold: float) -> tuple[dict[str, dict], list[str]]:
+    results: dict[str, dict] = {}
+    regressions: list[str] = []
+
+    # Imported by the first conversion otherwise, which would make the smallest benchmark look slow
+    import_module("pypdf")
+
+    print(f"{'Statements':>10} {'Pages':>7} {'Transactions':>12} {'Seconds':>9} {'Tx/s':>9} {'Baseline':>9} {'Change':>8}")
+    for statements in statement_counts:
+        result = benchmark_conversion(statements, transactions, workers, seed)
+        results[str(statements)] = result
+
+        baseline_result = baseline.get(str(statements))
+        if baseline_result:
+            regression = get_throughput_regression(result, baseline_result)
+            comparison = f"{baseline_result['transactions_per_second']:>9.1f} {-regression:>+8.1%}"
+            if regression > threshold:
+                regressions.append(str(statements))
+                comparison += "  REGRESSION"
+        else:
+            comparison = f"{'-':>9} {'-':>8}"
+
+        print(f"{statements:>10} {result['pages']:>7} {result['transactions_converted']:>12} {result['seconds']:>9.2f} {result['transactions_per_second']:>9.1f} {comparison}")
+        print("           " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stage_seconds"].items()))
+
+    return results, regressions
+
+# Results stored by --save-baseline, by number of statements. None stored yet: no comparison
+def load_benchmark_baseline(baseline_filename: str) -> dict[str, dict]:
+    try:
+        with open(baseline_filename, "r", encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)["results"]
+    except FileNotFoundError:
+        return {}
+
+def save_benchmark_baseline(baseline_filename: str, results: dict[str, dict], transactions: int, workers: int, seed: int) -> None:
+    with open(baseline_filename, "w", encoding="utf-8") as baseline_file:
+        json.dump({
+            "python": sys.version.split()[0],
+            "transactions_per_statement": transactions,
+            "workers": workers,
+            "seed": seed,
+            "results": results,
+        }, baseline_file, indent=1)
+
+
+#####
+# Command line
+def parse_command_line(argv: list[str] | None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate synthetic HSBC UK statement PDFs, and benchmark their conversion.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="generate synthetic statement PDFs in a folder")
+    generate.add_argument("output_folder", help="folder to write the PDFs to")
+    generate.add_argument("--statements", type=int, default=12, help="number of statements, one per month (default: %(default)s)")
+
+    benchmark = commands.add_parser("benchmark", help="time the conversion of synthetic statements, and compare with the baseline")
+    benchmark.add_argument("--sizes", type=int, nargs="+", default=list(BENCHMARK_STATEMENT_COUNTS), metavar="STATEMENTS",
+                           help="numbers of statements to convert, one benchmark each (default: %(default)s)")
+    benchmark.add_argument("--workers", type=int, default=1, help="number of processes converting the PDFs in parallel (default: %(default)s)")
+    benchmark.add_argument("--baseline", default=BENCHMARK_BASELINE_FILENAME, help="baseline results file (default: %(default)s)")
+    benchmark.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    benchmark.add_argument("--threshold", type=float, default=BENCHMARK_REGRESSION_THRESHOLD,
+                           help="fail if the transactions converted per second are this fraction below the baseline (default: %(default)s)")
+
+    for command in (generate, benchmark):
+        command.add_argument("--transactions", type=int, default=60, help="transactions per statement (default: %(default)s)")
+        command.add_argument("--seed", type=int, default=0, help="seed of the random statement content (default: %(default)s)")
+    generate.add_argument("--rows-per-page", type=int, default=30, help="transaction rows per page (default: %(default)s)")
+    generate.add_argument("--terms-pages", type=int, default=2, help="pages without transactions at the end of each statement (default: %(default)s)")
+
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_command_line(argv)
+
+    if args.command == "generate":
+        PDF_filenames = generate_synthetic_statements(args.output_folder, args.statements, args.transactions, args.rows_per_page, args.terms_pages, args.seed)
+        print(f"{len(PDF_filenames)} statements generated in {args.output_folder}")
+        return 0
+
+    baseline = load_benchmark_baseline(args.baseline)
+    results, regressions = run_benchmark(args.sizes, args.transactions, args.workers, args.seed, baseline, args.threshold)
+
+    if args.save_baseline:
+        save_benchmark_baseline(args.baseline, results, args.transactions, args.workers, args.seed)
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"Throughput regressed by more than {args.threshold:.0%} for {', '.join(regressions)} statements")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
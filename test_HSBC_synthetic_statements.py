@@ -0,0 +1,288 @@
+""" Tests of the conversion of synthetic HSBC UK Consumer Monthly Statement PDFs: the transactions converted are
+compared with the ones the statements were generated from, for each text extraction engine and line parser,
+and each way of selecting, converting and combining them"""
+
+__author__ = "Squizzy"
+__copyright__ = "Copyright 2024, Squizzy"
+__credits__ = ""
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Squizzy"
+
+import contextlib
+import csv
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+import HSBC_UK_Advance_Acct_Monthly_Statement_PDF_to_CSV_and_QIF as converter
+import HSBC_synthetic_statements_benchmark as generator
+
+#####
+# Constants
+
+# Statements generated, small enough for the tests to be quick but over several pages, some overdrawn
+TEST_STATEMENTS = 3
+TEST_TRANSACTIONS = 60
+TEST_ROWS_PER_PAGE = 30
+TEST_TERMS_PAGES = 1
+TEST_SEED = 0
+# Statements of another account, as the account number is generated from the seed
+TEST_OTHER_ACCOUNT_SEED = 1
+
+# Longest wait for the statements arriving in a watched folder to be converted, in seconds
+TEST_WATCH_TIMEOUT = 30
+
+# Switches of the converter set by the tests, restored after each test
+TEST_SWITCHES = ("line_parser_engine", "stream_conversion")
+
+
+#####
+# Test functions
+
+# Transactions of a CSV file generated by the converter, without the header
+def read_CSV_rows(CSV_filename: str) -> list[list[str]]:
+    with open(CSV_filename, "r", newline="") as CSV_file:
+        return list(csv.reader(CSV_file, delimiter="\t"))[1:]
+
+# Path of the CSV file generated for a PDF, from the base of its file name
+def get_CSV_filename(base_filename: str) -> str:
+    return os.path.join(converter.OUTPUT_FOLDER_CSV, base_filename + ".csv")
+
+# Transactions of all the test statements, in date order as in the combined files, without the header
+def get_test_statements_CSV_rows() -> list[list[str]]:
+    return [CSV_row for statement_number in range(TEST_STATEMENTS) for CSV_row in generator.get_statement_CSV_rows(statement_number, TEST_TRANSACTIONS, TEST_SEED)]
+
+# Write one synthetic statement, as generate_synthetic_statements but with any file name, and possibly a font encoding with differences
+def write_test_statement(statement_number: int, PDF_filename: str, encoding_differences: bool = False) -> None:
+    os.makedirs(os.path.dirname(PDF_filename) or ".", exist_ok=True)
+    generator.write_statement_PDF(generator.generate_statement_pages(statement_number, TEST_TRANSACTIONS, TEST_ROWS_PER_PAGE, TEST_TERMS_PAGES, TEST_SEED),
+                                  PDF_filename, encoding_differences)
+
+# Base of the file names of the CSV files of the test statements, as generated by generate_synthetic_statements
+def get_test_statements_base_filenames() -> list[str]:
+    return [os.path.splitext(generator.SYNTHETIC_STATEMENT_FILENAME.format(statement_number + 1))[0] for statement_number in range(TEST_STATEMENTS)]
+
+
+class SyntheticStatementsConversionTest(unittest.TestCase):
+    # Each test runs in its own temporary folder, as the converted files are written relative to the current folder
+    def setUp(self) -> None:
+        self.previous_folder = os.getcwd()
+        self.previous_switches = {name: getattr(converter, name) for name in TEST_SWITCHES}
+        self.test_folder = tempfile.TemporaryDirectory()
+        os.chdir(self.test_folder.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.previous_folder)
+        self.test_folder.cleanup()
+        for name, value in self.previous_switches.items():
+            setattr(converter, name, value)
+
+    # Generate the test statements in a new sub-folder of the test folder, returning it
+    def generate_statements(self, folder: str) -> str:
+        generator.generate_synthetic_statements(os.path.join(folder, "statements"), TEST_STATEMENTS, TEST_TRANSACTIONS, TEST_ROWS_PER_PAGE, TEST_TERMS_PAGES, TEST_SEED)
+        return folder
+
+    # Check the CSV file of each test statement, and the combined one if any, against the transactions generated
+    def assert_statements_converted(self, combined: bool = False) -> None:
+        for statement_number, base_filename in enumerate(get_test_statements_base_filenames()):
+            self.assertEqual(read_CSV_rows(get_CSV_filename(base_filename)),
+                             generator.get_statement_CSV_rows(statement_number, TEST_TRANSACTIONS, TEST_SEED), base_filename)
+
+        if combined:
+            # The statements are consecutive months of the same account: combined in date order, nothing left out
+            self.assertEqual(read_CSV_rows(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED)), get_test_statements_CSV_rows())
+
+    def test_statements_contain_the_cases_to_convert(self) -> None:
+        CSV_rows = get_test_statements_CSV_rows()
+
+        # A continuation line starting with the letters of a transaction type (VIS), not to be read as one
+        self.assertTrue(any("VISA RATE 1.1754" in CSV_row[2] for CSV_row in CSV_rows))
+        # Overdrawn balances, and days of several transactions whose balance is only on the last one
+        self.assertTrue(any(CSV_row[5].endswith(f" {converter.OVERDRAWN_BALANCE_SUFFIX}") for CSV_row in CSV_rows))
+        self.assertTrue(any(CSV_row[5] == "" for CSV_row in CSV_rows))
+
+    def test_each_text_engine_and_line_parser(self) -> None:
+        for text_engine in converter.TEXT_EXTRACTION_ENGINES:
+            for line_parser_engine in ("columns", "regex"):
+                for stream_conversion in (True, False):
+                    with self.subTest(text_engine=text_engine, line_parser_engine=line_parser_engine, stream_conversion=stream_conversion):
+                        converter.line_parser_engine = line_parser_engine
+                        converter.stream_conversion = stream_conversion
+                        os.chdir(self.generate_statements(f"{text_engine}_{line_parser_engine}_{stream_conversion}"))
+                        try:
+                            converter.convert(["statements"], formats=("csv",), use_cache=False, incremental=False, text_engine=text_engine)
+                            self.assert_statements_converted()
+                        finally:
+                            os.chdir(self.test_folder.name)
+
+    def test_fonts_not_readable_from_the_content_stream(self) -> None:
+        # Pages whose font encoding has differences: extracted with the layout mode whichever the engine, into the same transactions
+        for statement_number in range(TEST_STATEMENTS):
+            write_test_statement(statement_number, os.path.join("statements", generator.SYNTHETIC_STATEMENT_FILENAME.format(statement_number + 1)),
+                                 encoding_differences=True)
+
+        for text_engine in ("coordinates", "adaptive"):
+            with self.subTest(text_engine=text_engine):
+                converter.convert(["statements"], formats=("csv",), use_cache=False, incremental=False, text_engine=text_engine)
+                self.assert_statements_converted()
+                self.assertIn("Pages extracted with the layout mode, fonts not readable from the content stream", converter.conversion_statistics)
+                self.assertNotIn("Pages extracted from the coordinates, balances reconciled", converter.conversion_statistics)
+
+    def test_workers(self) -> None:
+        os.chdir(self.generate_statements("workers"))
+        converter.convert(["statements"], formats=("csv",), combine=True, workers=2, use_cache=False, incremental=False)
+        self.assert_statements_converted(combined=True)
+
+    def test_ledger(self) -> None:
+        os.chdir(self.generate_statements("ledger"))
+        converter.convert(["statements"], formats=("ledger",), use_cache=False, incremental=False)
+        self.assertEqual(len(converter.query_ledger()), TEST_STATEMENTS * TEST_TRANSACTIONS)
+
+        # Converting the statements again replaces their transactions instead of adding them twice
+        converter.convert(["statements"], formats=("ledger",), use_cache=False, incremental=False)
+        self.assertEqual(len(converter.query_ledger()), TEST_STATEMENTS * TEST_TRANSACTIONS)
+        self.assertEqual(len(converter.query_ledger(transaction_type="CR")), sum(CSV_row[1] == "CR" for CSV_row in get_test_statements_CSV_rows()))
+
+        # The files generated from the ledger, as the combined files of the statements
+        output_filenames = converter.export_ledger(formats=("csv", "qif"))
+        self.assertEqual(sorted(output_filenames), sorted([get_CSV_filename(converter.LEDGER_QUERY_BASE_FILENAME),
+                                                           os.path.join(converter.OUTPUT_FOLDER_QIF, converter.LEDGER_QUERY_BASE_FILENAME + ".qif")]))
+        self.assertEqual(read_CSV_rows(get_CSV_filename(converter.LEDGER_QUERY_BASE_FILENAME)), get_test_statements_CSV_rows())
+        with open(os.path.join(converter.OUTPUT_FOLDER_QIF, converter.LEDGER_QUERY_BASE_FILENAME + ".qif"), "r") as QIF_file:
+            self.assertEqual(sum(QIF_line.strip() == "^" for QIF_line in QIF_file), TEST_STATEMENTS * TEST_TRANSACTIONS)
+
+    def test_incremental_conversion(self) -> None:
+        os.chdir(self.generate_statements("incremental"))
+        converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False)
+
+        # Nothing converted again, but the combined files still include all the statements
+        os.remove(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED))
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False)
+        self.assertIn(f"{TEST_STATEMENTS} PDF files unchanged since their last conversion, 0 to convert", output.getvalue())
+        self.assert_statements_converted(combined=True)
+
+        # A setting changing the content of the files converts them all again
+        converter.line_parser_engine = "regex"
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False)
+        self.assertIn(f"0 PDF files unchanged since their last conversion, {TEST_STATEMENTS} to convert", output.getvalue())
+        self.assert_statements_converted(combined=True)
+
+    def test_page_text_cache(self) -> None:
+        os.chdir(self.generate_statements("cache"))
+        converter.convert(["statements"], formats=("csv",), incremental=False)
+        self.assertEqual(len(os.listdir(converter.PAGE_TEXT_CACHE_FOLDER)), TEST_STATEMENTS)
+
+        # The pages of the statements are not extracted again, and give the same transactions
+        for base_filename in get_test_statements_base_filenames():
+            os.remove(get_CSV_filename(base_filename))
+        converter.convert(["statements"], formats=("csv",), incremental=False)
+        self.assertFalse([name for name in converter.conversion_statistics if name.startswith("Pages extracted")])
+        self.assert_statements_converted()
+
+    def test_duplicate_transactions(self) -> None:
+        # Statements downloaded twice: their transactions are only once in the combined files, the others being reported
+        os.chdir(self.generate_statements("duplicates"))
+        shutil.copytree("statements", os.path.join("statements", "downloaded_again"))
+        converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False, incremental=False)
+
+        self.assertEqual(read_CSV_rows(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED)), get_test_statements_CSV_rows())
+        self.assertEqual(len(read_CSV_rows(converter.DUPLICATE_TRANSACTIONS_REPORT_FILENAME)), TEST_STATEMENTS * TEST_TRANSACTIONS)
+        self.assertEqual(converter.conversion_statistics["Duplicate transactions left out of the combined files"], TEST_STATEMENTS * TEST_TRANSACTIONS)
+
+        # Unless they are kept
+        converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False, incremental=False, keep_duplicates=True)
+        self.assertEqual(len(read_CSV_rows(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED))), 2 * TEST_STATEMENTS * TEST_TRANSACTIONS)
+
+    def test_combined_files_per_account(self) -> None:
+        os.chdir(self.generate_statements("accounts"))
+        generator.generate_synthetic_statements(os.path.join("statements", "other_account"), TEST_STATEMENTS, TEST_TRANSACTIONS, TEST_ROWS_PER_PAGE,
+                                                TEST_TERMS_PAGES, TEST_OTHER_ACCOUNT_SEED)
+        converter.convert(["statements"], formats=("csv",), combine=True, workers=2, use_cache=False, incremental=False, per_account=True)
+
+        # One combined file per account, with the transactions of its statements only
+        for seed in (TEST_SEED, TEST_OTHER_ACCOUNT_SEED):
+            account = converter.StatementMetadata(generator.SYNTHETIC_SORT_CODE, f"{generator.SYNTHETIC_FIRST_ACCOUNT_NUMBER + seed:08d}").account
+            combined_CSV_filename = os.path.join(converter.OUTPUT_FOLDER_CSV, converter.get_account_filename(converter.OUTPUT_FILENAME_CSV_COMBINED, account))
+            self.assertEqual(read_CSV_rows(combined_CSV_filename),
+                             [CSV_row for statement_number in range(TEST_STATEMENTS) for CSV_row in generator.get_statement_CSV_rows(statement_number, TEST_TRANSACTIONS, seed)])
+        self.assertFalse(os.path.exists(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED)))
+
+    def test_zip_archive(self) -> None:
+        # Statements in a zip archive of the folder selected, each converted into files named after the archive
+        os.chdir(self.generate_statements("archive"))
+        os.mkdir("archives")
+        with zipfile.ZipFile(os.path.join("archives", "Statements.zip"), "w") as archive:
+            for PDF_filename in sorted(os.listdir("statements")):
+                archive.write(os.path.join("statements", PDF_filename), PDF_filename)
+        converter.convert(["archives"], formats=("csv",), combine=True, use_cache=False, incremental=False)
+
+        for statement_number, base_filename in enumerate(get_test_statements_base_filenames()):
+            self.assertEqual(read_CSV_rows(get_CSV_filename(f"Statements_{base_filename}")),
+                             generator.get_statement_CSV_rows(statement_number, TEST_TRANSACTIONS, TEST_SEED))
+        self.assertEqual(read_CSV_rows(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED)), get_test_statements_CSV_rows())
+
+        # The archive selected itself: the files are named after the statements only
+        converter.convert([os.path.join("archives", "Statements.zip")], formats=("csv",), use_cache=False, incremental=False)
+        self.assert_statements_converted()
+
+    def test_watch(self) -> None:
+        # Statements arriving in the watched folder once it is watched are converted
+        stop_event = threading.Event()
+        watch_thread = threading.Thread(target=converter.watch, args=("statements",), kwargs={"combine": True, "stop_event": stop_event})
+        with contextlib.redirect_stdout(io.StringIO()):
+            watch_thread.start()
+            try:
+                self.generate_statements(".")
+                CSV_filenames = [get_CSV_filename(base_filename) for base_filename in get_test_statements_base_filenames()]
+                timeout = time.monotonic() + TEST_WATCH_TIMEOUT
+                while not all(map(os.path.exists, CSV_filenames)) and time.monotonic() < timeout:
+                    time.sleep(converter.WATCH_SETTLE_SECONDS)
+            finally:
+                stop_event.set()
+                watch_thread.join()
+
+        self.assert_statements_converted(combined=True)
+
+    def test_command_line(self) -> None:
+        os.chdir(self.generate_statements("command_line"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(converter.main(["statements", "--csv", "--combine", "--full", "--no-cache"]), 0)
+        self.assert_statements_converted(combined=True)
+
+        # The transactions streamed to the standard output, with one header
+        with contextlib.redirect_stdout(io.StringIO()) as output, contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(converter.main(["statements", "--stdout", "--no-cache"]), 0)
+        self.assertEqual(list(csv.reader(io.StringIO(output.getvalue()), delimiter="\t"))[1:], get_test_statements_CSV_rows())
+
+        # Options needing another one
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            converter.main(["statements", "--per-account"])
+
+    def test_PDFs_of_the_same_name(self) -> None:
+        # Statements of the same name in different folders, each converted into its own files named after its folder
+        write_test_statement(0, os.path.join("statements", "2023", "Statement.pdf"))
+        write_test_statement(1, os.path.join("statements", "2024", "Statement.pdf"))
+        converter.convert(["statements"], formats=("csv",), combine=True, use_cache=False, incremental=False, profiles_folder="profiles")
+
+        self.assertEqual(sorted(os.listdir("profiles")), ["2023_Statement" + converter.PROFILE_EXTENSION, "2024_Statement" + converter.PROFILE_EXTENSION])
+        self.assertEqual(read_CSV_rows(get_CSV_filename("2023_Statement")), generator.get_statement_CSV_rows(0, TEST_TRANSACTIONS, TEST_SEED))
+        self.assertEqual(read_CSV_rows(get_CSV_filename("2024_Statement")), generator.get_statement_CSV_rows(1, TEST_TRANSACTIONS, TEST_SEED))
+        self.assertEqual(read_CSV_rows(os.path.join(converter.OUTPUT_FOLDER_CSV, converter.OUTPUT_FILENAME_CSV_COMBINED)),
+                         generator.get_statement_CSV_rows(0, TEST_TRANSACTIONS, TEST_SEED) + generator.get_statement_CSV_rows(1, TEST_TRANSACTIONS, TEST_SEED))
+
+        # Selected one by one, their files would have the same name
+        with self.assertRaises(ValueError):
+            converter.convert([os.path.join("statements", "2023", "Statement.pdf"), os.path.join("statements", "2024", "Statement.pdf")],
+                              formats=("csv",), use_cache=False, incremental=False)
+
+
+if __name__ == "__main__":
+    unittest.main()